@@ -0,0 +1,130 @@
+"""
+This file is not part of the main application.
+It's a benchmark of the compact input encoding (options.compact_input, see
+prompt.format_input) against the default <p id="N"> tags, on a corpus text.
+Usage: python benchmark_input_encoding.py corpus.txt [-r reference.txt] [--translate]
+
+Paragraphs are the non-empty lines of the corpus. Token counts (input tokens of
+the whole corpus, per paragraph and the batches it takes) need no API key. With
+--translate a sample of the paragraphs is translated with both encodings, and
+each is scored by chrF against the reference translation (one line per corpus
+paragraph), or against the other encoding's translation without one.
+"""
+
+import argparse
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from models import Provider, TranslationServiceOptions
+from services.claude_provider import ClaudeProvider
+from services.openai_provider import OpenAIProvider
+from services.prompt import format_input, get_task_prompt
+from services.provider_factory import create_translation_provider
+from services.rate_limits import get_model_rate_limits
+from services.token_cache import count_tokens
+
+
+def read_paragraphs(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def chrf(hypothesis: str, reference: str, max_order: int = 6, beta: float = 2.0) -> float:
+    """Character n-gram F-score (chrF), 0 to 100"""
+    precisions = []
+    recalls = []
+    hypothesis = hypothesis.replace(" ", "")
+    reference = reference.replace(" ", "")
+    for order in range(1, max_order + 1):
+        hypothesis_ngrams = Counter(hypothesis[i:i + order] for i in range(len(hypothesis) - order + 1))
+        reference_ngrams = Counter(reference[i:i + order] for i in range(len(reference) - order + 1))
+        if not hypothesis_ngrams or not reference_ngrams:
+            continue
+        matches = sum((hypothesis_ngrams & reference_ngrams).values())
+        precisions.append(matches / sum(hypothesis_ngrams.values()))
+        recalls.append(matches / sum(reference_ngrams.values()))
+    if not precisions:
+        return 0.0
+    precision = sum(precisions) / len(precisions)
+    recall = sum(recalls) / len(recalls)
+    if not precision and not recall:
+        return 0.0
+    return 100 * (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+
+def make_options(provider: Provider, model: str, compact: bool) -> TranslationServiceOptions:
+    rate_limits = get_model_rate_limits(provider, model)
+    return TranslationServiceOptions(
+        provider=provider,
+        model=model,
+        temperature=0.2,
+        tpm_limit=rate_limits["tpm"],
+        rpm_limit=rate_limits["rpm"],
+        itpm_limit=rate_limits["itpm"],
+        otpm_limit=rate_limits["otpm"],
+        compact_input=compact,
+        use_response_cache=False,
+    )
+
+
+def count_encoding_tokens(args, paragraphs: list[str], compact: bool) -> dict:
+    options = make_options(args.provider, args.model, compact)
+    # Counting needs no API calls, the key is not used
+    provider_class = ClaudeProvider if args.provider == Provider.CLAUDE else OpenAIProvider
+    provider = provider_class(api_key="unused", options=options)
+    task_prompt = get_task_prompt(args.original_language, [], args.translate_language)
+    input_text = format_input(args.original_language, paragraphs, [], [], args.translate_language, compact=compact)
+    prompt_tokens = provider.calculate_input_tokens(task_prompt, [])
+    input_tokens = count_tokens(provider.encoding, input_text)
+    return {
+        "input_tokens": input_tokens,
+        "calculated_input_tokens": provider.calculate_input_tokens(task_prompt, paragraphs) - prompt_tokens,
+        "overhead_per_paragraph": (input_tokens - sum(count_tokens(provider.encoding, p) for p in paragraphs)) / len(paragraphs),
+        "batches": provider.estimate_num_batches(
+            task_prompt, paragraphs, None, args.original_language, args.translate_language
+        ),
+    }
+
+
+def translate(args, paragraphs: list[str], compact: bool) -> list[str]:
+    options = make_options(args.provider, args.model, compact)
+    provider = create_translation_provider(args.provider, options)
+    result = provider.translate_paragraphs(args.original_language, paragraphs, [], [], args.translate_language)
+    return result["translated_paragraphs"]
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Input encoding benchmark")
+    parser.add_argument("corpus", help="Text with one original paragraph per line")
+    parser.add_argument("-r", "--reference", help="Reference translation, one line per corpus paragraph")
+    parser.add_argument("-o", "--original_language", default="he", help="Language code of the corpus")
+    parser.add_argument("-t", "--translate_language", default="en", help="Language code to translate to")
+    parser.add_argument("-p", "--provider", type=Provider, default=Provider.OPENAI, help="Provider")
+    parser.add_argument("-m", "--model", default="gpt-4o", help="Model")
+    parser.add_argument("--translate", action="store_true", help="Also translate a sample with both encodings")
+    parser.add_argument("-n", "--sample", type=int, default=50, help="Paragraphs translated with --translate")
+    args = parser.parse_args()
+
+    paragraphs = read_paragraphs(args.corpus)
+    print(f"{len(paragraphs)} paragraphs, {args.provider.value} {args.model}")
+    print(f"{'encoding':<10} {'input tokens':>13} {'calculated':>11} {'overhead/paragraph':>19} {'batches':>8}")
+    for name, compact in (("tags", False), ("compact", True)):
+        counts = count_encoding_tokens(args, paragraphs, compact)
+        print(f"{name:<10} {counts['input_tokens']:>13} {counts['calculated_input_tokens']:>11} "
+              f"{counts['overhead_per_paragraph']:>19.2f} {counts['batches']:>8}")
+
+    if args.translate:
+        sample = paragraphs[:args.sample]
+        references = read_paragraphs(args.reference)[:args.sample] if args.reference else None
+        translations = {name: translate(args, sample, compact) for name, compact in (("tags", False), ("compact", True))}
+        if references is None:
+            scores = [chrf(compact, tags) for compact, tags in zip(translations["compact"], translations["tags"])]
+            print(f"chrF of compact against tags translations: {sum(scores) / len(scores):.2f}")
+        else:
+            for name, translated in translations.items():
+                scores = [chrf(translation, reference) for translation, reference in zip(translated, references)]
+                print(f"chrF of {name} against the reference: {sum(scores) / len(scores):.2f}")
+        for name, translated in translations.items():
+            print(f"{name}: {sum(1 for t in translated if t)} of {len(sample)} paragraphs translated")
@@ -0,0 +1,155 @@
+"""
+This file is not part of the main application.
+It's a benchmark of the JSON repair on malformed translation responses: the single
+pass repair_json (services/json_stream.py) against the regex repair it replaced.
+Usage: python benchmark_json_repair.py [response.txt ...]
+
+Without arguments it runs on generated responses of up to ~16k output tokens, built
+from the malformations seen in recorded responses (unescaped quotes, Hebrew
+gershayim, markdown fences, trailing commas). Pass files with recorded raw responses
+to benchmark those instead.
+"""
+
+import argparse
+import json
+import re
+import time
+
+from services.json_stream import repair_json
+
+# About 3 chars per output token for the mixed Hebrew/Cyrillic/Latin text below
+CHARS_PER_TOKEN = 3
+
+
+def regex_repair_json_quotes(json_text: str) -> str:
+    """The previous repair_json_quotes: escape quotes inside '": "...' matches of a DOTALL regex"""
+    try:
+        json.loads(json_text)
+        return json_text
+    except json.JSONDecodeError:
+        pass
+
+    def escape_quotes_in_match(match):
+        value = re.sub(r'(?<!\\)"', r'\"', match.group(2))
+        return f'{match.group(1)}{value}{match.group(3)}'
+
+    return re.sub(r'(": ")(.+?)(",|"[\n\s]*[}\]])', escape_quotes_in_match, json_text, flags=re.DOTALL)
+
+
+def paragraph_texts(index: int, kind: str) -> tuple[str, str, str]:
+    """Original, reference and translation of a paragraph, with unescaped quotes unless plain"""
+    if kind == "quotes":
+        return (
+            f'כתוב: "אין עוד מלבדו" {index}',
+            f'It is written: "There is none else besides Him." {index}',
+            f'Написано е: „Няма друг освен Него." Това означава, че няма друга сила. {index}',
+        )
+    if kind == "gershayim":
+        return (
+            f'אמר הרמב"ם ורש"י, שחז"ל כתבו "זוהר": "זוהר הרקיע" {index}',
+            f'Rambam and Rashi said that "Zohar": "the radiance of the sky" {index}',
+            f'Рамбам и Раши сказали, что мудрецы писали "Зоар": "сияние небосвода" {index}',
+        )
+    return f"שלום עולם {index}", f"Hello world {index}", f"Привет, мир {index}"
+
+
+def generated_response(
+    kind: str,
+    tokens: int,
+    fenced: bool = False,
+    trailing_commas: bool = False,
+    compact: bool = False,
+) -> tuple[str, list[str]]:
+    """Malformed response of about tokens output tokens, and its translations"""
+    objects = []
+    translations = []
+    size = 0
+    while size < tokens * CHARS_PER_TOKEN:
+        index = len(objects) + 1
+        original, reference, translation = paragraph_texts(index, kind if index % 3 else "plain")
+        if compact:
+            objects.append(
+                f'{{"id":{index},"original_paragraph":"{original}",'
+                f'"references":{{"English":"{reference}"}},"translation":"{translation}"}}'
+            )
+        else:
+            objects.append(
+                '    {\n'
+                f'      "id": {index},\n'
+                f'      "original_paragraph": "{original}",\n'
+                f'      "references": {{\n        "English": "{reference}"\n      }},\n'
+                f'      "translation": "{translation}"\n'
+                '    }'
+            )
+        translations.append(translation)
+        size += len(objects[-1])
+    if compact:
+        text = '{"paragraphs":[' + ",".join(objects) + (",]}" if trailing_commas else "]}")
+    else:
+        text = '{\n  "paragraphs": [\n' + ",\n".join(objects) + (",\n" if trailing_commas else "\n") + "  ]\n}"
+    if fenced:
+        text = f"```json\n{text}\n```"
+    return text, translations
+
+
+def generated_responses() -> dict[str, tuple[str, list[str] | None]]:
+    responses = {}
+    for tokens in (1000, 4000, 16000):
+        responses[f"quotes-{tokens}"] = generated_response("quotes", tokens)
+        responses[f"gershayim-{tokens}"] = generated_response("gershayim", tokens)
+        responses[f"fenced-trailing-commas-{tokens}"] = generated_response(
+            "gershayim", tokens, fenced=True, trailing_commas=True
+        )
+        responses[f"compact-{tokens}"] = generated_response("quotes", tokens, compact=True)
+    return responses
+
+
+def run(repair, text: str, translations: list[str] | None, repeat: int) -> tuple[float, bool]:
+    """
+    Best time of repeat runs, and whether the repair succeeded: the repaired text parses
+    and, when known, has the expected translations.
+    """
+    best = float("inf")
+    repaired = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            repaired = repair(text)
+        except ValueError:
+            repaired = None
+        best = min(best, time.perf_counter() - start)
+    try:
+        paragraphs = json.loads(repaired)["paragraphs"] if repaired is not None else []
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return best, False
+    if translations is None:
+        return best, bool(paragraphs)
+    return best, [para.get("translation") for para in paragraphs] == translations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON repair benchmark")
+    parser.add_argument("responses", nargs="*", help="Files with recorded raw responses")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs per response, the best is reported")
+    args = parser.parse_args()
+
+    if args.responses:
+        responses = {}
+        for path in args.responses:
+            with open(path, encoding="utf-8") as f:
+                responses[path] = (f.read(), None)
+    else:
+        responses = generated_responses()
+
+    print(f"{'response':<32} {'chars':>8} {'regex ms':>10} {'ok':>4} {'single pass ms':>15} {'ok':>4}")
+    successes = {"regex": 0, "single pass": 0}
+    for name, (text, translations) in responses.items():
+        regex_time, regex_ok = run(regex_repair_json_quotes, text, translations, args.repeat)
+        repair_time, repair_ok = run(repair_json, text, translations, args.repeat)
+        successes["regex"] += regex_ok
+        successes["single pass"] += repair_ok
+        print(f"{name:<32} {len(text):>8} {regex_time * 1000:>10.2f} {'yes' if regex_ok else 'no':>4} "
+              f"{repair_time * 1000:>15.2f} {'yes' if repair_ok else 'no':>4}")
+
+    for name, count in successes.items():
+        print(f"{name}: repaired {count} of {len(responses)} responses")
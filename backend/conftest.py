@@ -6,8 +6,27 @@ from testcontainers.postgres import PostgresContainer
 import peewee as pw
 from peewee_migrate import Router
 from fastapi.testclient import TestClient
-from models import Dictionaries, Rules, Sources, Segments
+from models import Dictionaries, Rules, Sources, Segments, SegmentsOrigins, TranslationCheckpoints, TranslationJobs
 from server import app, get_user_info
+from services import base_provider
+from services.rate_limiter import clear_rate_limiters
+from services.response_cache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limiters():
+    """Provider TPM windows are process-wide, start every test with empty ones"""
+    clear_rate_limiters()
+    yield
+    clear_rate_limiters()
+
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path, monkeypatch):
+    """Empty response cache per test, so responses faked by one test are not answered in another"""
+    cache = ResponseCache(str(tmp_path / "response-cache"), 16 * 1024 * 1024)
+    monkeypatch.setattr(base_provider, "response_cache", cache)
+    return cache
 
 
 @pytest.fixture(scope="function")
@@ -27,7 +46,7 @@ def test_db():
         )
 
         # Store original database references
-        models_to_rebind = [Dictionaries, Rules, Sources, Segments]
+        models_to_rebind = [Dictionaries, Rules, Sources, Segments, SegmentsOrigins, TranslationCheckpoints, TranslationJobs]
         original_databases = {model: model._meta.database for model in models_to_rebind}
 
         try:
@@ -82,5 +101,5 @@ def clean_tables(test_db):
     Fixture that truncates all tables before each test.
     """
     with test_db.atomic():
-        test_db.execute_sql("TRUNCATE dictionaries, rules, sources, segments RESTART IDENTITY CASCADE")
+        test_db.execute_sql("TRUNCATE dictionaries, rules, sources, segments, segments_origins, translation_checkpoints, translation_jobs RESTART IDENTITY CASCADE")
     yield
@@ -0,0 +1,33 @@
+"""
+Add translation_jobs table for background translations.
+Jobs are queued by POST /translate/jobs, claimed by worker threads and report
+progress (batches, tokens, partial results) while they run.
+"""
+
+def migrate(migrator, database, fake=False, **kwargs):
+    database.execute_sql("""
+        CREATE TABLE IF NOT EXISTS translation_jobs (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            status VARCHAR(32) NOT NULL DEFAULT 'queued',
+            request JSON NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL,
+            started_at TIMESTAMP NULL,
+            finished_at TIMESTAMP NULL,
+            total_paragraphs INTEGER NOT NULL DEFAULT 0,
+            translated_paragraphs INTEGER NOT NULL DEFAULT 0,
+            batches_done INTEGER NOT NULL DEFAULT 0,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            result JSON NULL,
+            error TEXT NULL
+        );
+    """)
+    # Workers pick the oldest queued job
+    database.execute_sql("CREATE INDEX IF NOT EXISTS translation_jobs_status ON translation_jobs (status, id);")
+    database.execute_sql("CREATE INDEX IF NOT EXISTS translation_jobs_username ON translation_jobs (username);")
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    database.execute_sql("DROP TABLE IF EXISTS translation_jobs CASCADE;")
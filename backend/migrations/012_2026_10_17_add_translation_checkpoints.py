@@ -0,0 +1,21 @@
+"""
+Add translation_checkpoints table.
+Sequential translations store their state after every finished batch, keyed by
+a hash of the request, so a retry of the same request resumes from the first
+unfinished batch instead of paying for the finished ones again.
+"""
+
+def migrate(migrator, database, fake=False, **kwargs):
+    database.execute_sql("""
+        CREATE TABLE IF NOT EXISTS translation_checkpoints (
+            key VARCHAR(64) PRIMARY KEY,
+            state JSON NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        );
+    """)
+    # Expired checkpoints are deleted by age
+    database.execute_sql("CREATE INDEX IF NOT EXISTS translation_checkpoints_updated_at ON translation_checkpoints (updated_at);")
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    database.execute_sql("DROP TABLE IF EXISTS translation_checkpoints CASCADE;")
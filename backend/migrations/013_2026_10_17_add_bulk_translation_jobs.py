@@ -0,0 +1,14 @@
+"""
+Add provider_batch_id and bulk_state to translation_jobs for bulk jobs.
+A bulk job submits all its batches to the provider's batch API, waits as
+'submitted' and is polled by the workers until the results are in.
+"""
+
+def migrate(migrator, database, fake=False, **kwargs):
+    database.execute_sql("ALTER TABLE translation_jobs ADD COLUMN IF NOT EXISTS provider_batch_id VARCHAR(255) NULL;")
+    database.execute_sql("ALTER TABLE translation_jobs ADD COLUMN IF NOT EXISTS bulk_state JSON NULL;")
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    database.execute_sql("ALTER TABLE translation_jobs DROP COLUMN IF EXISTS bulk_state;")
+    database.execute_sql("ALTER TABLE translation_jobs DROP COLUMN IF EXISTS provider_batch_id;")
@@ -0,0 +1,12 @@
+"""
+Index segments by md5(text) for the translation memory.
+Paragraphs of a translate request are looked up among the original segments by
+the hash of their text, and followed through segments_origins to their translations.
+"""
+
+def migrate(migrator, database, fake=False, **kwargs):
+    database.execute_sql("CREATE INDEX IF NOT EXISTS segments_text_md5 ON segments (md5(text));")
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    database.execute_sql("DROP INDEX IF EXISTS segments_text_md5;")
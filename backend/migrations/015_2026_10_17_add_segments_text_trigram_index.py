@@ -0,0 +1,18 @@
+"""
+Trigram index on segment text for fuzzy translation memory lookups.
+Only paragraph-sized segments are indexed, the rest of text segments of
+reference sources are too long to be useful and expensive to index.
+"""
+
+def migrate(migrator, database, fake=False, **kwargs):
+    database.execute_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    # Keep the length in sync with translation_memory.FUZZY_MAX_TEXT_LENGTH
+    database.execute_sql("""
+        CREATE INDEX IF NOT EXISTS segments_text_trgm ON segments
+        USING gin (text gin_trgm_ops)
+        WHERE length(text) <= 4000;
+    """)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    database.execute_sql("DROP INDEX IF EXISTS segments_text_trgm;")
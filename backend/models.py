@@ -118,6 +118,41 @@ class Rules(pw.Model):
         )
 
 
+class TranslationJobs(pw.Model):
+    id = pw.IntegerField(sequence='translation_jobs_id_seq')
+    username = pw.CharField()
+    status = pw.CharField(default='queued')  # queued, running, submitted (bulk), done, failed
+    request = JSONField()  # TranslationJobRequest
+    created_at = pw.DateTimeField(default=lambda: datetime.now(timezone.utc))
+    updated_at = pw.DateTimeField(default=lambda: datetime.now(timezone.utc))
+    started_at = pw.DateTimeField(null=True)
+    finished_at = pw.DateTimeField(null=True)
+    total_paragraphs = pw.IntegerField(default=0)
+    translated_paragraphs = pw.IntegerField(default=0)
+    batches_done = pw.IntegerField(default=0)
+    input_tokens = pw.IntegerField(default=0)
+    output_tokens = pw.IntegerField(default=0)
+    result = JSONField(null=True)  # Partial, then final, /translate response
+    error = pw.TextField(null=True)
+    provider_batch_id = pw.CharField(null=True)  # Batch API job of a bulk translation
+    bulk_state = JSONField(null=True)  # BulkTranslation, until its results are collected
+
+    class Meta:
+        database = db
+        table_name = 'translation_jobs'
+        primary_key = pw.CompositeKey('id')
+
+
+class TranslationCheckpoints(pw.Model):
+    key = pw.CharField(primary_key=True)  # Hash of the translation request
+    state = JSONField()  # TranslationCheckpoint
+    updated_at = pw.DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+    class Meta:
+        database = db
+        table_name = 'translation_checkpoints'
+
+
 # Server/HTTP API level definitions (not including database objects)
 # BaseModels used to define some requests responses which
 # are not regular Models - simple dicts are used for Models.
@@ -127,6 +162,11 @@ class Provider(str, Enum):
     OPENAI = "openai"
     CLAUDE = "claude"
 
+class OutputFormat(str, Enum):
+    JSON = "json"
+    # Id-delimited plain-text blocks, see services.tagged_output
+    TAGGED = "tagged"
+
 class TranslationServiceOptions(BaseModel):
     model: str = "gpt-4o"
     # model: str = "gpt-3.5-turbo"
@@ -135,6 +175,30 @@ class TranslationServiceOptions(BaseModel):
     # TPM (Tokens Per Minute) rate limit for the provider.
     # Set to 0 to disable TPM-based limiting (use only model context window).
     tpm_limit: int = 30000
+    # Per-minute limits on requests, input tokens and output tokens (0 disables each).
+    # The server fills all limits from services.rate_limits for the chosen model.
+    rpm_limit: int = 0
+    itpm_limit: int = 0
+    otpm_limit: int = 0
+    # Number of batches sent to the provider in parallel.
+    # 1 keeps sequential translation where each batch consumes the references.
+    max_concurrent_batches: int = 1
+    # Answer identical requests from the on-disk response cache (see services.response_cache).
+    use_response_cache: bool = True
+    # Align reference texts to the paragraphs by length up front (see services.reference_alignment),
+    # so each batch carries only the references of its paragraphs.
+    align_references: bool = True
+    # Enforce the response schema (OpenAI structured outputs, Claude tool use) instead
+    # of asking for JSON in the prompt and parsing the response leniently.
+    structured_output: bool = False
+    # Ask for responses without the echoed "original_paragraph" (see prompt.get_lean_task_prompt),
+    # the originals are filled in from the request.
+    lean_response: bool = False
+    # Send paragraphs as "N|text" lines instead of <p id="N"> tags (see prompt.format_input).
+    compact_input: bool = False
+    # Response format, None for the model's default ("output_format" in the provider's
+    # model list, JSON when not set).
+    output_format: OutputFormat | None = None
 
 class ParagraphsTranslateRequest(BaseModel):
     original_language: str
@@ -148,6 +212,41 @@ class ParagraphsTranslateRequest(BaseModel):
     provider: Provider | None = None
     # Optional: model to use (defaults based on provider)
     model: str | None = None
+    # Optional: number of batches translated in parallel (defaults to sequential)
+    max_concurrent_batches: int | None = None
+    # Fill paragraphs translated before (same text, languages and task prompt) from the
+    # stored segments instead of sending them (/translate and /translate/stream, without
+    # additional sources).
+    use_translation_memory: bool = True
+    # Set to False to send every batch to the provider even if an identical one was
+    # answered before (e.g. to get a fresh translation).
+    use_response_cache: bool = True
+    # Set to False to send reference windows proportional to each batch instead of
+    # the aligned reference spans.
+    align_references: bool = True
+    # Optional: have the provider enforce the response JSON schema (structured outputs
+    # on OpenAI models that support them, tool use on Claude).
+    structured_output: bool = False
+    # Optional: responses without the echoed original paragraphs, about half the output tokens.
+    lean_response: bool = False
+    # Optional: number paragraphs instead of tagging them, fewer input tokens per paragraph.
+    compact_input: bool = False
+    # Optional: response format, defaults to the model's (see TranslationServiceOptions).
+    output_format: OutputFormat | None = None
+
+class TranslationJobRequest(ParagraphsTranslateRequest):
+    # Optional: when set the job stores finished segments itself, batch by batch,
+    # the same way the frontend does after /translate.
+    translated_source_id: int | None = None
+    # Saved segment of each paragraph ({id, timestamp, order}), for order and origin links.
+    original_segments: List[dict] = []
+    # Current rest_of_text segment of each additional source ({id, timestamp, source_id, properties}).
+    additional_sources_segments: List[dict] = []
+    # Extra properties stored on new segments (e.g. dictionary_id, dictionary_timestamp).
+    segment_properties: dict = {}
+    # Optional: send all batches through the provider's batch API, at about half the
+    # cost and outside the interactive rate limits, but results may take up to 24 hours.
+    bulk: bool = False
 
 class CostEstimateRequest(BaseModel):
     original_language: str
@@ -164,6 +263,22 @@ class CostEstimateRequest(BaseModel):
     # Optional: dictionary to use for prompt
     dictionary_id: int | None = None
     dictionary_timestamp: int | None = None
+    # Optional: estimate a bulk job (batch API prices)
+    bulk: bool = False
+    # Optional: estimate lean responses and compact input (see ParagraphsTranslateRequest)
+    lean_response: bool = False
+    compact_input: bool = False
+    output_format: OutputFormat | None = None
+
+class SimilarTranslationsRequest(BaseModel):
+    original_language: str
+    translate_language: str
+    # Paragraphs to find earlier translations of similar paragraphs for
+    texts: List[str]
+    # Maximum matches per text
+    limit: int = 5
+    # Lowest trigram similarity (0 to 1) returned
+    min_similarity: float = 0.5
 
 class PromptRequest(BaseModel):
     dictionary_id: int | None = None
@@ -1,8 +1,10 @@
+import asyncio
 from datetime import datetime, timezone
 from db import db
 from docx import Document
 from dotenv import load_dotenv
 from keycloak import KeycloakOpenID
+import json
 import logging
 import os
 import traceback
@@ -27,14 +29,23 @@ from fastapi import (
     UploadFile,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
-from services.translation_service import get_provider_lock
 from services.provider_factory import create_translation_provider
+from services.client_pool import close_clients
 from services.openai_provider import OPENAI_MODELS, PROVIDER_NAME as OPENAI_NAME, PROVIDER_LABEL as OPENAI_LABEL
 from services.claude_provider import CLAUDE_MODELS, PROVIDER_NAME as CLAUDE_NAME, PROVIDER_LABEL as CLAUDE_LABEL
 from services.prompt_helper import get_task_prompt_for_translation
 from services.cost_calculator import calculate_cost
+from services.token_cache import get_token_cache_stats
+from services.base_provider import get_truncation_stats
+from services.checkpoint_service import translation_checkpoints
+from services.output_calibration import output_calibrator
+from services.rate_limiter import get_rate_limiter_stats
+from services.rate_limits import get_model_rate_limits
+from services.response_cache import response_cache
+from services.job_service import TranslationJobWorkers, create_job, get_job
+from services.translation_memory import find_similar_translations, lookup_translations
 from services.segment_service import get_paragraphs_from_file, get_latest_segments, store_segments
 from services.source_service import (
     create_or_update_sources,
@@ -68,8 +79,10 @@ from models import (
     Rules,
     Segments,
     SegmentsOrigins,
+    SimilarTranslationsRequest,
     Sources,
     SourcesOrigins,
+    TranslationJobRequest,
     TranslationServiceOptions,
 )
 
@@ -96,6 +109,13 @@ def required(param, error_message: str):
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Default number of batches translated in parallel when the request does not set it
+MAX_CONCURRENT_BATCHES = int(os.getenv("MAX_CONCURRENT_BATCHES", "1"))
+# Number of background threads running queued translation jobs (0 disables them)
+TRANSLATION_JOB_WORKERS = int(os.getenv("TRANSLATION_JOB_WORKERS", "2"))
+# Bounds of a /translation-memory/similar request (one query per text)
+MAX_SIMILAR_TRANSLATIONS_TEXTS = 200
+MAX_SIMILAR_TRANSLATIONS_LIMIT = 50
 
 app = FastAPI()
 
@@ -149,8 +169,19 @@ def startup():
 
     logger.info('Database connected and migrations applied')
 
+    if TRANSLATION_JOB_WORKERS > 0:
+        app.state.job_workers = TranslationJobWorkers(TRANSLATION_JOB_WORKERS, create_provider_for_request)
+        app.state.job_workers.start()
+
 @app.on_event('shutdown')
 def shutdown():
+    job_workers = getattr(app.state, 'job_workers', None)
+    if job_workers:
+        job_workers.stop()
+        app.state.job_workers = None
+
+    close_clients()
+
     if not db.is_closed():
         db.close()
     logger.info('Database connection closed')
@@ -416,59 +447,134 @@ def get_providers_handler():
         logger.error("Error getting providers: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get providers: {str(e)}")
 
+
+@app.get("/token-cache", response_model=dict)
+def get_token_cache_handler():
+    """
+    Get hit/miss counters of the shared token-count cache.
+    """
+    return get_token_cache_stats()
+
+@app.get("/translation-stats", response_model=dict)
+def get_translation_stats_handler():
+    """
+    Get counters of truncated batches that were split and retried automatically,
+    the output token ratios calibrated from real usage, and the rate limit window usage
+    and waits of each model, and the hits of the provider response cache.
+    """
+    return {
+        "truncation": get_truncation_stats(),
+        "output_calibration": output_calibrator.stats(),
+        "rate_limits": get_rate_limiter_stats(),
+        "response_cache": response_cache.stats(),
+    }
+
+def create_provider_for_request(request: ParagraphsTranslateRequest):
+    """
+    Validate a translate request and create its provider.
+
+    Returns:
+        Tuple of (TranslationServiceOptions, translation provider)
+    """
+    required(request.paragraphs, "No paragraphs provided.")
+    required(request.original_language, "Missing original_language in request.")
+    required(request.translate_language, "Missing translate_language in request.")
+
+    if request.additional_sources_languages and (not request.additional_sources_texts or len(request.additional_sources_texts) != len(request.additional_sources_languages)):
+        raise HTTPException(status_code=400, detail="len(additional_sources_texts) should match len(additional_sources_languages).")
+
+    # Determine provider and model (defaults for backward compatibility)
+    provider = request.provider if request.provider else Provider.OPENAI
+
+    # Set default model based on provider if not specified
+    if request.model:
+        model = request.model
+    else:
+        # Default models per provider
+        if provider == Provider.CLAUDE:
+            model = "claude-sonnet-4-5-20250929"
+        else:
+            model = "gpt-4o"
+
+    rate_limits = get_model_rate_limits(provider, model)
+    options = TranslationServiceOptions(
+        provider=provider,
+        model=model,
+        temperature=0.2,
+        tpm_limit=rate_limits["tpm"],
+        rpm_limit=rate_limits["rpm"],
+        itpm_limit=rate_limits["itpm"],
+        otpm_limit=rate_limits["otpm"],
+        max_concurrent_batches=request.max_concurrent_batches or MAX_CONCURRENT_BATCHES,
+        use_response_cache=request.use_response_cache,
+        align_references=request.align_references,
+        structured_output=request.structured_output,
+        lean_response=request.lean_response,
+        compact_input=request.compact_input,
+        output_format=request.output_format,
+    )
+
+    # Create provider instance using factory
+    return options, create_translation_provider(provider, options)
+
+
+def find_translated_paragraphs(request: ParagraphsTranslateRequest, task_prompt: str) -> dict[str, str]:
+    """
+    Translation memory hits of a translate request, by paragraph text.
+
+    Empty when the request disables the memory or has additional sources: their
+    references are consumed in paragraph order and cannot skip paragraphs.
+    """
+    if not request.use_translation_memory or request.additional_sources_languages:
+        return {}
+    try:
+        return lookup_translations(request.paragraphs, request.original_language, request.translate_language, task_prompt)
+    except Exception as e:
+        # The memory only saves tokens, translate everything rather than fail
+        logger.warning("Translation memory lookup failed, translating all paragraphs: %s", e)
+        return {}
+
+
 @app.post("/translate", response_model=dict)
-def translate_paragraphs_handler(
+async def translate_paragraphs_handler(
     request: ParagraphsTranslateRequest,
     user_info: dict = Depends(get_user_info)
 ):
     try:
         start_time = datetime.now(timezone.utc)
 
-        required(request.paragraphs, "No paragraphs provided.")
-        required(request.original_language, "Missing original_language in request.")
-        required(request.translate_language, "Missing translate_language in request.")
-
-        if request.additional_sources_languages and (not request.additional_sources_texts or len(request.additional_sources_texts) != len(request.additional_sources_languages)):
-            raise HTTPException(status_code=400, detail="len(additional_sources_texts) should match len(additional_sources_languages).")
-
-        # Determine provider and model (defaults for backward compatibility)
-        provider = request.provider if request.provider else Provider.OPENAI
-
-        # Set default model based on provider if not specified
-        if request.model:
-            model = request.model
-        else:
-            # Default models per provider
-            if provider == Provider.CLAUDE:
-                model = "claude-sonnet-4-5-20250929"
-            else:
-                model = "gpt-4o"
-
-        options = TranslationServiceOptions(
-            provider=provider,
-            model=model,
-            temperature=0.2,
-            tpm_limit=30000
+        options, translation_service = create_provider_for_request(request)
+        task_prompt = get_task_prompt_for_translation(
+            request.task_prompt, None, None,
+            request.original_language, request.additional_sources_languages, request.translate_language,
         )
 
-        # Create provider instance using factory
-        translation_service = create_translation_provider(provider, options)
+        # Paragraphs translated before are filled in from the translation memory, only the others are sent
+        memory = await asyncio.to_thread(find_translated_paragraphs, request, task_prompt)
+        missing = [i for i, paragraph in enumerate(request.paragraphs) if paragraph not in memory]
 
-        # Acquire provider lock to prevent concurrent translations that would exceed TPM limit
-        provider_lock = get_provider_lock(options.provider.value)
-
-        logger.info(f"User {user_info['preferred_username']} waiting for {options.provider.value} translation lock...")
-        with provider_lock:
-            logger.info(f"User {user_info['preferred_username']} acquired {options.provider.value} translation lock")
-            result = translation_service.translate_paragraphs(
+        if missing:
+            result = await translation_service.atranslate_paragraphs(
                 original_language=request.original_language,
-                paragraphs=request.paragraphs,
+                paragraphs=[request.paragraphs[i] for i in missing],
                 additional_sources_languages=request.additional_sources_languages,
                 additional_sources_texts=request.additional_sources_texts,
                 translate_language=request.translate_language,
-                task_prompt=request.task_prompt,
+                task_prompt=task_prompt,
+                checkpoint_store=translation_checkpoints,
             )
-            logger.info(f"User {user_info['preferred_username']} released {options.provider.value} translation lock")
+        else:
+            result = {
+                "translated_paragraphs": [],
+                "references_by_language": {},
+                "remaining_additional_sources_texts": [],
+                "properties": translation_service.get_result_properties(task_prompt=task_prompt),
+            }
+
+        translated_paragraphs = [memory.get(paragraph) for paragraph in request.paragraphs]
+        for i, translation in zip(missing, result["translated_paragraphs"]):
+            translated_paragraphs[i] = translation
+        properties = {**result["properties"], "translation_memory_hits": len(request.paragraphs) - len(missing)}
 
         # Convert references_by_language dict to additional_sources_paragraphs list for backward compatibility
         # The order must match additional_sources_languages
@@ -483,11 +589,11 @@ def translate_paragraphs_handler(
         logger.info("Total translation time: %.2f seconds for %d paragraphs", total_duration, len(request.paragraphs))
 
         return {
-            "translated_paragraphs": result["translated_paragraphs"],
+            "translated_paragraphs": translated_paragraphs,
             "additional_sources_paragraphs": additional_sources_paragraphs,
             "remaining_additional_sources_texts": result["remaining_additional_sources_texts"],
-            "properties": result["properties"],
-            "total_segments_translated": len(result["translated_paragraphs"]),
+            "properties": properties,
+            "total_segments_translated": len(translated_paragraphs),
             "translation_time_seconds": total_duration
         }
 
@@ -497,6 +603,176 @@ def translate_paragraphs_handler(
         raise HTTPException(status_code=500, detail=f"Translation failed: {str(e)}")
 
 
+@app.post("/translate/stream")
+async def translate_paragraphs_stream_handler(
+    request: ParagraphsTranslateRequest,
+    user_info: dict = Depends(get_user_info)
+):
+    """
+    Streaming variant of /translate.
+
+    Responds with newline-delimited JSON, one line per translated paragraph as soon
+    as the model produces it (paragraphs from the translation memory first):
+        {"type": "paragraph", "index": int, "translated_paragraph": str, "additional_sources_paragraphs": [str]}
+    followed by a final line:
+        {"type": "done", "remaining_additional_sources_texts": [str], "properties": dict, ...}
+    or, if translation fails midway, {"type": "error", "detail": str}.
+    """
+    try:
+        options, translation_service = create_provider_for_request(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in translation stream handler: %s", e)
+        raise HTTPException(status_code=500, detail=f"Translation failed: {str(e)}")
+
+    lang_names = [LANGUAGES.get(lang_code, lang_code) for lang_code in request.additional_sources_languages]
+
+    async def events():
+        start_time = datetime.now(timezone.utc)
+        total_segments_translated = 0
+        try:
+            task_prompt = get_task_prompt_for_translation(
+                request.task_prompt, None, None,
+                request.original_language, request.additional_sources_languages, request.translate_language,
+            )
+            # Paragraphs from the translation memory come first, the others as the model translates them
+            memory = await asyncio.to_thread(find_translated_paragraphs, request, task_prompt)
+            missing = [i for i, paragraph in enumerate(request.paragraphs) if paragraph not in memory]
+            for index, paragraph in enumerate(request.paragraphs):
+                if paragraph in memory:
+                    total_segments_translated += 1
+                    line = {
+                        "type": "paragraph",
+                        "index": index,
+                        "translated_paragraph": memory[paragraph],
+                        "additional_sources_paragraphs": [],
+                    }
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+
+            remaining_additional_sources_texts = []
+            if missing:
+                # Tokenizing whole books is CPU bound, keep it off the event loop
+                progress = await asyncio.to_thread(
+                    translation_service.start_translation,
+                    request.original_language,
+                    [request.paragraphs[i] for i in missing],
+                    request.additional_sources_languages,
+                    request.additional_sources_texts,
+                    request.translate_language,
+                    task_prompt,
+                    translation_checkpoints,
+                )
+                async for event in translation_service.aiter_translation(progress, stream=True):
+                    if event["type"] != "paragraph":
+                        remaining_additional_sources_texts = event["remaining_additional_sources_texts"]
+                        continue
+                    total_segments_translated += 1
+                    line = {
+                        "type": "paragraph",
+                        "index": missing[event["index"]],
+                        "translated_paragraph": event["translation"],
+                        # Order matches additional_sources_languages, as in /translate
+                        "additional_sources_paragraphs": [event["references"].get(name, "") for name in lang_names],
+                    }
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+
+            total_duration = (datetime.now(timezone.utc) - start_time).total_seconds()
+            line = {
+                "type": "done",
+                "remaining_additional_sources_texts": remaining_additional_sources_texts,
+                "properties": {
+                    **translation_service.get_result_properties(task_prompt=task_prompt),
+                    "translation_memory_hits": len(request.paragraphs) - len(missing),
+                },
+                "total_segments_translated": total_segments_translated,
+                "translation_time_seconds": total_duration,
+            }
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+        except Exception as e:
+            logger.error("Error in translation stream: %s", e)
+            logger.error(traceback.format_exc())
+            yield json.dumps({"type": "error", "detail": f"Translation failed: {str(e)}"}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/translation-memory/similar", response_model=list)
+def similar_translations_handler(
+    request: SimilarTranslationsRequest,
+    user_info: dict = Depends(get_user_info)
+):
+    """
+    Earlier translations of paragraphs similar to each of texts, most similar first.
+
+    Returns one list of matches ({original_text, translation, similarity, ...}) per text.
+    """
+    if len(request.texts) > MAX_SIMILAR_TRANSLATIONS_TEXTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SIMILAR_TRANSLATIONS_TEXTS} texts per request.")
+    if not 1 <= request.limit <= MAX_SIMILAR_TRANSLATIONS_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit should be between 1 and {MAX_SIMILAR_TRANSLATIONS_LIMIT}.")
+    if not 0 < request.min_similarity <= 1:
+        raise HTTPException(status_code=400, detail="min_similarity should be above 0 and at most 1.")
+    try:
+        return find_similar_translations(
+            request.texts,
+            request.original_language,
+            request.translate_language,
+            limit=request.limit,
+            min_similarity=request.min_similarity,
+        )
+    except Exception as e:
+        logger.error("Error finding similar translations: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to find similar translations: {str(e)}")
+
+
+@app.post("/translate/jobs", response_model=dict)
+def create_translation_job_handler(
+    request: TranslationJobRequest,
+    user_info: dict = Depends(get_user_info)
+):
+    """
+    Queue a translation to run in the background, poll GET /translate/jobs/{job_id} for progress.
+
+    If translated_source_id is set, every translated batch is stored as segments of that
+    source (with references and origin links) as soon as it is done. This needs
+    original_segments ({id, timestamp, order} per paragraph) and additional_sources_segments
+    ({source_id, properties} per additional source).
+
+    With bulk set, the batches go through the provider's batch API: the job stays
+    "submitted" (up to 24 hours) and stores all segments once the results are in.
+    """
+    # Fail fast on invalid requests and missing API keys
+    create_provider_for_request(request)
+
+    if request.translated_source_id is not None:
+        if len(request.original_segments) != len(request.paragraphs):
+            raise HTTPException(status_code=400, detail="len(original_segments) should match len(paragraphs).")
+        if len(request.additional_sources_segments) != len(request.additional_sources_languages):
+            raise HTTPException(status_code=400, detail="len(additional_sources_segments) should match len(additional_sources_languages).")
+
+    try:
+        job = create_job(request, user_info['preferred_username'])
+    except Exception as e:
+        logger.error("Error creating translation job: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to create translation job: {str(e)}")
+
+    job_workers = getattr(app.state, 'job_workers', None)
+    if job_workers:
+        job_workers.notify()
+    return job
+
+
+@app.get("/translate/jobs/{job_id}", response_model=dict)
+def get_translation_job_handler(job_id: int, user_info: dict = Depends(get_user_info)):
+    """Status, progress (batches, paragraphs, tokens) and partial result of a translation job"""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Translation job {job_id} not found")
+    return job
+
+
 @app.post("/estimate-cost", response_model=dict)
 def estimate_cost_handler(
     request: CostEstimateRequest,
@@ -512,6 +788,9 @@ def estimate_cost_handler(
         {
             "input_tokens": int,
             "output_tokens": int,
+            "cached_input_tokens": int,
+            "cache_write_tokens": int,
+            "estimated_batches": int,
             "input_cost": float,
             "output_cost": float,
             "total_cost": float,
@@ -552,11 +831,18 @@ def estimate_cost_handler(
         )
 
         # Create provider instance for token calculation (no API calls, no locking needed)
+        rate_limits = get_model_rate_limits(provider, model)
         options = TranslationServiceOptions(
             provider=provider,
             model=model,
             temperature=0.2,
-            tpm_limit=30000
+            tpm_limit=rate_limits["tpm"],
+            rpm_limit=rate_limits["rpm"],
+            itpm_limit=rate_limits["itpm"],
+            otpm_limit=rate_limits["otpm"],
+            lean_response=request.lean_response,
+            compact_input=request.compact_input,
+            output_format=request.output_format,
         )
         provider_instance = create_translation_provider(provider, options)
 
@@ -571,11 +857,28 @@ def estimate_cost_handler(
         num_references = len(request.additional_sources_languages) if request.additional_sources_languages else 0
         output_tokens = provider_instance.estimate_output_tokens(
             request.paragraphs,
-            num_references
+            num_references,
+            request.original_language,
+            request.translate_language,
+        )
+
+        # Every batch resends the task prompt, all but the first read it from the prompt cache
+        num_batches = provider_instance.estimate_num_batches(
+            task_prompt,
+            request.paragraphs,
+            request.additional_sources_texts if request.additional_sources_texts else None,
+            request.original_language,
+            request.translate_language,
         )
+        prompt_tokens = provider_instance.calculate_input_tokens(task_prompt, [], None)
+        input_tokens += prompt_tokens * max(num_batches - 1, 0)
+        cached_input_tokens, cache_write_tokens = provider_instance.estimate_prompt_cache_tokens(prompt_tokens, num_batches)
 
         # Calculate cost using centralized helper
-        cost_info = calculate_cost(input_tokens, output_tokens, provider, model)
+        cost_info = calculate_cost(
+            input_tokens, output_tokens, provider, model, cached_input_tokens, cache_write_tokens, bulk=request.bulk
+        )
+        cost_info["estimated_batches"] = num_batches
 
         # Add provider and model info to response
         cost_info["provider"] = provider.value
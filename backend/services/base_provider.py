@@ -1,10 +1,33 @@
 from abc import ABC, abstractmethod
-from typing import TypedDict
+import asyncio
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Iterator, TypedDict
+import hashlib
 import json
 import logging
 import re
-from models import TranslationServiceOptions
-from services.prompt import get_task_prompt, format_input, LANGUAGES
+import threading
+from models import OutputFormat, TranslationServiceOptions
+from services.json_stream import ParagraphStreamParser, repair_json
+from services.tagged_output import TaggedStreamParser
+from services.output_calibration import output_calibrator
+from services.rate_limiter import RateLimits, Reservation, SlidingWindowLimiter, get_rate_limiter
+from services.response_cache import response_cache, response_cache_key
+from services.prompt import (
+    get_compact_task_prompt,
+    get_input_paragraphs,
+    get_input_reference_languages,
+    get_lean_task_prompt,
+    get_tagged_task_prompt,
+    get_prompt_hash,
+    get_task_prompt,
+    format_input,
+    LANGUAGES,
+)
+from services.reference_alignment import align_reference
+from services.token_cache import count_tokens, token_offsets
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +37,22 @@ OTHER_LANG_TEXT_MULTIPLIER = 1.5
 # Safety margin for token limits to avoid hitting exact limits (90%)
 SAFETY_MARGIN = 0.9
 
+# Tag wrapped around each paragraph in the input (see format_input).
+# Paragraphs are counted separately plus this tag, with a wide id to stay conservative.
+PARAGRAPH_TAG = '    <p id="00000"></p>\n'
+
+# Number before each paragraph of compact input (options.compact_input)
+COMPACT_PARAGRAPH_TAG = "00000|\n"
+
+# Concurrent batches start their reference slices earlier than estimated by this
+# fraction of the batch's expected reference length, so drift does not cut them off
+REFERENCE_SLICE_OVERLAP = 0.1
+
+# Usage of the last response received in the current thread or task (see record_usage)
+_response_usage: ContextVar[dict | None] = ContextVar("response_usage", default=None)
+# Whether the last response in the current thread or task came from the response cache
+_response_cached: ContextVar[bool] = ContextVar("response_cached", default=False)
+
 
 def strip_markdown_json_fences(text: str) -> str:
     """
@@ -46,12 +85,9 @@ def repair_json_quotes(json_text: str) -> str:
     Fix unescaped quotes in JSON string values.
 
     LLMs sometimes generate text with unescaped quotes inside JSON strings,
-    causing parsing errors. This function attempts to repair such issues.
-
-    Strategy:
-    - Find all string values between "key": "value" patterns
-    - Escape any unescaped quotes within the value
-    - Preserve already-escaped quotes (\\")
+    causing parsing errors. The text is repaired in a single pass by the
+    tolerant stream parser (see repair_json), which also drops markdown
+    fences and trailing commas.
 
     Args:
         json_text: JSON text that may contain unescaped quotes
@@ -66,41 +102,76 @@ def repair_json_quotes(json_text: str) -> str:
     except json.JSONDecodeError:
         pass  # Continue with repair
 
-    # Strategy: Replace unescaped quotes with escaped quotes in string values
-    # We need to be careful not to escape quotes that are part of JSON structure
-    # Pattern: Find content between ": " and one of: , } ] \n
-
-    def escape_quotes_in_match(match):
-        """Escape unescaped quotes within a JSON string value"""
-        prefix = match.group(1)  # The ": " part
-        value = match.group(2)    # The string content
-        suffix = match.group(3)   # The ending (comma, brace, bracket, etc.)
-
-        # Escape any unescaped quotes in the value
-        # Replace " with \" but don't replace already-escaped \"
-        repaired_value = re.sub(r'(?<!\\)"', r'\"', value)
-
-        return f'{prefix}{repaired_value}{suffix}'
-
-    # Pattern explanation:
-    # (": ")          - Key-value separator (group 1)
-    # (.*?)           - String content, non-greedy (group 2)
-    # (",|"[\n\s]*[}\]])  - Ending: quote+comma OR quote+newline/space+closing brace/bracket (group 3)
-    pattern = r'(": ")(.+?)(",|"[\n\s]*[}\]])'
-
-    repaired = re.sub(pattern, escape_quotes_in_match, json_text, flags=re.DOTALL)
-
+    repaired = repair_json(json_text)
     logger.debug("Applied JSON quote repair")
     return repaired
 
 
 class TranslatedParagraph(TypedDict):
     id: int
-    original_paragraph: str
+    original_paragraph: str  # Filled in from the request for lean responses
     references: dict[str, str]
     translation: str
 
 
+def validate_translated_paragraph(para: dict, index: int, originals: dict[int, str] | None = None) -> TranslatedParagraph:
+    """
+    Check that a paragraph object from the response has the required fields.
+
+    Args:
+        originals: Original paragraphs by id, to fill in "original_paragraph" of lean responses
+    """
+    if not isinstance(para, dict):
+        raise ValueError(f"Paragraph {index} is not an object")
+    if "id" not in para:
+        raise ValueError(f"Missing 'id' in paragraph {index}")
+    if "translation" not in para:
+        raise ValueError(f"Missing 'translation' in paragraph {index}")
+    if originals is not None and "original_paragraph" not in para:
+        try:
+            para["original_paragraph"] = originals.get(int(para["id"]), "")
+        except (TypeError, ValueError):
+            para["original_paragraph"] = ""
+    return para
+
+
+def check_paragraph_count(count: int, expected: int):
+    """
+    Check that a response translated every paragraph of its request.
+
+    Raises:
+        ValueError: If paragraphs are missing or extra
+    """
+    if not count:
+        logger.error("No paragraphs in response")
+        raise ValueError("No paragraphs in response")
+    if count != expected:
+        logger.error("Response has %d paragraphs, the request has %d", count, expected)
+        raise ValueError(f"Response has {count} paragraphs, the request has {expected}")
+
+
+class TruncatedResponseError(ValueError):
+    """The response hit max_tokens before the JSON was complete"""
+
+
+# How often batches were truncated and split, since the process started
+_truncation_stats = {"truncated_batches": 0, "unsplittable_paragraphs": 0}
+_truncation_stats_lock = threading.Lock()
+
+
+def record_truncation(unsplittable: bool = False):
+    with _truncation_stats_lock:
+        _truncation_stats["truncated_batches"] += 1
+        if unsplittable:
+            _truncation_stats["unsplittable_paragraphs"] += 1
+
+
+def get_truncation_stats() -> dict:
+    """Truncated batches (each split and retried) and single paragraphs that were still truncated"""
+    with _truncation_stats_lock:
+        return dict(_truncation_stats)
+
+
 class TranslationResult(TypedDict):
     translated_paragraphs: list[str]
     references_by_language: dict[str, list[str]]
@@ -108,12 +179,618 @@ class TranslationResult(TypedDict):
     properties: dict
 
 
+def dedupe_paragraphs(paragraphs: list[str]) -> tuple[list[str], list[int]]:
+    """
+    Collapse repeated paragraphs.
+
+    Returns:
+        Tuple of (distinct paragraphs in order of first occurrence, index in them of every paragraph)
+    """
+    index_by_text: dict[str, int] = {}
+    positions = [index_by_text.setdefault(paragraph, len(index_by_text)) for paragraph in paragraphs]
+    return list(index_by_text), positions
+
+
+class TranslationEvent(TypedDict, total=False):
+    type: str  # "paragraph" for each translated paragraph, "done" once at the end
+    index: int  # Position of the paragraph in the translated result
+    translation: str
+    references: dict[str, str]  # Reference text by language name
+    remaining_additional_sources_texts: list[str]  # Only on "done"
+
+
+class TranslationCheckpoint(TypedDict):
+    """State of a sequential translation after its last finished batch"""
+    batch_num: int
+    paragraph_offset: int  # Number of translated paragraphs
+    translations: list[str]
+    references: list[dict[str, str]]  # Reference text by language name, per paragraph
+    reference_offsets: list[int]  # Consumed chars of each reference text (remaining texts are suffixes)
+    stored_paragraphs: int  # Paragraphs already stored as segments by a translation job
+
+
+class CheckpointStore(ABC):
+    """Where TranslationProgress keeps checkpoints between attempts of the same request"""
+
+    @abstractmethod
+    def load(self, key: str) -> TranslationCheckpoint | None:
+        pass
+
+    @abstractmethod
+    def save(self, key: str, checkpoint: TranslationCheckpoint):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+
+class PlannedBatch(TypedDict):
+    start: int  # Index of the first paragraph of the batch in the request
+    paragraphs: list[str]
+    additional_sources_texts: list[str] | None
+    reference_starts: list[int]  # Offset of each reference slice in its full text
+    max_output_tokens: int
+    input_tokens: int
+    estimated_tokens: int  # Input + estimated output, used for rate limiting
+
+
+class BulkRequest(TypedDict):
+    """One batch of a bulk translation, as a request of the provider's batch API"""
+    custom_id: str
+    task_prompt: str
+    input_text: str
+    max_output_tokens: int
+
+
+class BulkResult(TypedDict):
+    """Outcome of one BulkRequest"""
+    text: str | None  # Response text, None if the request failed
+    truncated: bool  # The response hit max_output_tokens
+    error: str | None
+    usage: dict | None  # record_usage arguments
+
+
+class BulkTranslation(TypedDict):
+    """State of a bulk translation from submitting its batches until their results are collected"""
+    batch_id: str | None  # Provider batch, None if the first batch held all paragraphs
+    task_prompt: str
+    batches: list[PlannedBatch]  # Submitted batches, request i has custom_id str(i)
+    first_batch: PlannedBatch | None  # Sent interactively to learn reference positions
+    first_result: tuple[list[str], dict[str, list[str]]] | None
+    token_usage: dict  # Usage of the first batch
+
+
+class BatchPlanner:
+    """
+    Cuts batch boundaries from token counts computed once per request.
+
+    Every paragraph, the task prompt and every reference text are tokenized once.
+    Prefix sums over paragraph tokens and chars, plus the token offsets of each
+    reference, answer "does paragraphs[start:end] fit" in O(log n), so each batch
+    is found by a single forward scan instead of re-tokenizing on every probe.
+
+    Paragraph costs are counted like calculate_input_tokens does: each paragraph
+    separately plus its tag (see get_paragraph_tag). All counts go through the shared token cache.
+    With the languages given, output is estimated with the calibrated multiplier.
+
+    Translations pass the reference_spans of their reference texts, aligned once per
+    request by BaseTranslationProvider.align_reference_texts, and a batch carries the
+    aligned span of its paragraphs, plus one paragraph's span on each side. References
+    without spans (not aligned, or only counting batches) get a window proportional to
+    the batch from the given offset.
+    """
+
+    def __init__(
+        self,
+        provider: "BaseTranslationProvider",
+        task_prompt: str,
+        paragraphs: list[str],
+        additional_sources_texts: list[str] | None = None,
+        original_language: str | None = None,
+        translate_language: str | None = None,
+        reference_spans: list[list[tuple[int, int]] | None] | None = None,
+    ):
+        encoding = provider.encoding
+        model_limits = provider.get_model_token_limit()
+
+        self.context_window = model_limits["context_window"]
+        self.max_output_tokens = model_limits["max_output_tokens"]
+        self.tpm_limit = provider.options.tpm_limit
+        self.itpm_limit = provider.options.itpm_limit
+        self.otpm_limit = provider.options.otpm_limit
+        self.paragraphs = paragraphs
+        self.additional_sources_texts = additional_sources_texts or []
+        self.output_multiplier = provider.get_output_multiplier(
+            len(self.additional_sources_texts), original_language, translate_language
+        )
+
+        self.prompt_tokens = count_tokens(encoding, provider.get_request_task_prompt(task_prompt))
+        tag_tokens = count_tokens(encoding, provider.get_paragraph_tag())
+
+        # Prefix sums: text tokens, input tokens (text + tag) and chars (with "\n" joins)
+        self.text_tokens = [0]
+        self.input_tokens = [0]
+        self.chars = [0]
+        for paragraph in paragraphs:
+            tokens = count_tokens(encoding, paragraph)
+            self.text_tokens.append(self.text_tokens[-1] + tokens)
+            self.input_tokens.append(self.input_tokens[-1] + tokens + tag_tokens)
+            self.chars.append(self.chars[-1] + len(paragraph) + 1)
+
+        # Char offset of every token in each reference text
+        self.reference_offsets = [token_offsets(encoding, text) for text in self.additional_sources_texts]
+
+        # Char span of every paragraph's reference in each reference text, None where not aligned
+        self.reference_spans: list[list[tuple[int, int]] | None] = (
+            reference_spans if reference_spans is not None else [None] * len(self.additional_sources_texts)
+        )
+
+    @property
+    def aligned(self) -> bool:
+        """Whether every reference text is aligned, batches do not depend on the references consumed before them"""
+        return bool(self.reference_spans) and all(spans is not None for spans in self.reference_spans)
+
+    def reference_window(self, start: int, end: int) -> int:
+        """Chars of each reference sent with paragraphs[start:end] (see limit_additional_sources)."""
+        paragraphs_chars = self.chars[end] - self.chars[start] - 1
+        return int(paragraphs_chars * OTHER_LANG_TEXT_MULTIPLIER)
+
+    def reference_slice(self, index: int, start: int, end: int, offset: int) -> tuple[int, int]:
+        """Span [start, end) of reference_texts[index] sent with paragraphs[start:end], given the unaligned offset"""
+        spans = self.reference_spans[index]
+        if spans is None:
+            return offset, offset + self.reference_window(start, end)
+        return spans[max(start - 1, 0)][0], spans[min(end, len(spans) - 1)][1]
+
+    def reference_tokens(self, index: int, start: int, end: int) -> int:
+        """Tokens in reference_texts[index][start:end], plus the two tokens split at its edges."""
+        offsets = self.reference_offsets[index]
+        end = min(end, len(self.additional_sources_texts[index]))
+        if end <= start:
+            return 0
+        return bisect_left(offsets, end) - bisect_left(offsets, start) + 2
+
+    def check_fit(self, start: int, end: int, reference_starts: list[int]) -> tuple[bool, int, int, int]:
+        """
+        Check whether paragraphs[start:end] fit within rate, context and output limits.
+
+        Returns:
+            Tuple of (fits, input tokens, estimated total tokens, available output tokens)
+        """
+        sources_tokens = sum(
+            self.reference_tokens(i, *self.reference_slice(i, start, end, offset))
+            for i, offset in enumerate(reference_starts)
+        )
+        input_tokens = self.prompt_tokens + self.input_tokens[end] - self.input_tokens[start] + sources_tokens
+        estimated_output = int((self.text_tokens[end] - self.text_tokens[start]) * self.output_multiplier)
+        total_tokens = input_tokens + estimated_output
+
+        # Check TPM limit (input + output must fit under TPM)
+        if self.tpm_limit > 0 and total_tokens > self.tpm_limit:
+            return False, input_tokens, total_tokens, 0
+
+        # Check separate input/output per-minute limits
+        if self.itpm_limit > 0 and input_tokens > self.itpm_limit:
+            return False, input_tokens, total_tokens, 0
+
+        # Check if we fit within context window
+        if input_tokens + min(estimated_output, self.max_output_tokens) >= self.context_window * SAFETY_MARGIN:
+            return False, input_tokens, total_tokens, 0
+
+        available_output_tokens = min(self.max_output_tokens, self.context_window - input_tokens)
+        if self.otpm_limit > 0:
+            # A larger max_tokens would never be admitted under the output limit
+            available_output_tokens = min(available_output_tokens, self.otpm_limit)
+
+        # Don't use more than SAFETY_MARGIN of available output to avoid truncation
+        if estimated_output > available_output_tokens * SAFETY_MARGIN:
+            return False, input_tokens, total_tokens, 0
+
+        return True, input_tokens, total_tokens, available_output_tokens
+
+    def plan(
+        self,
+        start: int,
+        reference_starts: list[int] | None = None,
+        max_paragraphs: int | None = None,
+    ) -> PlannedBatch:
+        """
+        Plan the largest batch starting at paragraph `start`.
+
+        Args:
+            start: Index of the first paragraph of the batch
+            reference_starts: Offset in each reference text where the batch slice starts,
+                ignored for aligned references
+            max_paragraphs: Optional cap on the batch size (after a truncated response)
+
+        Returns:
+            PlannedBatch with paragraphs, reference slices and token budget
+
+        Raises:
+            ValueError: If not even a single paragraph fits
+        """
+        reference_starts = list(reference_starts or [0] * len(self.additional_sources_texts))
+
+        end = start
+        input_tokens = 0
+        estimated_tokens = 0
+        max_output_tokens = 0
+        last = len(self.paragraphs) if max_paragraphs is None else min(len(self.paragraphs), start + max_paragraphs)
+        while end < last:
+            fits, batch_input_tokens, total_tokens, available_output_tokens = self.check_fit(
+                start, end + 1, reference_starts
+            )
+            if not fits:
+                break
+            end += 1
+            input_tokens = batch_input_tokens
+            estimated_tokens = total_tokens
+            max_output_tokens = available_output_tokens
+
+        if end == start:
+            raise ValueError(
+                f"Cannot fit any paragraphs within limits. "
+                f"TPM limit: {self.tpm_limit}, ITPM limit: {self.itpm_limit}, OTPM limit: {self.otpm_limit}, "
+                f"Context window: {self.context_window}. "
+                f"Try removing additional sources or increasing TPM limit."
+            )
+
+        if end < len(self.paragraphs):
+            logger.debug("Planned batch of %d paragraphs starting at %d (%d tokens)",
+                         end - start, start, estimated_tokens)
+
+        limited_sources = None
+        if self.additional_sources_texts:
+            slices = [self.reference_slice(i, start, end, offset) for i, offset in enumerate(reference_starts)]
+            reference_starts = [slice_start for slice_start, _ in slices]
+            limited_sources = [
+                text[slice_start:slice_end]
+                for text, (slice_start, slice_end) in zip(self.additional_sources_texts, slices)
+            ]
+
+        return PlannedBatch(
+            start=start,
+            paragraphs=self.paragraphs[start:end],
+            additional_sources_texts=limited_sources,
+            reference_starts=reference_starts,
+            max_output_tokens=max_output_tokens,
+            input_tokens=input_tokens,
+            estimated_tokens=estimated_tokens,
+        )
+
+
+class TranslationProgress:
+    """
+    State of a sequential translation, advanced one batch at a time.
+
+    Holds everything the batch loop needs between batches (planner, paragraph
+    offset, remaining reference texts) and the results accumulated so far, so the
+    same bookkeeping drives both the sync and the async translation loops.
+
+    With a checkpoint_store the state is saved after every finished batch, and a
+    later attempt of the same request starts from the first unfinished batch.
+    """
+
+    def __init__(
+        self,
+        provider: "BaseTranslationProvider",
+        original_language: str,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        task_prompt: str,
+        checkpoint_store: CheckpointStore | None = None,
+        reference_spans: list[list[tuple[int, int]] | None] | None = None,
+    ):
+        self.provider = provider
+        self.original_language = original_language
+        self.paragraphs = paragraphs
+        self.additional_sources_languages = additional_sources_languages
+        self.translate_language = translate_language
+        self.task_prompt = task_prompt
+
+        # Tokenize everything once; remaining texts are always suffixes of the full texts
+        self.planner = BatchPlanner(
+            provider, task_prompt, paragraphs, additional_sources_texts, original_language, translate_language,
+            reference_spans,
+        )
+        self.remaining_additional_sources_texts = additional_sources_texts.copy() if additional_sources_texts else []
+
+        self.batch_num = 0
+        self.paragraph_offset = 0
+        self.batch: PlannedBatch | None = None
+        self.batch_paragraphs: list[TranslatedParagraph] = []
+
+        # After a truncated response, batches are capped until its paragraphs are translated
+        self.max_batch_paragraphs: int | None = None
+        self.split_end = 0
+
+        self.translated_paragraphs: list[str] = []
+        self.paragraph_references: list[dict[str, str]] = []
+        self.references_by_language: dict[str, list[str]] = {
+            LANGUAGES[lang]: [] for lang in additional_sources_languages
+        } if additional_sources_languages else {}
+
+        # Resume from the last finished batch of a previous attempt of the same request
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_key = self.get_checkpoint_key() if checkpoint_store else None
+        self.resumed_paragraphs = 0
+        # Set by callers that store the translated segments themselves, kept across attempts
+        self.stored_paragraphs = 0
+        if checkpoint_store:
+            try:
+                checkpoint = checkpoint_store.load(self.checkpoint_key)
+            except Exception as e:
+                logger.warning("Failed to load translation checkpoint: %s", e)
+                checkpoint = None
+            if checkpoint:
+                self.restore(checkpoint)
+
+    def get_checkpoint_key(self) -> str:
+        """Hash of everything that determines the translation, identifies retries of a request"""
+        options = self.provider.options
+        request = [
+            options.provider.value,
+            options.model,
+            options.temperature,
+            self.original_language,
+            self.translate_language,
+            self.additional_sources_languages or [],
+            self.task_prompt,
+            self.paragraphs,
+            self.planner.additional_sources_texts,
+        ]
+        return hashlib.sha256(json.dumps(request, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def checkpoint(self) -> TranslationCheckpoint:
+        return TranslationCheckpoint(
+            batch_num=self.batch_num,
+            paragraph_offset=self.paragraph_offset,
+            translations=self.translated_paragraphs,
+            references=self.paragraph_references,
+            reference_offsets=[
+                len(text) - len(remaining_text)
+                for text, remaining_text in zip(self.planner.additional_sources_texts, self.remaining_additional_sources_texts)
+            ],
+            stored_paragraphs=self.stored_paragraphs,
+        )
+
+    def restore(self, checkpoint: TranslationCheckpoint):
+        """Continue after the batches of a checkpoint"""
+        self.batch_num = checkpoint["batch_num"]
+        self.paragraph_offset = checkpoint["paragraph_offset"]
+        self.remaining_additional_sources_texts = [
+            text[offset:]
+            for text, offset in zip(self.planner.additional_sources_texts, checkpoint["reference_offsets"])
+        ]
+        for translation, references in zip(checkpoint["translations"], checkpoint["references"]):
+            self.record_paragraph(translation, references)
+        self.resumed_paragraphs = self.paragraph_offset
+        self.stored_paragraphs = checkpoint.get("stored_paragraphs", 0)
+
+        logger.info("Resuming translation from checkpoint: %d paragraphs in %d batches already translated",
+                    self.paragraph_offset, self.batch_num)
+
+    def replay(self) -> list[TranslationEvent]:
+        """Paragraph events for the paragraphs restored from a checkpoint"""
+        return [
+            TranslationEvent(
+                type="paragraph",
+                index=index,
+                translation=self.translated_paragraphs[index],
+                references=self.paragraph_references[index],
+            )
+            for index in range(self.resumed_paragraphs)
+        ]
+
+    def next_batch(self) -> tuple[PlannedBatch, str] | None:
+        """
+        Plan the next batch and build its input text (Part 2).
+
+        Returns:
+            Tuple of (batch, input text), or None when all paragraphs are translated
+        """
+        if self.paragraph_offset >= len(self.paragraphs):
+            return None
+
+        self.batch_num += 1
+        logger.info("Processing batch %d, %d paragraphs remaining",
+                    self.batch_num, len(self.paragraphs) - self.paragraph_offset)
+
+        if self.paragraph_offset >= self.split_end:
+            self.max_batch_paragraphs = None
+
+        # Determine how many paragraphs fit and limit additional sources proportionally
+        self.batch = self.planner.plan(self.paragraph_offset, [
+            len(text) - len(remaining_text)
+            for text, remaining_text in zip(self.planner.additional_sources_texts, self.remaining_additional_sources_texts)
+        ], self.max_batch_paragraphs)
+        self.batch_paragraphs = []
+
+        input_text = self.provider.format_batch_input(
+            self.original_language, self.batch, self.additional_sources_languages, self.translate_language
+        )
+        return self.batch, input_text
+
+    def add_paragraph(self, para: TranslatedParagraph) -> TranslationEvent:
+        """Record a translated paragraph of the current batch"""
+        index = len(self.translated_paragraphs)
+        references = para.get("references", {})
+
+        self.batch_paragraphs.append(para)
+        self.record_paragraph(para["translation"], references)
+
+        return TranslationEvent(
+            type="paragraph",
+            index=index,
+            translation=para["translation"],
+            references=references,
+        )
+
+    def record_paragraph(self, translation: str, references: dict[str, str]):
+        self.translated_paragraphs.append(translation)
+        self.paragraph_references.append(references)
+        for lang_name, ref_text in references.items():
+            if lang_name in self.references_by_language:
+                self.references_by_language[lang_name].append(ref_text)
+
+    def split_batch(self, error: TruncatedResponseError):
+        """
+        Handle a truncated response to the current batch.
+
+        Paragraphs that completed before the cut (only when streaming) are kept,
+        the rest of the batch is retried in batches of at most half its size,
+        halving again on every truncation down to a single paragraph.
+
+        Raises:
+            TruncatedResponseError: If a single paragraph was truncated
+        """
+        self.finish_batch(self._split_batch(error))
+
+    async def asplit_batch(self, error: TruncatedResponseError):
+        """Async version of split_batch"""
+        await self.afinish_batch(self._split_batch(error))
+
+    def _split_batch(self, error: TruncatedResponseError) -> int:
+        """Cap the following batches after a truncation, returns the paragraphs kept of the current one"""
+        size = len(self.batch["paragraphs"])
+        kept = len(self.batch_paragraphs)
+        if kept == 0 and size == 1:
+            record_truncation(unsplittable=True)
+            raise TruncatedResponseError(
+                f"Paragraph {self.paragraph_offset + 1} alone does not fit in the output token limit. {error}"
+            ) from error
+
+        record_truncation()
+        _response_usage.set(None)
+        self.split_end = max(self.split_end, self.batch["start"] + size)
+        self.max_batch_paragraphs = max(1, size // 2)
+        logger.warning("Batch %d was truncated after %d of %d paragraphs, retrying the rest in batches of at most %d",
+                       self.batch_num, kept, size, self.max_batch_paragraphs)
+        return kept
+
+    def finish_batch(self, num_translated: int | None = None):
+        """Move past the current batch (see advance_batch) and save the checkpoint"""
+        self.advance_batch(num_translated)
+        self.save_checkpoint()
+
+    async def afinish_batch(self, num_translated: int | None = None):
+        """Async version of finish_batch, the checkpoint store is called in a worker thread"""
+        self.advance_batch(num_translated)
+        if self.checkpoint_store:
+            await asyncio.to_thread(self.save_checkpoint)
+
+    def advance_batch(self, num_translated: int | None = None):
+        """
+        Consume the current batch's references and move past its paragraphs.
+
+        Args:
+            num_translated: Paragraphs of the batch that were translated, all by default
+
+        Raises:
+            ValueError: If the response did not translate every paragraph of the batch
+        """
+        if num_translated is None:
+            check_paragraph_count(len(self.batch_paragraphs), len(self.batch["paragraphs"]))
+
+        if self.additional_sources_languages and self.remaining_additional_sources_texts:
+            _, batch_references_by_language = self.provider.collect_batch_results(
+                self.batch_paragraphs, self.additional_sources_languages
+            )
+            remaining_texts = self.provider.rebuild_remaining_texts(
+                references_by_language=batch_references_by_language,
+                additional_sources_languages=self.additional_sources_languages,
+                remaining_additional_sources_texts=self.remaining_additional_sources_texts,
+            )
+            # Aligned slices start before the consumed text, find the end of the extracted references
+            for i, (lang_code, spans) in enumerate(zip(self.additional_sources_languages, self.planner.reference_spans)):
+                if spans is None:
+                    continue
+                text = self.planner.additional_sources_texts[i]
+                refs = batch_references_by_language.get(LANGUAGES.get(lang_code, lang_code), [])
+                consumed = max(
+                    len(text) - len(self.remaining_additional_sources_texts[i]),
+                    self.provider.locate_consumed_end(text, self.batch["reference_starts"][i], refs),
+                )
+                remaining_texts[i] = text[consumed:]
+            self.remaining_additional_sources_texts = remaining_texts
+
+        if num_translated is None:
+            num_translated = len(self.batch["paragraphs"])
+            # Truncated responses would understate the output, only complete ones calibrate
+            self.provider.record_output_usage(
+                self.batch["paragraphs"],
+                self.original_language,
+                self.translate_language,
+                len(self.additional_sources_languages or []),
+            )
+        self.paragraph_offset += num_translated
+
+        logger.debug("Batch %d: translated %d paragraphs, %d remaining",
+                    self.batch_num, num_translated, len(self.paragraphs) - self.paragraph_offset)
+
+    def save_checkpoint(self):
+        if self.checkpoint_store:
+            try:
+                self.checkpoint_store.save(self.checkpoint_key, self.checkpoint())
+            except Exception as e:
+                # Only a retry would miss it, don't fail the translation
+                logger.warning("Failed to save translation checkpoint: %s", e)
+
+    def delete_checkpoint(self):
+        if self.checkpoint_store:
+            try:
+                self.checkpoint_store.delete(self.checkpoint_key)
+            except Exception as e:
+                logger.warning("Failed to delete translation checkpoint: %s", e)
+
+    def finish(self) -> TranslationEvent:
+        """The final "done" event"""
+        self.delete_checkpoint()
+        return self.done()
+
+    async def afinish(self) -> TranslationEvent:
+        """Async version of finish"""
+        if self.checkpoint_store:
+            await asyncio.to_thread(self.delete_checkpoint)
+        return self.done()
+
+    def done(self) -> TranslationEvent:
+        logger.info("Translation completed: %d paragraphs in %d batches",
+                   len(self.translated_paragraphs), self.batch_num)
+        return TranslationEvent(
+            type="done",
+            remaining_additional_sources_texts=self.remaining_additional_sources_texts,
+        )
+
+    def result(self) -> TranslationResult:
+        return TranslationResult(
+            translated_paragraphs=self.translated_paragraphs,
+            references_by_language=self.references_by_language,
+            remaining_additional_sources_texts=self.remaining_additional_sources_texts,
+            properties=self.provider.get_result_properties(task_prompt=self.task_prompt),
+        )
+
+
 class BaseTranslationProvider(ABC):
     """Abstract base class for translation providers"""
 
+    # Shortest system prompt (in tokens) the provider caches between requests
+    MIN_CACHEABLE_PROMPT_TOKENS = 1024
+    # Whether input tokens read from the prompt cache count towards the ITPM/TPM limits
+    CACHE_READS_COUNT_TOWARDS_RATE_LIMITS = True
+
     def __init__(self, api_key: str, options: TranslationServiceOptions):
         self.api_key = api_key
         self.options = options
+        # Tokens reported by the API for all requests sent by this instance.
+        # input_tokens include the cached ones: read from the prompt cache, or written to it.
+        self.token_usage = {"input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0, "cache_write_tokens": 0}
+        self.usage_lock = threading.Lock()
+        # Responses answered from the response cache instead of the API
+        self.cached_responses = 0
 
     @abstractmethod
     def get_model_token_limit(self) -> dict:
@@ -146,13 +823,21 @@ class BaseTranslationProvider(ABC):
         pass
 
     @abstractmethod
-    def estimate_output_tokens(self, original_paragraphs: list[str], num_references: int) -> int:
+    def estimate_output_tokens(
+        self,
+        original_paragraphs: list[str],
+        num_references: int,
+        original_language: str | None = None,
+        translate_language: str | None = None,
+    ) -> int:
         """
         Estimate output tokens based on input size and reference count.
 
         Args:
             original_paragraphs: List of paragraphs to translate
             num_references: Number of reference sources
+            original_language: Optional language code, with translate_language enables calibration
+            translate_language: Optional target language code
 
         Returns:
             Estimated output token count
@@ -160,6 +845,128 @@ class BaseTranslationProvider(ABC):
         pass
 
     @abstractmethod
+    def stream_translation_text(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> Iterator[str]:
+        """
+        Send request to provider API with streaming enabled.
+
+        Args:
+            task_prompt: Task prompt (Part 1) - system message
+            input_text: Input text (Part 2) - user message
+            max_output_tokens: Maximum tokens to allocate for output
+
+        Yields:
+            Raw response text deltas as they arrive. Raises ValueError once the
+            stream ends if the response was truncated.
+        """
+        pass
+
+    @abstractmethod
+    def astream_translation_text(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> AsyncIterator[str]:
+        """
+        Async version of stream_translation_text, using the provider's async client.
+        """
+        pass
+
+    @abstractmethod
+    def submit_bulk_requests(self, requests: list[BulkRequest]) -> str:
+        """
+        Submit requests to the provider's batch API, processed asynchronously at a discount.
+
+        Returns:
+            Provider batch id
+        """
+        pass
+
+    @abstractmethod
+    def get_bulk_results(self, batch_id: str) -> dict[str, BulkResult] | None:
+        """
+        Results of a submitted provider batch.
+
+        Returns:
+            BulkResult by custom_id once the batch ended (requests that did not run
+            are missing), None while it is still processing
+
+        Raises:
+            ValueError: If the batch failed as a whole
+        """
+        pass
+
+    # Shared methods that work for all providers
+
+    def record_usage(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        cached_input_tokens: int = 0,
+        cache_write_tokens: int = 0,
+    ):
+        """Add the usage reported for one API request to token_usage"""
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cached_input_tokens": cached_input_tokens,
+            "cache_write_tokens": cache_write_tokens,
+        }
+        with self.usage_lock:
+            for key, tokens in usage.items():
+                self.token_usage[key] += tokens
+        _response_usage.set(usage)
+
+    def get_token_usage(self) -> dict:
+        with self.usage_lock:
+            return dict(self.token_usage)
+
+    def estimate_prompt_cache_tokens(self, prompt_tokens: int, num_batches: int) -> tuple[int, int]:
+        """
+        Estimate prompt cache usage of a translation sent in num_batches batches.
+
+        Every batch repeats the same system prompt, all batches after the first
+        read it from the cache.
+
+        Returns:
+            Tuple of (cached input tokens, cache write tokens)
+        """
+        if prompt_tokens < self.MIN_CACHEABLE_PROMPT_TOKENS or num_batches < 2:
+            return 0, 0
+        return prompt_tokens * (num_batches - 1), 0
+
+    def record_output_usage(
+        self,
+        paragraphs: list[str],
+        original_language: str,
+        translate_language: str,
+        num_references: int,
+    ):
+        """
+        Feed the usage of the response just received for paragraphs to the output calibration.
+
+        Usage is taken from record_usage in the same thread or task, nothing is
+        recorded when the provider did not report it.
+        """
+        usage = _response_usage.get()
+        _response_usage.set(None)
+        if not usage:
+            return
+        output_calibrator.record(
+            model=self.options.model,
+            original_language=original_language,
+            translate_language=translate_language,
+            num_references=num_references,
+            paragraph_tokens=sum(count_tokens(self.encoding, paragraph) for paragraph in paragraphs),
+            output_tokens=usage["output_tokens"],
+            **self.get_calibration_options(),
+        )
+
     def send_for_translation(
         self,
         task_prompt: str,
@@ -169,6 +976,9 @@ class BaseTranslationProvider(ABC):
         """
         Send request to provider API.
 
+        The response is streamed and parsed incrementally while it is generated,
+        so no separate parsing pass over the full text is needed.
+
         Args:
             task_prompt: Task prompt (Part 1) - system message
             input_text: Input text (Part 2) - user message
@@ -177,9 +987,151 @@ class BaseTranslationProvider(ABC):
         Returns:
             List of TranslatedParagraph objects from LLM response
         """
-        pass
+        return list(self.stream_for_translation(task_prompt, input_text, max_output_tokens))
 
-    # Shared methods that work for all providers
+    def stream_for_translation(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> Iterator[TranslatedParagraph]:
+        """
+        Streaming counterpart of send_for_translation.
+
+        Responses are stored in the response cache once they parsed completely and
+        translated every paragraph of the request, an identical request is answered
+        from it without calling the API.
+
+        Yields:
+            Each TranslatedParagraph as soon as its JSON object is complete
+
+        Raises:
+            ValueError: If the response is incomplete or misses paragraphs of the request
+        """
+        task_prompt = self.get_request_task_prompt(task_prompt)
+        request_paragraphs = get_input_paragraphs(input_text)
+        # Lean responses do not echo the originals, they are filled in from the request
+        originals = request_paragraphs if self.options.lean_response else None
+        cache_key = self.get_response_cache_key(task_prompt, input_text)
+        cached_text = response_cache.get(cache_key) if cache_key else None
+        if cached_text is not None:
+            self.record_cached_response()
+            deltas = [cached_text]
+        else:
+            deltas = self.stream_translation_text(task_prompt, input_text, max_output_tokens)
+
+        parser = self.create_response_parser(get_input_reference_languages(input_text))
+        received = []
+        count = 0
+
+        try:
+            for delta in deltas:
+                received.append(delta)
+                for para in parser.feed(delta):
+                    yield validate_translated_paragraph(para, count, originals)
+                    count += 1
+            for para in parser.finish():
+                yield validate_translated_paragraph(para, count, originals)
+                count += 1
+            check_paragraph_count(count, len(request_paragraphs))
+        except ValueError:
+            if cached_text is not None:
+                # Stored before responses were checked, a retry must send the request
+                response_cache.delete(cache_key)
+            raise
+
+        if cache_key and cached_text is None:
+            response_cache.put(cache_key, "".join(received))
+
+    async def asend_for_translation(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> list[TranslatedParagraph]:
+        """Async version of send_for_translation"""
+        return [para async for para in self.astream_for_translation(task_prompt, input_text, max_output_tokens)]
+
+    async def astream_for_translation(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> AsyncIterator[TranslatedParagraph]:
+        """Async version of stream_for_translation"""
+        task_prompt = self.get_request_task_prompt(task_prompt)
+        request_paragraphs = get_input_paragraphs(input_text)
+        # Lean responses do not echo the originals, they are filled in from the request
+        originals = request_paragraphs if self.options.lean_response else None
+        cache_key = self.get_response_cache_key(task_prompt, input_text)
+        cached_text = await asyncio.to_thread(response_cache.get, cache_key) if cache_key else None
+        parser = self.create_response_parser(get_input_reference_languages(input_text))
+        received = []
+        count = 0
+
+        try:
+            if cached_text is not None:
+                self.record_cached_response()
+                for para in parser.feed(cached_text):
+                    yield validate_translated_paragraph(para, count, originals)
+                    count += 1
+            else:
+                async for delta in self.astream_translation_text(task_prompt, input_text, max_output_tokens):
+                    received.append(delta)
+                    for para in parser.feed(delta):
+                        yield validate_translated_paragraph(para, count, originals)
+                        count += 1
+            for para in parser.finish():
+                yield validate_translated_paragraph(para, count, originals)
+                count += 1
+            check_paragraph_count(count, len(request_paragraphs))
+        except ValueError:
+            if cached_text is not None:
+                # Stored before responses were checked, a retry must send the request
+                await asyncio.to_thread(response_cache.delete, cache_key)
+            raise
+
+        if cache_key and cached_text is None:
+            await asyncio.to_thread(response_cache.put, cache_key, "".join(received))
+
+    def get_output_format(self) -> OutputFormat:
+        """Response format of the options, or the model's default"""
+        return self.options.output_format or self.get_model_output_format()
+
+    def get_model_output_format(self) -> OutputFormat:
+        """Default response format of the model, override per provider"""
+        return OutputFormat.JSON
+
+    def create_response_parser(self, reference_languages: list[str] | None = None) -> ParagraphStreamParser | TaggedStreamParser:
+        """Incremental parser of responses in the output format, to a request with references in reference_languages"""
+        if self.get_output_format() == OutputFormat.TAGGED:
+            return TaggedStreamParser(reference_languages)
+        return ParagraphStreamParser()
+
+    def get_request_task_prompt(self, task_prompt: str) -> str:
+        """Task prompt sent to the provider, in the output format and made lean and compact as the options ask"""
+        if self.options.lean_response:
+            task_prompt = get_lean_task_prompt(task_prompt)
+        if self.get_output_format() == OutputFormat.TAGGED:
+            task_prompt = get_tagged_task_prompt(task_prompt)
+        if self.options.compact_input:
+            task_prompt = get_compact_task_prompt(task_prompt)
+        return task_prompt
+
+    def get_response_cache_key(self, task_prompt: str, input_text: str) -> str | None:
+        """Response cache key of a request, None when the options bypass the cache"""
+        if not self.options.use_response_cache:
+            return None
+        return response_cache_key(
+            self.options.provider.value, self.options.model, self.options.temperature, task_prompt, input_text
+        )
+
+    def record_cached_response(self):
+        """Count a response read from the response cache, it has no usage to record"""
+        with self.usage_lock:
+            self.cached_responses += 1
+        _response_usage.set(None)
+        _response_cached.set(True)
 
     def limit_additional_sources(
         self,
@@ -200,6 +1152,37 @@ class BaseTranslationProvider(ABC):
 
         return [text[:chars_per_source] for text in additional_sources_texts]
 
+    def get_output_multiplier(
+        self,
+        num_references: int,
+        original_language: str | None = None,
+        translate_language: str | None = None,
+    ) -> float:
+        """
+        Ratio of output tokens to original paragraph tokens.
+
+        Output includes: original text (1x, not in lean responses) + translation
+        (OTHER_LANG_TEXT_MULTIPLIER) + references from each source (num_references * OTHER_LANG_TEXT_MULTIPLIER).
+        With the languages given, a ratio calibrated from real usage of this model
+        and language pair replaces the estimate once enough responses were seen.
+        """
+        echo = 0 if self.options.lean_response else 1
+        default = echo + OTHER_LANG_TEXT_MULTIPLIER + (num_references * OTHER_LANG_TEXT_MULTIPLIER)
+        if not original_language or not translate_language:
+            return default
+        return output_calibrator.multiplier(
+            self.options.model, original_language, translate_language, num_references, default,
+            **self.get_calibration_options(),
+        )
+
+    def get_calibration_options(self) -> dict:
+        """Options that change the output per paragraph, calibrated separately"""
+        return {
+            "output_format": self.get_output_format().value,
+            "lean": self.options.lean_response,
+            "compact": self.options.compact_input,
+        }
+
     def reduce_paragraphs_to_fit(
         self,
         task_prompt: str,
@@ -210,96 +1193,19 @@ class BaseTranslationProvider(ABC):
         Reduces paragraphs until they fit within both the model's context window
         and the organization's TPM rate limit.
 
-        Uses binary search for efficient O(log n) complexity.
+        Uses BatchPlanner, which tokenizes the input once and scans prefix sums.
 
         Returns:
             Tuple of (paragraphs that fit, limited additional sources, max tokens available for output)
         """
-        model_limits = self.get_model_token_limit()
-        context_window = model_limits["context_window"]
-        max_output_tokens = model_limits["max_output_tokens"]
-
-        num_references = len(additional_sources_texts) if additional_sources_texts else 0
-        tpm_limit = self.options.tpm_limit
+        planner = BatchPlanner(self, task_prompt, paragraphs, additional_sources_texts)
+        batch = planner.plan(0)
 
-        # Helper function to check if N paragraphs fit within limits
-        def check_paragraphs_fit(num_paragraphs: int) -> tuple[bool, list[str] | None, int]:
-            """Check if num_paragraphs fit, return (fits, limited_sources, available_output_tokens)"""
-            if num_paragraphs == 0:
-                return False, None, 0
+        if len(batch["paragraphs"]) < len(paragraphs):
+            logger.warning("Reduced paragraphs to %d (from %d) due to limits",
+                         len(batch["paragraphs"]), len(paragraphs))
 
-            paragraphs_to_check = paragraphs[:num_paragraphs]
-
-            # Limit additional sources proportional to paragraphs
-            limited_sources = self.limit_additional_sources(paragraphs_to_check, additional_sources_texts)
-
-            input_tokens = self.calculate_input_tokens(
-                task_prompt, paragraphs_to_check, limited_sources
-            )
-            estimated_output = self.estimate_output_tokens(
-                paragraphs_to_check, num_references
-            )
-            total_tokens = input_tokens + estimated_output
-
-            logger.debug(f"Binary search check: {num_paragraphs} paras, "
-                        f"input_tokens={input_tokens}, estimated_output={estimated_output}, "
-                        f"total={total_tokens}, tpm_limit={tpm_limit}, max_output_tokens={max_output_tokens}")
-
-            # Check TPM limit (input + output must fit under TPM)
-            if tpm_limit > 0 and total_tokens > tpm_limit:
-                return False, None, 0
-
-            # Check if we fit within context window
-            context_total = input_tokens + min(estimated_output, max_output_tokens)
-            if context_total >= context_window * SAFETY_MARGIN:
-                return False, None, 0
-
-            available_output_tokens = min(max_output_tokens, context_window - input_tokens)
-
-            # Ensure estimated output doesn't exceed available capacity (with safety margin)
-            # Don't use more than SAFETY_MARGIN of available to avoid truncation
-            if estimated_output > available_output_tokens * SAFETY_MARGIN:
-                logger.debug(f"  Insufficient output tokens: estimated={estimated_output}, "
-                           f"available={available_output_tokens}, safe_limit={available_output_tokens * SAFETY_MARGIN:.0f}")
-                return False, None, 0
-
-            return True, limited_sources, available_output_tokens
-
-        # Binary search for maximum number of paragraphs that fit
-        left, right = 0, len(paragraphs) - 1
-        best_fit = -1
-        best_sources = None
-        best_output_tokens = 0
-
-        while left <= right:
-            mid = (left + right) // 2
-            fits, limited_sources, available_output_tokens = check_paragraphs_fit(mid + 1)
-
-            if fits:
-                # This many paragraphs fit, try more
-                best_fit = mid
-                best_sources = limited_sources
-                best_output_tokens = available_output_tokens
-                left = mid + 1
-                logger.debug("Binary search: %d paragraphs fit, trying more", mid + 1)
-            else:
-                # Too many paragraphs, try fewer
-                right = mid - 1
-                logger.debug("Binary search: %d paragraphs don't fit, trying fewer", mid + 1)
-
-        count = 1 + best_fit
-        if count > 0:
-            if count < len(paragraphs):
-                logger.warning("Reduced paragraphs to %d (from %d) due to limits",
-                             count, len(paragraphs))
-            return paragraphs[:count], best_sources, best_output_tokens
-
-        # No paragraphs fit - calculate token breakdown for error message
-        raise ValueError(
-            f"Cannot fit any paragraphs within limits. "
-            f"TPM limit: {tpm_limit}, Context window: {context_window}. "
-            f"Try removing additional sources or increasing TPM limit."
-        )
+        return batch["paragraphs"], batch["additional_sources_texts"], batch["max_output_tokens"]
 
     def rebuild_remaining_texts(
         self,
@@ -333,6 +1239,801 @@ class BaseTranslationProvider(ABC):
 
         return reduced_texts
 
+    def locate_consumed_end(self, text: str, start: int, extracted_refs: list[str]) -> int:
+        """
+        Find where the references extracted from a slice of text end.
+
+        Looks for the last non-empty extracted reference in the text, falling back
+        to the summed length of all references (as rebuild_remaining_texts does)
+        when the model did not copy it verbatim.
+
+        Args:
+            text: Full reference text
+            start: Offset of the slice that was sent to the model
+            extracted_refs: References the model extracted from that slice
+
+        Returns:
+            Offset in text right after the consumed portion
+        """
+        last_ref = next((ref for ref in reversed(extracted_refs) if ref), None)
+        if last_ref:
+            position = text.find(last_ref, start)
+            if position >= 0:
+                return position + len(last_ref)
+
+        consumed_length = sum(len(ref) for ref in extracted_refs if ref)
+        return min(start + consumed_length, len(text))
+
+    def collect_batch_results(
+        self,
+        translated_batch: list[TranslatedParagraph],
+        additional_sources_languages: list[str],
+    ) -> tuple[list[str], dict[str, list[str]]]:
+        """
+        Split a translated batch into translations and references per language.
+
+        Returns:
+            Tuple of (translations, references by language name)
+        """
+        translations: list[str] = []
+        references_by_language: dict[str, list[str]] = {
+            LANGUAGES[lang]: [] for lang in additional_sources_languages
+        } if additional_sources_languages else {}
+
+        for para in translated_batch:
+            translations.append(para["translation"])
+
+            references = para.get("references", {})
+            for lang_name, ref_text in references.items():
+                if lang_name in references_by_language:
+                    references_by_language[lang_name].append(ref_text)
+
+        return translations, references_by_language
+
+    def translate_batch(
+        self,
+        original_language: str,
+        batch: PlannedBatch,
+        additional_sources_languages: list[str],
+        translate_language: str,
+        task_prompt: str,
+        planner: BatchPlanner | None = None,
+    ) -> tuple[list[str], dict[str, list[str]]]:
+        """
+        Format and send one planned batch.
+
+        A truncated response is retried as two halves of the batch (recursively,
+        down to a single paragraph). Both halves keep the batch's reference slices,
+        which cover the references of either half and already fit the limits.
+
+        Args:
+            planner: Planner of the batch, to estimate the tokens of its halves
+
+        Returns:
+            Tuple of (translations, references by language name) for the batch
+        """
+        input_text = self.format_batch_input(original_language, batch, additional_sources_languages, translate_language)
+
+        truncation = None
+        reservation = self.reserve_batch(batch)
+        try:
+            translated_batch = self.send_for_translation(
+                task_prompt=task_prompt,
+                input_text=input_text,
+                max_output_tokens=batch["max_output_tokens"],
+            )
+        except TruncatedResponseError as e:
+            truncation = e
+        finally:
+            # Failed requests too, their estimate would hold the window until it expires
+            self.settle_reservation(reservation)
+
+        if truncation:
+            results = [
+                self.translate_batch(
+                    original_language, half, additional_sources_languages, translate_language, task_prompt, planner
+                )
+                for half in self.split_planned_batch(batch, truncation, planner)
+            ]
+            return self.merge_batch_results(results)
+
+        check_paragraph_count(len(translated_batch), len(batch["paragraphs"]))
+        self.record_output_usage(
+            batch["paragraphs"], original_language, translate_language, len(additional_sources_languages or [])
+        )
+        return self.collect_batch_results(translated_batch, additional_sources_languages)
+
+    async def atranslate_batch(
+        self,
+        original_language: str,
+        batch: PlannedBatch,
+        additional_sources_languages: list[str],
+        translate_language: str,
+        task_prompt: str,
+        planner: BatchPlanner | None = None,
+    ) -> tuple[list[str], dict[str, list[str]]]:
+        """Async version of translate_batch"""
+        input_text = self.format_batch_input(original_language, batch, additional_sources_languages, translate_language)
+
+        truncation = None
+        reservation = await self.areserve_batch(batch)
+        try:
+            translated_batch = await self.asend_for_translation(
+                task_prompt=task_prompt,
+                input_text=input_text,
+                max_output_tokens=batch["max_output_tokens"],
+            )
+        except TruncatedResponseError as e:
+            truncation = e
+        finally:
+            self.settle_reservation(reservation)
+
+        if truncation:
+            results = [
+                await self.atranslate_batch(
+                    original_language, half, additional_sources_languages, translate_language, task_prompt, planner
+                )
+                for half in self.split_planned_batch(batch, truncation, planner)
+            ]
+            return self.merge_batch_results(results)
+
+        check_paragraph_count(len(translated_batch), len(batch["paragraphs"]))
+        self.record_output_usage(
+            batch["paragraphs"], original_language, translate_language, len(additional_sources_languages or [])
+        )
+        return self.collect_batch_results(translated_batch, additional_sources_languages)
+
+    def split_planned_batch(
+        self,
+        batch: PlannedBatch,
+        error: TruncatedResponseError,
+        planner: BatchPlanner | None = None,
+    ) -> list[PlannedBatch]:
+        """
+        Split a batch whose response was truncated into two halves.
+
+        Each half is estimated (for rate limiting) with the batch's reference slices and
+        prompt, its own paragraphs and their share of the estimated output. Paragraph
+        tokens come from the planner's prefix sums, or the token cache without one.
+
+        Raises:
+            TruncatedResponseError: If the batch is a single paragraph
+        """
+        size = len(batch["paragraphs"])
+        if size == 1:
+            record_truncation(unsplittable=True)
+            raise TruncatedResponseError(
+                f"Paragraph {batch['start'] + 1} alone does not fit in the output token limit. {error}"
+            ) from error
+
+        record_truncation()
+        middle = size // 2
+        logger.warning("Batch of %d paragraphs at %d was truncated, retrying as %d + %d",
+                       size, batch["start"], middle, size - middle)
+
+        start = batch["start"]
+        if planner is not None:
+            text_tokens = [planner.text_tokens[i + 1] - planner.text_tokens[i] for i in range(start, start + size)]
+            input_tokens = [planner.input_tokens[i + 1] - planner.input_tokens[i] for i in range(start, start + size)]
+        else:
+            tag_tokens = count_tokens(self.encoding, self.get_paragraph_tag())
+            text_tokens = [count_tokens(self.encoding, paragraph) for paragraph in batch["paragraphs"]]
+            input_tokens = [tokens + tag_tokens for tokens in text_tokens]
+        output_tokens = batch["estimated_tokens"] - batch["input_tokens"]
+
+        def half(begin: int, end: int) -> PlannedBatch:
+            half_input_tokens = batch["input_tokens"] - sum(input_tokens) + sum(input_tokens[begin:end])
+            half_output_tokens = output_tokens * sum(text_tokens[begin:end]) // max(sum(text_tokens), 1)
+            return PlannedBatch(
+                batch,
+                start=start + begin,
+                paragraphs=batch["paragraphs"][begin:end],
+                input_tokens=half_input_tokens,
+                estimated_tokens=half_input_tokens + half_output_tokens,
+            )
+
+        return [half(0, middle), half(middle, size)]
+
+    def merge_batch_results(
+        self,
+        results: list[tuple[list[str], dict[str, list[str]]]],
+    ) -> tuple[list[str], dict[str, list[str]]]:
+        """Concatenate the results of consecutive parts of a batch"""
+        translations: list[str] = []
+        references_by_language: dict[str, list[str]] = {}
+        for part_translations, part_references in results:
+            translations.extend(part_translations)
+            for lang_name, refs in part_references.items():
+                references_by_language.setdefault(lang_name, []).extend(refs)
+        return translations, references_by_language
+
+    def format_batch_input(
+        self,
+        original_language: str,
+        batch: PlannedBatch,
+        additional_sources_languages: list[str],
+        translate_language: str,
+    ) -> str:
+        return format_input(
+            original_language=original_language,
+            original_paragraphs=batch["paragraphs"],
+            additional_sources_languages=additional_sources_languages,
+            additional_sources_texts=batch["additional_sources_texts"],
+            translate_language=translate_language,
+            compact=self.options.compact_input,
+        )
+
+    def get_paragraph_tag(self) -> str:
+        """Markup format_input adds around each paragraph, counted in input tokens"""
+        return COMPACT_PARAGRAPH_TAG if self.options.compact_input else PARAGRAPH_TAG
+
+    @property
+    def rate_limits(self) -> RateLimits:
+        return RateLimits(
+            rpm=self.options.rpm_limit,
+            itpm=self.options.itpm_limit,
+            otpm=self.options.otpm_limit,
+            tpm=self.options.tpm_limit,
+        )
+
+    @property
+    def rate_limiter(self) -> SlidingWindowLimiter:
+        """Process-wide limiter shared by all requests to this provider's model"""
+        return get_rate_limiter(f"{self.options.provider.value}:{self.options.model}", self.rate_limits)
+
+    def reserve_batch(self, batch: PlannedBatch) -> Reservation:
+        """Wait until the batch fits in the model's rate limit window and reserve it for the next request"""
+        _response_usage.set(None)
+        _response_cached.set(False)
+        return self.rate_limiter.reserve(batch["input_tokens"], batch["estimated_tokens"] - batch["input_tokens"])
+
+    async def areserve_batch(self, batch: PlannedBatch) -> Reservation:
+        """Async version of reserve_batch"""
+        _response_usage.set(None)
+        _response_cached.set(False)
+        return await self.rate_limiter.areserve(batch["input_tokens"], batch["estimated_tokens"] - batch["input_tokens"])
+
+    def settle_reservation(self, reservation: Reservation):
+        """Replace a reservation's estimate with the usage reported for the response, if any"""
+        usage = _response_usage.get()
+        if _response_cached.get():
+            # Answered from the response cache, nothing was sent
+            reservation.reconcile(0, 0)
+        elif usage:
+            input_tokens = usage["input_tokens"]
+            if not self.CACHE_READS_COUNT_TOWARDS_RATE_LIMITS:
+                input_tokens -= usage["cached_input_tokens"]
+            reservation.reconcile(input_tokens, usage["output_tokens"])
+
+    def learn_reference_positions(
+        self,
+        first_batch: PlannedBatch,
+        first_result: tuple[list[str], dict[str, list[str]]],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+    ) -> tuple[int, list[int], list[float]]:
+        """
+        Learn where references continue after the first batch, and how fast they advance.
+
+        Returns:
+            Tuple of (anchor paragraph, offset in each reference text at the anchor,
+            reference chars per original char for each reference)
+        """
+        anchor = len(first_batch["paragraphs"])
+        anchor_offsets = [0] * len(additional_sources_texts)
+        ratios = [1.0] * len(additional_sources_texts)
+
+        batch_chars = max(len("\n".join(first_batch["paragraphs"])), 1)
+        for i, (lang_code, text) in enumerate(zip(additional_sources_languages, additional_sources_texts)):
+            refs = first_result[1].get(LANGUAGES.get(lang_code, lang_code), [])
+            anchor_offsets[i] = self.locate_consumed_end(text, 0, refs)
+            if anchor_offsets[i] > 0:
+                ratios[i] = anchor_offsets[i] / batch_chars
+        logger.info("Reference char ratios learned from first batch: %s", ratios)
+
+        return anchor, anchor_offsets, ratios
+
+    def plan_concurrent_batches(
+        self,
+        planner: BatchPlanner,
+        anchor: int,
+        anchor_offsets: list[int],
+        ratios: list[float],
+    ) -> list[PlannedBatch]:
+        """
+        Plan all batches from paragraph `anchor` on, with reference slices at their estimated positions.
+        """
+        references_texts = planner.additional_sources_texts
+
+        planned: list[PlannedBatch] = []
+        start = anchor
+        while start < len(planner.paragraphs):
+            # planner.chars holds the char offset of each paragraph within the original text
+            distance = planner.chars[start] - planner.chars[anchor]
+            reference_starts = [
+                anchor_offset + int(distance * ratio)
+                for anchor_offset, ratio in zip(anchor_offsets, ratios)
+            ]
+            batch = planner.plan(start, reference_starts)
+
+            # Move each estimated slice back by the overlap, keeping its (already budgeted)
+            # length unless it already reaches the end of the reference text
+            if references_texts:
+                batch_chars = len("\n".join(batch["paragraphs"]))
+                for i, (text, ratio) in enumerate(zip(references_texts, ratios)):
+                    if planner.reference_spans[i] is not None:
+                        continue
+                    slice_start = batch["reference_starts"][i]
+                    slice_end = slice_start + len(batch["additional_sources_texts"][i])
+                    shifted_start = max(
+                        anchor_offsets[i],
+                        slice_start - int(batch_chars * ratio * REFERENCE_SLICE_OVERLAP),
+                    )
+                    if slice_end < len(text):
+                        slice_end -= slice_start - shifted_start
+                    batch["reference_starts"][i] = shifted_start
+                    batch["additional_sources_texts"][i] = text[shifted_start:slice_end]
+
+            planned.append(batch)
+            start += len(batch["paragraphs"])
+
+        logger.info("Planned %d concurrent batches for %d paragraphs (max %d in flight)",
+                    len(planned), len(planner.paragraphs), self.options.max_concurrent_batches)
+
+        return planned
+
+    def assemble_batch_results(
+        self,
+        batch_results: list[tuple[list[str], dict[str, list[str]]]],
+        last_batch: PlannedBatch | None,
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        task_prompt: str | None = None,
+    ) -> TranslationResult:
+        """
+        Join per-batch results in paragraph order and compute the remaining reference texts.
+        """
+        all_translated_paragraphs: list[str] = []
+        all_references_by_language: dict[str, list[str]] = {
+            LANGUAGES[lang]: [] for lang in additional_sources_languages
+        } if additional_sources_languages else {}
+
+        for translations, references_by_language in batch_results:
+            all_translated_paragraphs.extend(translations)
+            for lang_name, refs in references_by_language.items():
+                all_references_by_language[lang_name].extend(refs)
+
+        remaining_additional_sources_texts = []
+        if additional_sources_texts and last_batch:
+            last_refs = batch_results[-1][1]
+            for lang_code, text, offset in zip(additional_sources_languages, additional_sources_texts, last_batch["reference_starts"]):
+                refs = last_refs.get(LANGUAGES.get(lang_code, lang_code), [])
+                remaining_additional_sources_texts.append(text[self.locate_consumed_end(text, offset, refs):])
+
+        logger.info("Translation completed: %d paragraphs in %d batches",
+                   len(all_translated_paragraphs), len(batch_results))
+
+        return TranslationResult(
+            translated_paragraphs=all_translated_paragraphs,
+            references_by_language=all_references_by_language,
+            remaining_additional_sources_texts=remaining_additional_sources_texts,
+            properties=self.get_result_properties(task_prompt=task_prompt),
+        )
+
+    def translate_paragraphs_concurrently(
+        self,
+        original_language: str,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        task_prompt: str,
+    ) -> TranslationResult:
+        """
+        Translate paragraphs by planning all batches up front and sending them in parallel.
+
+        References cannot be consumed batch after batch here. Aligned references
+        (see BatchPlanner) give every batch its slice directly. Otherwise every batch
+        gets a slice starting at its estimated position in each reference text.
+        Positions follow the char ratio between each reference and the original, which
+        is learned from the first batch: it is sent alone, and consumes its references
+        exactly like the sequential mode does.
+
+        Returns:
+            TranslationResult with translations and references in paragraph order
+        """
+        references_texts = additional_sources_texts or []
+        batch_results: list[tuple[list[str], dict[str, list[str]]]] = []
+        planner = BatchPlanner(
+            self, task_prompt, paragraphs, references_texts, original_language, translate_language,
+            self.align_reference_texts(paragraphs, references_texts),
+        )
+
+        # Reference offsets anchored at paragraph `anchor`, and chars per original char
+        anchor = 0
+        anchor_offsets = [0] * len(references_texts)
+        ratios = [1.0] * len(references_texts)
+
+        last_batch: PlannedBatch | None = None
+
+        if references_texts and not planner.aligned:
+            first_batch = planner.plan(0, anchor_offsets)
+            first_result = self.translate_batch(
+                original_language, first_batch, additional_sources_languages, translate_language, task_prompt, planner
+            )
+            batch_results.append(first_result)
+            last_batch = first_batch
+            anchor, anchor_offsets, ratios = self.learn_reference_positions(
+                first_batch, first_result, additional_sources_languages, references_texts
+            )
+
+        planned = self.plan_concurrent_batches(planner, anchor, anchor_offsets, ratios)
+
+        with ThreadPoolExecutor(max_workers=self.options.max_concurrent_batches) as executor:
+            futures = []
+            try:
+                # Each batch waits for its TPM budget in translate_batch
+                for batch in planned:
+                    futures.append(executor.submit(
+                        self.translate_batch,
+                        original_language, batch, additional_sources_languages, translate_language, task_prompt, planner,
+                    ))
+                batch_results.extend(future.result() for future in futures)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if planned:
+            last_batch = planned[-1]
+
+        return self.assemble_batch_results(
+            batch_results, last_batch, additional_sources_languages, references_texts, task_prompt
+        )
+
+    async def atranslate_paragraphs_concurrently(
+        self,
+        original_language: str,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        task_prompt: str,
+    ) -> TranslationResult:
+        """
+        Async version of translate_paragraphs_concurrently.
+
+        Batches run as tasks on the event loop, at most max_concurrent_batches at a time.
+        """
+        references_texts = additional_sources_texts or []
+        batch_results: list[tuple[list[str], dict[str, list[str]]]] = []
+        # Aligning and tokenizing whole books is CPU bound, keep it off the event loop
+        reference_spans = await asyncio.to_thread(self.align_reference_texts, paragraphs, references_texts)
+        planner = await asyncio.to_thread(
+            BatchPlanner, self, task_prompt, paragraphs, references_texts, original_language, translate_language,
+            reference_spans,
+        )
+
+        anchor = 0
+        anchor_offsets = [0] * len(references_texts)
+        ratios = [1.0] * len(references_texts)
+
+        last_batch: PlannedBatch | None = None
+
+        if references_texts and not planner.aligned:
+            first_batch = planner.plan(0, anchor_offsets)
+            first_result = await self.atranslate_batch(
+                original_language, first_batch, additional_sources_languages, translate_language, task_prompt, planner
+            )
+            batch_results.append(first_result)
+            last_batch = first_batch
+            anchor, anchor_offsets, ratios = self.learn_reference_positions(
+                first_batch, first_result, additional_sources_languages, references_texts
+            )
+
+        planned = self.plan_concurrent_batches(planner, anchor, anchor_offsets, ratios)
+        semaphore = asyncio.Semaphore(self.options.max_concurrent_batches)
+
+        async def run(batch: PlannedBatch):
+            async with semaphore:
+                return await self.atranslate_batch(
+                    original_language, batch, additional_sources_languages, translate_language, task_prompt, planner
+                )
+
+        tasks = []
+        try:
+            for batch in planned:
+                tasks.append(asyncio.ensure_future(run(batch)))
+            batch_results.extend(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        if planned:
+            last_batch = planned[-1]
+
+        return self.assemble_batch_results(
+            batch_results, last_batch, additional_sources_languages, references_texts, task_prompt
+        )
+
+    def parse_translation_text(
+        self,
+        text: str,
+        original_paragraphs: list[str] | None = None,
+        reference_languages: list[str] | None = None,
+    ) -> list[TranslatedParagraph]:
+        """Parse a complete response text, as returned by the batch APIs, to original_paragraphs"""
+        originals = None
+        if self.options.lean_response and original_paragraphs is not None:
+            originals = {i + 1: paragraph for i, paragraph in enumerate(original_paragraphs)}
+        parser = self.create_response_parser(reference_languages)
+        paragraphs = [
+            validate_translated_paragraph(para, index, originals)
+            for index, para in enumerate(parser.feed(text) + parser.finish())
+        ]
+        if original_paragraphs is None:
+            if not paragraphs:
+                raise ValueError("No paragraphs in response")
+        else:
+            check_paragraph_count(len(paragraphs), len(original_paragraphs))
+        return paragraphs
+
+    def submit_bulk_translation(
+        self,
+        original_language: str,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        task_prompt: str | None = None,
+    ) -> BulkTranslation:
+        """
+        Plan all batches like translate_paragraphs_concurrently and submit them as one
+        provider batch, see collect_bulk_translation for the results.
+
+        Batch APIs cost about half and have their own rate limits, but results may take
+        up to 24 hours. With references that cannot be aligned the first batch is still
+        sent interactively, to learn where the other batches' reference slices start.
+
+        Returns:
+            BulkTranslation to keep until the results are collected (JSON serializable)
+        """
+        if not task_prompt:
+            task_prompt = get_task_prompt(
+                original_language=original_language,
+                additional_sources_languages=additional_sources_languages,
+                translate_language=translate_language,
+            )
+
+        references_texts = additional_sources_texts or []
+        planner = BatchPlanner(
+            self, task_prompt, paragraphs, references_texts, original_language, translate_language,
+            self.align_reference_texts(paragraphs, references_texts),
+        )
+
+        anchor = 0
+        anchor_offsets = [0] * len(references_texts)
+        ratios = [1.0] * len(references_texts)
+        first_batch: PlannedBatch | None = None
+        first_result = None
+
+        if references_texts and not planner.aligned:
+            first_batch = planner.plan(0, anchor_offsets)
+            first_result = self.translate_batch(
+                original_language, first_batch, additional_sources_languages, translate_language, task_prompt, planner
+            )
+            anchor, anchor_offsets, ratios = self.learn_reference_positions(
+                first_batch, first_result, additional_sources_languages, references_texts
+            )
+
+        planned = self.plan_concurrent_batches(planner, anchor, anchor_offsets, ratios)
+
+        batch_id = None
+        if planned:
+            batch_id = self.submit_bulk_requests([
+                BulkRequest(
+                    custom_id=str(i),
+                    task_prompt=self.get_request_task_prompt(task_prompt),
+                    input_text=self.format_batch_input(original_language, batch, additional_sources_languages, translate_language),
+                    max_output_tokens=batch["max_output_tokens"],
+                )
+                for i, batch in enumerate(planned)
+            ])
+            logger.info("Submitted %d batches (%d paragraphs) as %s batch %s",
+                        len(planned), len(paragraphs) - anchor, self.options.provider.value, batch_id)
+
+        return BulkTranslation(
+            batch_id=batch_id,
+            task_prompt=task_prompt,
+            batches=planned,
+            first_batch=first_batch,
+            first_result=first_result,
+            token_usage=self.get_token_usage(),
+        )
+
+    def collect_bulk_translation(
+        self,
+        bulk: BulkTranslation,
+        original_language: str,
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        on_batch_sent: Callable[[], None] | None = None,
+    ) -> TranslationResult | None:
+        """
+        Assemble the results of a bulk translation once its provider batch ended.
+
+        Batches whose request failed, expired or could not be parsed are sent again
+        interactively, truncated ones as two halves (like translate_batch).
+
+        Args:
+            on_batch_sent: Called after each batch that was sent again
+
+        Returns:
+            TranslationResult, or None while the provider batch is still processing
+        """
+        results: dict[str, BulkResult] = {}
+        if bulk["batch_id"]:
+            results = self.get_bulk_results(bulk["batch_id"])
+            if results is None:
+                return None
+
+        self.record_usage(**bulk["token_usage"])
+        batch_results: list[tuple[list[str], dict[str, list[str]]]] = []
+        last_batch = bulk["first_batch"]
+        if bulk["first_result"]:
+            translations, references_by_language = bulk["first_result"]
+            batch_results.append((translations, references_by_language))
+
+        task_prompt = bulk["task_prompt"]
+        lang_names = [LANGUAGES.get(lang_code, lang_code) for lang_code in additional_sources_languages]
+        for i, batch in enumerate(bulk["batches"]):
+            last_batch = batch
+            result = results.get(str(i))
+            _response_usage.set(None)
+            if result and result["usage"]:
+                self.record_usage(**result["usage"])
+
+            if result and result["truncated"]:
+                halves = self.split_planned_batch(batch, TruncatedResponseError(
+                    f"Bulk response was truncated at {batch['max_output_tokens']} output tokens."
+                ))
+                batch_results.append(self.merge_batch_results([
+                    self.translate_batch(original_language, half, additional_sources_languages, translate_language, task_prompt)
+                    for half in halves
+                ]))
+                if on_batch_sent:
+                    on_batch_sent()
+                continue
+
+            translated_batch = None
+            if result and result["text"] is not None:
+                try:
+                    translated_batch = self.parse_translation_text(result["text"], batch["paragraphs"], lang_names)
+                except ValueError as e:
+                    logger.warning("Could not parse bulk result of batch %d: %s", i, e)
+            if translated_batch is not None and len(translated_batch) != len(batch["paragraphs"]):
+                logger.warning("Bulk result of batch %d has %d paragraphs instead of %d",
+                               i, len(translated_batch), len(batch["paragraphs"]))
+                translated_batch = None
+
+            if translated_batch is None:
+                logger.warning("Batch %d of %s batch %s has no usable result (%s), sending it again",
+                               i, self.options.provider.value, bulk["batch_id"],
+                               result["error"] if result else "missing")
+                batch_results.append(self.translate_batch(
+                    original_language, batch, additional_sources_languages, translate_language, task_prompt
+                ))
+                if on_batch_sent:
+                    on_batch_sent()
+                continue
+
+            self.record_output_usage(
+                batch["paragraphs"], original_language, translate_language, len(additional_sources_languages or [])
+            )
+            batch_results.append(self.collect_batch_results(translated_batch, additional_sources_languages))
+
+        return self.assemble_batch_results(
+            batch_results, last_batch, additional_sources_languages, additional_sources_texts or [], task_prompt
+        )
+
+    def get_result_properties(self, with_usage: bool = True, task_prompt: str | None = None) -> dict:
+        """
+        Properties describing how the translation was produced (stored with segments).
+
+        Args:
+            with_usage: Include the tokens used so far, with those read from or written to the prompt cache,
+                and the number of responses answered from the response cache
+            task_prompt: Include its hash, the translation memory only reuses translations made with the same prompt
+        """
+        properties = {
+            "provider": self.options.provider.value,
+            "model": self.options.model,
+            "temperature": self.options.temperature,
+        }
+        if task_prompt:
+            properties["prompt_hash"] = get_prompt_hash(task_prompt)
+        if with_usage:
+            properties["token_usage"] = self.get_token_usage()
+            if self.cached_responses:
+                properties["cached_responses"] = self.cached_responses
+        return properties
+
+    def estimate_num_batches(
+        self,
+        task_prompt: str,
+        paragraphs: list[str],
+        additional_sources_texts: list[str] | None = None,
+        original_language: str | None = None,
+        translate_language: str | None = None,
+    ) -> int:
+        """Number of batches a translation of paragraphs would be sent in (0 if nothing fits)"""
+        planner = BatchPlanner(self, task_prompt, paragraphs, additional_sources_texts, original_language, translate_language)
+        num_batches = 0
+        start = 0
+        try:
+            while start < len(paragraphs):
+                start += len(planner.plan(start)["paragraphs"])
+                num_batches += 1
+        except ValueError:
+            return 0
+        return num_batches
+
+    def align_reference_texts(
+        self,
+        paragraphs: list[str],
+        additional_sources_texts: list[str] | None,
+    ) -> list[list[tuple[int, int]] | None]:
+        """
+        Reference spans of a translation's BatchPlanner: each reference text aligned to
+        the paragraphs (see services.reference_alignment), None where it cannot be or
+        options.align_references is off.
+
+        Aligning takes seconds for a book, it is done once per translation. Estimates
+        only count batches and plan with unaligned windows.
+        """
+        texts = additional_sources_texts or []
+        if not self.options.align_references:
+            return [None] * len(texts)
+        return [align_reference(paragraphs, text) for text in texts]
+
+    def start_translation(
+        self,
+        original_language: str,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        task_prompt: str | None = None,
+        checkpoint_store: CheckpointStore | None = None,
+    ) -> TranslationProgress:
+        """
+        Prepare a sequential translation, to be run with iter_translation or aiter_translation.
+
+        Builds the default task prompt if none is given, tokenizes the input and aligns
+        the references once.
+        With a checkpoint_store, resumes from a checkpoint of the same request if there is one.
+        """
+        if not task_prompt:
+            task_prompt = get_task_prompt(
+                original_language=original_language,
+                additional_sources_languages=additional_sources_languages,
+                translate_language=translate_language,
+            )
+
+        return TranslationProgress(
+            self,
+            original_language=original_language,
+            paragraphs=paragraphs,
+            additional_sources_languages=additional_sources_languages,
+            additional_sources_texts=additional_sources_texts,
+            translate_language=translate_language,
+            task_prompt=task_prompt,
+            checkpoint_store=checkpoint_store,
+            reference_spans=self.align_reference_texts(paragraphs, additional_sources_texts),
+        )
+
     def translate_paragraphs(
         self,
         original_language: str,
@@ -340,12 +2041,20 @@ class BaseTranslationProvider(ABC):
         additional_sources_languages: list[str],
         additional_sources_texts: list[str],
         translate_language: str,
-        task_prompt: str | None = None
+        task_prompt: str | None = None,
+        checkpoint_store: CheckpointStore | None = None,
     ) -> TranslationResult:
         """
         Translate paragraphs with optional reference sources.
 
         Handles large documents by batching paragraphs to fit within model context.
+        When options.max_concurrent_batches > 1 batches are sent in parallel,
+        see translate_paragraphs_concurrently.
+
+        Without reference sources, a paragraph repeated in the request (headings,
+        refrains) is sent once and its translation copied to every occurrence.
+        References are consumed in paragraph order, so with reference sources every
+        occurrence is translated with its own references.
 
         Args:
             original_language: Language code of original text
@@ -354,21 +2063,12 @@ class BaseTranslationProvider(ABC):
             additional_sources_texts: Full text of each reference source
             translate_language: Target language code
             task_prompt: Optional custom task prompt (Part 1). If not provided, default prompt is used.
+            checkpoint_store: Optional store for per-batch checkpoints (sequential mode only),
+                a retry of a failed request resumes from its first unfinished batch.
 
         Returns:
             TranslationResult with translations, references, remaining texts, and properties
         """
-        remaining_paragraphs = paragraphs.copy()
-        remaining_additional_sources_texts = additional_sources_texts.copy() if additional_sources_texts else []
-
-        all_translated_paragraphs: list[str] = []
-        all_references_by_language: dict[str, list[str]] = {
-            LANGUAGES[lang]: [] for lang in additional_sources_languages
-        } if additional_sources_languages else {}
-
-        batch_num = 0
-        paragraph_offset = 0
-
         # Build task prompt once at the beginning (if not provided)
         if not task_prompt:
             task_prompt = get_task_prompt(
@@ -377,77 +2077,196 @@ class BaseTranslationProvider(ABC):
                 translate_language=translate_language,
             )
 
-        while remaining_paragraphs:
-            batch_num += 1
-            logger.info("Processing batch %d, %d paragraphs remaining", batch_num, len(remaining_paragraphs))
+        paragraphs, positions = self.dedupe_request_paragraphs(paragraphs, additional_sources_languages)
 
-            # Determine how many paragraphs fit and limit additional sources proportionally
-            paragraphs_to_translate, limited_additional_sources_texts, available_output_tokens = self.reduce_paragraphs_to_fit(
+        if self.options.max_concurrent_batches > 1:
+            result = self.translate_paragraphs_concurrently(
+                original_language=original_language,
+                paragraphs=paragraphs,
+                additional_sources_languages=additional_sources_languages,
+                additional_sources_texts=additional_sources_texts,
+                translate_language=translate_language,
                 task_prompt=task_prompt,
-                paragraphs=remaining_paragraphs,
-                additional_sources_texts=remaining_additional_sources_texts if remaining_additional_sources_texts else None
             )
+            return self.expand_duplicate_paragraphs(result, positions)
+
+        progress = self.start_translation(
+            original_language=original_language,
+            paragraphs=paragraphs,
+            additional_sources_languages=additional_sources_languages,
+            additional_sources_texts=additional_sources_texts,
+            translate_language=translate_language,
+            task_prompt=task_prompt,
+            checkpoint_store=checkpoint_store,
+        )
+        for _ in self.iter_translation(progress):
+            pass
 
-            # Build input text (Part 2) for this batch
-            input_text = format_input(
+        return self.expand_duplicate_paragraphs(progress.result(), positions)
+
+    async def atranslate_paragraphs(
+        self,
+        original_language: str,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+        additional_sources_texts: list[str],
+        translate_language: str,
+        task_prompt: str | None = None,
+        checkpoint_store: CheckpointStore | None = None,
+    ) -> TranslationResult:
+        """
+        Async version of translate_paragraphs, using the providers' async clients.
+
+        Waiting on the API does not hold a thread, only tokenizing the input does.
+        """
+        if not task_prompt:
+            task_prompt = get_task_prompt(
                 original_language=original_language,
-                original_paragraphs=paragraphs_to_translate,
                 additional_sources_languages=additional_sources_languages,
-                additional_sources_texts=limited_additional_sources_texts,
                 translate_language=translate_language,
             )
 
-            # Send batch for translation with dynamically calculated output token budget
-            translated_batch = self.send_for_translation(
+        paragraphs, positions = self.dedupe_request_paragraphs(paragraphs, additional_sources_languages)
+
+        if self.options.max_concurrent_batches > 1:
+            result = await self.atranslate_paragraphs_concurrently(
+                original_language=original_language,
+                paragraphs=paragraphs,
+                additional_sources_languages=additional_sources_languages,
+                additional_sources_texts=additional_sources_texts,
+                translate_language=translate_language,
                 task_prompt=task_prompt,
-                input_text=input_text,
-                max_output_tokens=available_output_tokens,
             )
+            return self.expand_duplicate_paragraphs(result, positions)
+
+        # Tokenizing whole books is CPU bound, keep it off the event loop
+        progress = await asyncio.to_thread(
+            self.start_translation,
+            original_language,
+            paragraphs,
+            additional_sources_languages,
+            additional_sources_texts,
+            translate_language,
+            task_prompt,
+            checkpoint_store,
+        )
 
-            # Extract results from batch
-            batch_references_by_language: dict[str, list[str]] = {
-                LANGUAGES[lang]: [] for lang in additional_sources_languages
-            } if additional_sources_languages else {}
-
-            for para in translated_batch:
-                all_translated_paragraphs.append(para["translation"])
-
-                # Extract references
-                references = para.get("references", {})
-                for lang_name, ref_text in references.items():
-                    if lang_name in batch_references_by_language:
-                        batch_references_by_language[lang_name].append(ref_text)
-                    if lang_name in all_references_by_language:
-                        all_references_by_language[lang_name].append(ref_text)
-
-            # Update remaining texts
-            if additional_sources_languages and remaining_additional_sources_texts:
-                remaining_additional_sources_texts = self.rebuild_remaining_texts(
-                    references_by_language=batch_references_by_language,
-                    additional_sources_languages=additional_sources_languages,
-                    remaining_additional_sources_texts=remaining_additional_sources_texts,
-                )
+        async for _ in self.aiter_translation(progress):
+            pass
 
-            # Move to next batch
-            num_translated = len(paragraphs_to_translate)
-            remaining_paragraphs = remaining_paragraphs[num_translated:]
-            paragraph_offset += num_translated
+        return self.expand_duplicate_paragraphs(progress.result(), positions)
 
-            logger.debug("Batch %d: translated %d paragraphs, %d remaining",
-                        batch_num, num_translated, len(remaining_paragraphs))
+    def dedupe_request_paragraphs(
+        self,
+        paragraphs: list[str],
+        additional_sources_languages: list[str],
+    ) -> tuple[list[str], list[int] | None]:
+        """
+        Paragraphs to send for a translate request, see translate_paragraphs.
 
-        properties = {
-            "provider": self.options.provider.value,
-            "model": self.options.model,
-            "temperature": self.options.temperature,
-        }
+        Returns:
+            Tuple of (paragraphs to translate, index in them of every requested
+            paragraph or None when all are sent)
+        """
+        if additional_sources_languages:
+            return paragraphs, None
+        unique, positions = dedupe_paragraphs(paragraphs)
+        if len(unique) == len(paragraphs):
+            return paragraphs, None
+        logger.info("Translating %d distinct paragraphs of %d requested", len(unique), len(paragraphs))
+        return unique, positions
+
+    def expand_duplicate_paragraphs(self, result: TranslationResult, positions: list[int] | None) -> TranslationResult:
+        """
+        Copy the translations of deduplicated paragraphs back to every requested position.
 
-        logger.info("Translation completed: %d paragraphs in %d batches",
-                   len(all_translated_paragraphs), batch_num)
+        Raises:
+            ValueError: If not every deduplicated paragraph was translated
+        """
+        if positions is None:
+            return result
+        translations = result["translated_paragraphs"]
+        check_paragraph_count(len(translations), max(positions) + 1)
+        result["translated_paragraphs"] = [translations[index] for index in positions]
+        result["properties"]["duplicate_paragraphs"] = len(positions) - len(translations)
+        return result
+
+    def iter_translation(self, progress: TranslationProgress, stream: bool = False) -> Iterator[TranslationEvent]:
+        """
+        Translate batch by batch, yielding each paragraph as it is translated.
 
-        return TranslationResult(
-            translated_paragraphs=all_translated_paragraphs,
-            references_by_language=all_references_by_language,
-            remaining_additional_sources_texts=remaining_additional_sources_texts,
-            properties=properties,
-        )
+        With stream=True responses are read with stream_for_translation, so the first
+        paragraphs arrive while the model is still generating the rest of the batch.
+        Batches are always sent sequentially, max_concurrent_batches is ignored.
+
+        Args:
+            progress: Translation prepared by start_translation
+            stream: Yield paragraphs while each response is generated
+
+        Yields:
+            A "paragraph" TranslationEvent per paragraph in order (starting with the
+            paragraphs restored from a checkpoint), then one "done" event with the
+            remaining reference texts
+        """
+        send = self.stream_for_translation if stream else self.send_for_translation
+        yield from progress.replay()
+
+        while (next_batch := progress.next_batch()) is not None:
+            batch, input_text = next_batch
+            truncation = None
+            reservation = self.reserve_batch(batch)
+            try:
+                for para in send(
+                    task_prompt=progress.task_prompt,
+                    input_text=input_text,
+                    max_output_tokens=batch["max_output_tokens"],
+                ):
+                    yield progress.add_paragraph(para)
+            except TruncatedResponseError as e:
+                truncation = e
+            finally:
+                # Also on errors and when the consumer stops reading (a client disconnect)
+                self.settle_reservation(reservation)
+
+            if truncation:
+                progress.split_batch(truncation)
+                continue
+            progress.finish_batch()
+
+        yield progress.finish()
+
+    async def aiter_translation(self, progress: TranslationProgress, stream: bool = False) -> AsyncIterator[TranslationEvent]:
+        """Async version of iter_translation"""
+        for event in progress.replay():
+            yield event
+
+        while (next_batch := progress.next_batch()) is not None:
+            batch, input_text = next_batch
+            truncation = None
+            reservation = await self.areserve_batch(batch)
+            try:
+                if stream:
+                    async for para in self.astream_for_translation(
+                        task_prompt=progress.task_prompt,
+                        input_text=input_text,
+                        max_output_tokens=batch["max_output_tokens"],
+                    ):
+                        yield progress.add_paragraph(para)
+                else:
+                    for para in await self.asend_for_translation(
+                        task_prompt=progress.task_prompt,
+                        input_text=input_text,
+                        max_output_tokens=batch["max_output_tokens"],
+                    ):
+                        yield progress.add_paragraph(para)
+            except TruncatedResponseError as e:
+                truncation = e
+            finally:
+                self.settle_reservation(reservation)
+
+            if truncation:
+                await progress.asplit_batch(truncation)
+                continue
+            await progress.afinish_batch()
+
+        yield await progress.afinish()
@@ -0,0 +1,49 @@
+"""
+Per-batch translation checkpoints stored in the translation_checkpoints table.
+
+A failed translation leaves the checkpoint of its last finished batch behind,
+a retry of the same request (same provider, model, languages, prompt and texts)
+resumes from there. Finished translations delete their checkpoint.
+"""
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+
+from db import db
+from models import TranslationCheckpoints
+from services.base_provider import CheckpointStore, TranslationCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints of requests that were never retried are dropped after this many hours
+CHECKPOINT_TTL_HOURS = int(os.getenv("TRANSLATION_CHECKPOINT_TTL_HOURS", "72"))
+
+
+class DatabaseCheckpointStore(CheckpointStore):
+    def load(self, key: str) -> TranslationCheckpoint | None:
+        now = datetime.now(timezone.utc)
+        TranslationCheckpoints.delete().where(
+            TranslationCheckpoints.updated_at < now - timedelta(hours=CHECKPOINT_TTL_HOURS)
+        ).execute()
+
+        checkpoint = TranslationCheckpoints.get_or_none(TranslationCheckpoints.key == key)
+        return checkpoint.state if checkpoint else None
+
+    def save(self, key: str, checkpoint: TranslationCheckpoint):
+        # A savepoint inside the transaction of a job storing its segments, a failed save doesn't abort it
+        with db.atomic():
+            TranslationCheckpoints.insert(
+                key=key,
+                state=checkpoint,
+                updated_at=datetime.now(timezone.utc),
+            ).on_conflict(
+                conflict_target=[TranslationCheckpoints.key],
+                preserve=[TranslationCheckpoints.state, TranslationCheckpoints.updated_at],
+            ).execute()
+        logger.debug("Saved translation checkpoint %s after batch %d", key[:12], checkpoint["batch_num"])
+
+    def delete(self, key: str):
+        TranslationCheckpoints.delete().where(TranslationCheckpoints.key == key).execute()
+
+
+translation_checkpoints = DatabaseCheckpointStore()
@@ -1,12 +1,14 @@
-import tiktoken
+import json
 import logging
 import anthropic
-from anthropic import Anthropic
 from datetime import datetime
-import json
+from typing import AsyncIterator, Iterator
 
-from models import TranslationServiceOptions
-from services.base_provider import BaseTranslationProvider, TranslatedParagraph, OTHER_LANG_TEXT_MULTIPLIER, strip_markdown_json_fences, repair_json_quotes
+from models import OutputFormat, TranslationServiceOptions
+from services.base_provider import BaseTranslationProvider, BulkRequest, BulkResult, TruncatedResponseError
+from services.client_pool import get_anthropic_client, get_async_anthropic_client, get_encoding
+from services.prompt import get_input_reference_languages, get_response_schema
+from services.token_cache import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +19,9 @@ PROVIDER_LABEL = "Claude"
 # Available models with their specifications
 # List obtained from: curl https://api.anthropic.com/v1/models
 # Pricing is approximate as of 2025-2026 (per MTok)
+# Default rate limits per minute (usage tier 1), 0 means no such limit.
+# Override them per deployment with RATE_LIMITS / RATE_LIMITS_FILE (see services/rate_limits.py)
+# Optional "output_format": default response format of the model (models.OutputFormat), JSON if not set
 CLAUDE_MODELS = [
     {
         "value": "claude-sonnet-4-5-20250929",
@@ -25,6 +30,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 3.0,   # $3/MTok
         "output_price": 15.0,  # $15/MTok
+        "cached_input_price": 0.3,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 3.75,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 30000, "otpm": 8000, "tpm": 0},
         "description": "Balanced performance and cost"
     },
     {
@@ -34,6 +42,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 15.0,   # $15/MTok
         "output_price": 75.0,  # $75/MTok
+        "cached_input_price": 1.5,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 18.75,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 30000, "otpm": 8000, "tpm": 0},
         "description": "Most capable, highest cost"
     },
     {
@@ -43,6 +54,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 15.0,
         "output_price": 75.0,
+        "cached_input_price": 1.5,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 18.75,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 30000, "otpm": 8000, "tpm": 0},
         "description": "High capability, premium pricing"
     },
     {
@@ -52,6 +66,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 8192,
         "input_price": 1.0,    # $1/MTok
         "output_price": 5.0,   # $5/MTok
+        "cached_input_price": 0.1,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 1.25,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 50000, "otpm": 10000, "tpm": 0},
         "description": "Fast and cost-effective"
     },
     {
@@ -61,6 +78,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 15.0,
         "output_price": 75.0,
+        "cached_input_price": 1.5,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 18.75,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 30000, "otpm": 8000, "tpm": 0},
         "description": "Previous Opus version"
     },
     {
@@ -70,6 +90,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 15.0,
         "output_price": 75.0,
+        "cached_input_price": 1.5,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 18.75,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 30000, "otpm": 8000, "tpm": 0},
         "description": "Original Opus 4"
     },
     {
@@ -79,6 +102,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 3.0,
         "output_price": 15.0,
+        "cached_input_price": 0.3,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 3.75,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 30000, "otpm": 8000, "tpm": 0},
         "description": "Original Sonnet 4"
     },
     {
@@ -88,6 +114,9 @@ CLAUDE_MODELS = [
         "max_output_tokens": 8192,
         "input_price": 1.0,
         "output_price": 5.0,
+        "cached_input_price": 0.1,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 1.25,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 50000, "otpm": 10000, "tpm": 0},
         "description": "Budget-friendly option"
     },
     {
@@ -97,20 +126,34 @@ CLAUDE_MODELS = [
         "max_output_tokens": 4096,
         "input_price": 0.8,    # $0.8/MTok
         "output_price": 4.0,   # $4/MTok
+        "cached_input_price": 0.08,  # Prompt cache reads, 0.1x input
+        "cache_write_price": 1.0,  # Prompt cache writes (5 minutes), 1.25x input
+        "rate_limits": {"rpm": 50, "itpm": 50000, "otpm": 10000, "tpm": 0},
         "description": "Lowest cost option"
     },
 ]
 
+# Tool the model must call with the translation in structured output mode
+TRANSLATION_TOOL_NAME = "submit_translation"
+
 
 class ClaudeProvider(BaseTranslationProvider):
     """Anthropic Claude translation provider"""
 
+    # Cache reads don't count towards ITPM on current models
+    CACHE_READS_COUNT_TOWARDS_RATE_LIMITS = False
+
     def __init__(self, api_key: str, options: TranslationServiceOptions):
         super().__init__(api_key, options)
-        self.client = Anthropic(api_key=api_key)
+        # Clients and encodings are shared by all requests, see services/client_pool.py
+        self.client = get_anthropic_client(api_key)
         # Use tiktoken as approximation for Claude token counting (MVP approach)
         # Claude uses similar tokenization to OpenAI
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.encoding = get_encoding("cl100k_base")
+
+    def get_async_client(self) -> anthropic.AsyncAnthropic:
+        """Shared async client of the running event loop, see services/client_pool.py"""
+        return get_async_anthropic_client(self.api_key)
 
     def get_model_token_limit(self) -> dict:
         """Return context window and max output tokens for Claude models"""
@@ -135,45 +178,148 @@ class ClaudeProvider(BaseTranslationProvider):
         Uses tiktoken approximation (close enough for MVP).
         """
         # Task prompt tokens
-        prompt_tokens = len(self.encoding.encode(task_prompt))
+        prompt_tokens = count_tokens(self.encoding, self.get_request_task_prompt(task_prompt))
 
-        # Original paragraphs tokens (estimate with XML overhead)
-        paragraphs_text = "\n".join(f'<p id="{i}">{p}</p>' for i, p in enumerate(original_paragraphs))
-        paragraphs_tokens = len(self.encoding.encode(paragraphs_text))
+        # Original paragraphs tokens (each paragraph cached separately, plus tag overhead)
+        paragraphs_tokens = sum(count_tokens(self.encoding, p) for p in original_paragraphs)
+        paragraphs_tokens += len(original_paragraphs) * count_tokens(self.encoding, self.get_paragraph_tag())
 
         # Additional sources tokens
         sources_tokens = 0
         if additional_sources_texts:
             for text in additional_sources_texts:
-                sources_tokens += len(self.encoding.encode(text))
+                sources_tokens += count_tokens(self.encoding, text)
 
         return prompt_tokens + paragraphs_tokens + sources_tokens
 
-    def estimate_output_tokens(self, original_paragraphs: list[str], num_references: int) -> int:
+    def estimate_output_tokens(
+        self,
+        original_paragraphs: list[str],
+        num_references: int,
+        original_language: str | None = None,
+        translate_language: str | None = None,
+    ) -> int:
         """Estimate output tokens based on input size"""
-        # Use same approach as OpenAI for consistency
-        base_estimate = sum(len(self.encoding.encode(p)) for p in original_paragraphs)
-        multiplier = 1 + OTHER_LANG_TEXT_MULTIPLIER + (num_references * OTHER_LANG_TEXT_MULTIPLIER)
-        return int(base_estimate * multiplier)
+        base_estimate = sum(count_tokens(self.encoding, p) for p in original_paragraphs)
+        return int(base_estimate * self.get_output_multiplier(num_references, original_language, translate_language))
+
+    def estimate_prompt_cache_tokens(self, prompt_tokens: int, num_batches: int) -> tuple[int, int]:
+        """The first batch writes the prompt to the cache, the others read it"""
+        cached_input_tokens, _ = super().estimate_prompt_cache_tokens(prompt_tokens, num_batches)
+        if not cached_input_tokens:
+            return 0, 0
+        return cached_input_tokens, prompt_tokens
+
+    def stream_request(self, task_prompt: str, input_text: str, max_output_tokens: int) -> dict:
+        """Arguments of a streamed messages request, shared by the sync and async clients"""
+        request = dict(
+            model=self.options.model,
+            max_tokens=max_output_tokens,
+            temperature=self.options.temperature,
+            # Claude uses separate system parameter. The task prompt is the same for every batch,
+            # the cache breakpoint lets later batches read it from the prompt cache (ignored when
+            # the prompt is shorter than the model's minimum cacheable length).
+            system=[
+                {"type": "text", "text": task_prompt, "cache_control": {"type": "ephemeral"}}
+            ],
+            messages=[
+                {"role": "user", "content": input_text}
+            ]
+        )
+        if self.uses_translation_tool():
+            # The forced tool call's input is the response, validated against the schema
+            request["tools"] = [{
+                "name": TRANSLATION_TOOL_NAME,
+                "description": "Submit the translated paragraphs in the OUTPUT FORMAT.",
+                "input_schema": get_response_schema(get_input_reference_languages(input_text), self.options.lean_response),
+            }]
+            request["tool_choice"] = {"type": "tool", "name": TRANSLATION_TOOL_NAME}
+        return request
+
+    def get_model_output_format(self) -> OutputFormat:
+        """Default response format of the model ("output_format" in CLAUDE_MODELS)"""
+        model = next((model for model in CLAUDE_MODELS if model["value"] == self.options.model), {})
+        return OutputFormat(model.get("output_format", OutputFormat.JSON))
+
+    def uses_translation_tool(self) -> bool:
+        """Structured output mode of JSON responses, tagged responses are plain text"""
+        return self.options.structured_output and self.get_output_format() == OutputFormat.JSON
+
+    def get_message_text(self, message) -> str:
+        """Response text of a message: its text, or the tool input in structured output mode"""
+        for block in message.content:
+            if block.type == "tool_use" and block.name == TRANSLATION_TOOL_NAME:
+                return json.dumps(block.input, ensure_ascii=False)
+        return "".join(block.text for block in message.content if block.type == "text")
+
+    def iter_stream_text(self, stream) -> Iterator[str]:
+        """Response text deltas of a message stream, see get_message_text"""
+        if not self.uses_translation_tool():
+            yield from stream.text_stream
+            return
+        for event in stream:
+            if event.type == "content_block_delta" and event.delta.type == "input_json_delta":
+                yield event.delta.partial_json
+
+    async def aiter_stream_text(self, stream) -> AsyncIterator[str]:
+        """Async version of iter_stream_text"""
+        if not self.uses_translation_tool():
+            async for text in stream.text_stream:
+                yield text
+            return
+        async for event in stream:
+            if event.type == "content_block_delta" and event.delta.type == "input_json_delta":
+                yield event.delta.partial_json
+
+    def get_usage(self, usage) -> dict:
+        """record_usage arguments for the usage of a message"""
+        # input_tokens excludes the tokens read from and written to the prompt cache
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_write = usage.cache_creation_input_tokens or 0
+        return {
+            "input_tokens": usage.input_tokens + cache_read + cache_write,
+            "output_tokens": usage.output_tokens,
+            "cached_input_tokens": cache_read,
+            "cache_write_tokens": cache_write,
+        }
+
+    def check_stream_end(self, response, max_output_tokens: int):
+        """Log token usage of the final streamed message and raise if it was truncated"""
+        recorded = self.get_usage(response.usage)
+        cache_read = recorded["cached_input_tokens"]
+        cache_write = recorded["cache_write_tokens"]
+        self.record_usage(**recorded)
+        logger.info(f"Claude token usage: input={response.usage.input_tokens}, "
+                   f"cache_read={cache_read}, cache_write={cache_write}, "
+                   f"output={response.usage.output_tokens}, "
+                   f"max_tokens_requested={max_output_tokens}")
+
+        if response.stop_reason == "max_tokens":
+            error_msg = (
+                f"Translation response was truncated due to max_tokens limit. "
+                f"Input tokens: {response.usage.input_tokens}, "
+                f"Output tokens: {response.usage.output_tokens}/{max_output_tokens}."
+            )
+            logger.warning(error_msg)
+            raise TruncatedResponseError(error_msg)
 
-    def send_for_translation(
+    def stream_translation_text(
         self,
         task_prompt: str,
         input_text: str,
         max_output_tokens: int,
-    ) -> list[TranslatedParagraph]:
+    ) -> Iterator[str]:
         """
-        Send paragraphs to Claude for translation.
+        Send paragraphs to Claude with streaming and yield response text deltas.
 
         Args:
             task_prompt: Task prompt (Part 1) - system message
             input_text: Input text (Part 2) - user message
             max_output_tokens: Maximum tokens to allocate for output
 
-        Returns:
-            List of TranslatedParagraph objects from LLM response
+        Yields:
+            Response text as it is generated
         """
-
         logger.debug("Sending translation request to Claude")
         logger.debug("Task prompt:\n%s", task_prompt)
         logger.debug("Input:\n%s", input_text)
@@ -181,83 +327,15 @@ class ClaudeProvider(BaseTranslationProvider):
         try:
             start_time = datetime.utcnow()
 
-            response = self.client.messages.create(
-                model=self.options.model,
-                max_tokens=max_output_tokens,
-                temperature=self.options.temperature,
-                system=task_prompt,  # Claude uses separate system parameter
-                messages=[
-                    {"role": "user", "content": input_text}
-                ]
-            )
+            with self.client.messages.stream(**self.stream_request(task_prompt, input_text, max_output_tokens)) as stream:
+                for text in self.iter_stream_text(stream):
+                    yield text
+                response = stream.get_final_message()
 
             duration = (datetime.utcnow() - start_time).total_seconds()
             logger.debug("API call duration: %.2f seconds", duration)
 
-            # Log token usage
-            logger.info(f"Claude token usage: input={response.usage.input_tokens}, "
-                       f"output={response.usage.output_tokens}, "
-                       f"max_tokens_requested={max_output_tokens}")
-
-            if not response.content or len(response.content) == 0:
-                logger.error("Claude returned empty response")
-                raise ValueError("Claude returned empty response")
-
-            # Check stop_reason for truncation
-            if response.stop_reason == "max_tokens":
-                error_msg = (
-                    f"Translation response was truncated due to max_tokens limit. "
-                    f"Input tokens: {response.usage.input_tokens}, "
-                    f"Output tokens: {response.usage.output_tokens}/{max_output_tokens}. "
-                    f"Try translating fewer paragraphs at a time."
-                )
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-
-            # Extract text from response
-            text = response.content[0].text.strip()
-            logger.debug("Raw response:\n%s", text)
-
-            # Strip markdown code fences if present
-            json_text = strip_markdown_json_fences(text)
-
-            try:
-                response_json = json.loads(json_text)
-            except json.JSONDecodeError as e:
-                logger.warning("Failed to parse JSON response: %s", e)
-                # Log the problematic area around the error position
-                error_pos = e.pos if hasattr(e, 'pos') else 0
-                start = max(0, error_pos - 200)
-                end = min(len(json_text), error_pos + 200)
-                context = json_text[start:end]
-                logger.warning("Context around error position %d:", error_pos)
-                logger.warning("...%s...", context)
-
-                # Try to repair common JSON issues (unescaped quotes)
-                logger.info("Attempting to repair JSON with unescaped quotes...")
-                try:
-                    repaired_json = repair_json_quotes(json_text)
-                    response_json = json.loads(repaired_json)
-                    logger.info("Successfully repaired and parsed JSON")
-                except json.JSONDecodeError as repair_error:
-                    logger.error("Failed to repair JSON: %s", repair_error)
-                    logger.error("Full response length: %d characters", len(json_text))
-                    logger.error("First 1000 chars of response: %s", json_text[:1000])
-                    raise ValueError(f"Failed to parse JSON response even after repair: {repair_error}")
-
-            paragraphs = response_json.get("paragraphs", [])
-            if not paragraphs:
-                logger.error("No paragraphs in response")
-                raise ValueError("No paragraphs in response")
-
-            # Validate response structure
-            for i, para in enumerate(paragraphs):
-                if "id" not in para:
-                    raise ValueError(f"Missing 'id' in paragraph {i}")
-                if "translation" not in para:
-                    raise ValueError(f"Missing 'translation' in paragraph {i}")
-
-            return paragraphs
+            self.check_stream_end(response, max_output_tokens)
 
         except anthropic.APITimeoutError:
             logger.error("Request to Claude timed out")
@@ -270,3 +348,86 @@ class ClaudeProvider(BaseTranslationProvider):
         except anthropic.APIError as e:
             logger.error("Claude API error: %s", str(e))
             raise ValueError(f"Claude API error: {e}")
+
+    async def astream_translation_text(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> AsyncIterator[str]:
+        """Async version of stream_translation_text, using AsyncAnthropic"""
+        logger.debug("Sending async translation request to Claude")
+        logger.debug("Task prompt:\n%s", task_prompt)
+        logger.debug("Input:\n%s", input_text)
+
+        try:
+            start_time = datetime.utcnow()
+
+            async with self.get_async_client().messages.stream(**self.stream_request(task_prompt, input_text, max_output_tokens)) as stream:
+                async for text in self.aiter_stream_text(stream):
+                    yield text
+                response = await stream.get_final_message()
+
+            duration = (datetime.utcnow() - start_time).total_seconds()
+            logger.debug("API call duration: %.2f seconds", duration)
+
+            self.check_stream_end(response, max_output_tokens)
+
+        except anthropic.APITimeoutError:
+            logger.error("Request to Claude timed out")
+            raise ValueError("Translation request timed out")
+
+        except anthropic.NotFoundError as e:
+            logger.error("Claude model not found: %s", str(e))
+            raise ValueError(f"Model not found: {self.options.model}. Please select a valid Claude model.")
+
+        except anthropic.APIError as e:
+            logger.error("Claude API error: %s", str(e))
+            raise ValueError(f"Claude API error: {e}")
+
+    def submit_bulk_requests(self, requests: list[BulkRequest]) -> str:
+        """Create a Message Batch with the requests"""
+        try:
+            batch = self.client.messages.batches.create(requests=[
+                {
+                    "custom_id": request["custom_id"],
+                    "params": self.stream_request(request["task_prompt"], request["input_text"], request["max_output_tokens"]),
+                }
+                for request in requests
+            ])
+        except anthropic.APIError as e:
+            logger.error("Claude API error: %s", str(e))
+            raise ValueError(f"Claude API error: {e}")
+
+        return batch.id
+
+    def get_bulk_results(self, batch_id: str) -> dict[str, BulkResult] | None:
+        """Read the results of an ended Message Batch"""
+        results: dict[str, BulkResult] = {}
+        try:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status != "ended":
+                logger.info("Claude batch %s is %s (%s)", batch_id, batch.processing_status, batch.request_counts)
+                return None
+
+            for item in self.client.messages.batches.results(batch_id):
+                result = item.result
+                if result.type != "succeeded":
+                    # errored, canceled or expired
+                    error = str(result.error.error) if result.type == "errored" else result.type
+                    results[item.custom_id] = BulkResult(text=None, truncated=False, error=error, usage=None)
+                    continue
+
+                message = result.message
+                results[item.custom_id] = BulkResult(
+                    text=self.get_message_text(message),
+                    truncated=message.stop_reason == "max_tokens",
+                    error=None,
+                    usage=self.get_usage(message.usage),
+                )
+        except anthropic.APIError as e:
+            logger.error("Claude API error: %s", str(e))
+            raise ValueError(f"Claude API error: {e}")
+
+        logger.info("Claude batch %s ended with %d results", batch_id, len(results))
+        return results
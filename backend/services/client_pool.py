@@ -0,0 +1,135 @@
+"""
+Process-wide pool of provider API clients and tokenizer encodings.
+
+Providers are created per request (they carry the request's options and token
+usage), but their OpenAI / Anthropic clients are shared: one sync client per
+(provider, API key), and one async client per (provider, API key, event loop),
+each with a keep-alive connection pool, so consecutive requests reuse open
+connections and TLS sessions instead of handshaking again. Async connections
+belong to the loop that opened them, a client of another loop (a worker thread's,
+or one of asyncio.run) would fail with "attached to a different loop". Encodings
+are looked up once per model.
+"""
+from functools import lru_cache
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+
+import httpx
+import tiktoken
+import anthropic
+from anthropic import Anthropic, AsyncAnthropic
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Connections kept per client (sync and async clients have separate pools)
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "100"))
+PROVIDER_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Idle connections are closed after this many seconds
+PROVIDER_KEEPALIVE_SECONDS = float(os.getenv("PROVIDER_KEEPALIVE_SECONDS", "120"))
+# HTTP/2 multiplexes concurrent requests on one connection, needs the optional h2 package
+PROVIDER_HTTP2 = os.getenv("PROVIDER_HTTP2", "false").lower() == "true"
+
+_clients: dict[tuple[str, str], OpenAI | Anthropic] = {}
+_async_clients: dict[tuple[str, str, asyncio.AbstractEventLoop], AsyncOpenAI | AsyncAnthropic] = {}
+_clients_lock = threading.Lock()
+
+
+def http2_enabled() -> bool:
+    if PROVIDER_HTTP2 and importlib.util.find_spec("h2") is None:
+        logger.warning("PROVIDER_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+        return False
+    return PROVIDER_HTTP2
+
+
+def connection_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=PROVIDER_MAX_CONNECTIONS,
+        max_keepalive_connections=PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=PROVIDER_KEEPALIVE_SECONDS,
+    )
+
+
+def _get_client(provider: str, api_key: str, create):
+    with _clients_lock:
+        client = _clients.get((provider, api_key))
+        if client is None:
+            http2 = http2_enabled()
+            logger.info("Creating %s API client (HTTP/2: %s)", provider, http2)
+            client = _clients[(provider, api_key)] = create(http2)
+        return client
+
+
+def _get_async_client(provider: str, api_key: str, create):
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _async_clients.get((provider, api_key, loop))
+        if client is None:
+            # Clients of closed loops cannot be used again
+            for key in [key for key in _async_clients if key[2].is_closed()]:
+                del _async_clients[key]
+            http2 = http2_enabled()
+            logger.info("Creating %s async API client (HTTP/2: %s)", provider, http2)
+            client = _async_clients[(provider, api_key, loop)] = create(http2)
+        return client
+
+
+def get_openai_client(api_key: str) -> OpenAI:
+    """Shared OpenAI client for api_key"""
+    def create(http2: bool):
+        # The SDK's default http clients keep its timeouts and redirect settings
+        return OpenAI(api_key=api_key, http_client=openai.DefaultHttpxClient(limits=connection_limits(), http2=http2))
+    return _get_client("openai", api_key, create)
+
+
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    """Shared AsyncOpenAI client for api_key in the running event loop"""
+    def create(http2: bool):
+        return AsyncOpenAI(
+            api_key=api_key,
+            http_client=openai.DefaultAsyncHttpxClient(limits=connection_limits(), http2=http2),
+        )
+    return _get_async_client("openai", api_key, create)
+
+
+def get_anthropic_client(api_key: str) -> Anthropic:
+    """Shared Anthropic client for api_key"""
+    def create(http2: bool):
+        return Anthropic(api_key=api_key, http_client=anthropic.DefaultHttpxClient(limits=connection_limits(), http2=http2))
+    return _get_client("anthropic", api_key, create)
+
+
+def get_async_anthropic_client(api_key: str) -> AsyncAnthropic:
+    """Shared AsyncAnthropic client for api_key in the running event loop"""
+    def create(http2: bool):
+        return AsyncAnthropic(
+            api_key=api_key,
+            http_client=anthropic.DefaultAsyncHttpxClient(limits=connection_limits(), http2=http2),
+        )
+    return _get_async_client("anthropic", api_key, create)
+
+
+@lru_cache(maxsize=None)
+def get_model_encoding(model: str):
+    """tiktoken encoding of an OpenAI model"""
+    return tiktoken.encoding_for_model(model)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str):
+    """tiktoken encoding by name"""
+    return tiktoken.get_encoding(name)
+
+
+def close_clients():
+    """Close the sync clients' connections (async clients are dropped with their event loop)"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client in clients:
+        client.close()
@@ -7,6 +7,9 @@ from services.openai_provider import OPENAI_MODELS
 from services.claude_provider import CLAUDE_MODELS
 from models import Provider
 
+# Both the OpenAI Batch API and Anthropic Message Batches bill half the regular prices
+BATCH_API_DISCOUNT = 0.5
+
 
 def get_model_pricing(provider: Provider, model: str) -> dict:
     """
@@ -20,6 +23,8 @@ def get_model_pricing(provider: Provider, model: str) -> dict:
         dict with keys:
             - input_price: Price per 1M input tokens (USD)
             - output_price: Price per 1M output tokens (USD)
+            - cached_input_price: Price per 1M input tokens read from the prompt cache (USD)
+            - cache_write_price: Price per 1M input tokens written to the prompt cache (USD)
 
     Raises:
         ValueError: If model not found for the given provider
@@ -33,9 +38,12 @@ def get_model_pricing(provider: Provider, model: str) -> dict:
 
     for model_info in models_list:
         if model_info["value"] == model:
+            # Models without prompt caching bill cached tokens as regular input
             return {
                 "input_price": model_info["input_price"],
-                "output_price": model_info["output_price"]
+                "output_price": model_info["output_price"],
+                "cached_input_price": model_info.get("cached_input_price", model_info["input_price"]),
+                "cache_write_price": model_info.get("cache_write_price", model_info["input_price"]),
             }
 
     raise ValueError(f"Unknown model '{model}' for provider '{provider.value}'")
@@ -45,7 +53,10 @@ def calculate_cost(
     input_tokens: int,
     output_tokens: int,
     provider: Provider,
-    model: str
+    model: str,
+    cached_input_tokens: int = 0,
+    cache_write_tokens: int = 0,
+    bulk: bool = False,
 ) -> dict:
     """
     Calculate cost from token counts using provider pricing.
@@ -53,15 +64,20 @@ def calculate_cost(
     Prices are per 1M tokens. Returns costs in USD rounded to 4 decimal places.
 
     Args:
-        input_tokens: Number of input tokens
+        input_tokens: Number of input tokens, including cached_input_tokens and cache_write_tokens
         output_tokens: Number of output tokens
         provider: Provider enum
         model: Model identifier
+        cached_input_tokens: Input tokens read from the prompt cache
+        cache_write_tokens: Input tokens written to the prompt cache
+        bulk: Sent through the provider's batch API (see BATCH_API_DISCOUNT)
 
     Returns:
         dict with keys:
             - input_tokens: int - Input token count
             - output_tokens: int - Output token count
+            - cached_input_tokens: int - Input tokens read from the prompt cache
+            - cache_write_tokens: int - Input tokens written to the prompt cache
             - input_cost: float - Cost for input tokens (USD)
             - output_cost: float - Cost for output tokens (USD)
             - total_cost: float - Total cost (USD)
@@ -75,6 +91,8 @@ def calculate_cost(
         {
             "input_tokens": 1000,
             "output_tokens": 2000,
+            "cached_input_tokens": 0,
+            "cache_write_tokens": 0,
             "input_cost": 0.0025,
             "output_cost": 0.0200,
             "total_cost": 0.0225,
@@ -84,13 +102,23 @@ def calculate_cost(
     pricing = get_model_pricing(provider, model)
 
     # Prices are per 1M tokens
-    input_cost = (input_tokens / 1_000_000) * pricing["input_price"]
+    uncached_input_tokens = input_tokens - cached_input_tokens - cache_write_tokens
+    input_cost = (
+        uncached_input_tokens * pricing["input_price"]
+        + cached_input_tokens * pricing["cached_input_price"]
+        + cache_write_tokens * pricing["cache_write_price"]
+    ) / 1_000_000
     output_cost = (output_tokens / 1_000_000) * pricing["output_price"]
+    if bulk:
+        input_cost *= BATCH_API_DISCOUNT
+        output_cost *= BATCH_API_DISCOUNT
     total_cost = input_cost + output_cost
 
     return {
         "input_tokens": input_tokens,
         "output_tokens": output_tokens,
+        "cached_input_tokens": cached_input_tokens,
+        "cache_write_tokens": cache_write_tokens,
         "input_cost": round(input_cost, 4),
         "output_cost": round(output_cost, 4),
         "total_cost": round(total_cost, 4),
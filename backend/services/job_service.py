@@ -0,0 +1,416 @@
+"""
+Background translation jobs.
+
+POST /translate/jobs stores a queued job, worker threads claim queued jobs and
+translate them batch by batch, updating progress (batches, tokens, partial
+results) and storing finished segments after every batch.
+
+Bulk jobs submit all their batches to the provider's batch API instead and wait
+as "submitted". Workers claim them again every BULK_POLL_SECONDS to check the
+provider batch, and store all segments once its results are in.
+"""
+from datetime import datetime, timedelta, timezone
+from playhouse.shortcuts import model_to_dict
+import logging
+import os
+import threading
+
+from db import db
+from models import TranslationJobs, TranslationJobRequest
+from services.base_provider import TruncatedResponseError
+from services.checkpoint_service import translation_checkpoints
+from services.prompt import LANGUAGES
+from services.segment_service import store_translated_batch
+
+logger = logging.getLogger(__name__)
+
+# Seconds an idle worker waits before looking for queued jobs again
+JOB_POLL_SECONDS = int(os.getenv("TRANSLATION_JOB_POLL_SECONDS", "5"))
+
+# Running jobs not updated for this long are queued again (their worker is gone)
+JOB_STALE_SECONDS = int(os.getenv("TRANSLATION_JOB_STALE_SECONDS", "1800"))
+
+# Seconds between checks of a submitted bulk job's provider batch
+BULK_POLL_SECONDS = int(os.getenv("TRANSLATION_BULK_POLL_SECONDS", "60"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUBMITTED = "submitted"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def create_job(request: TranslationJobRequest, username: str) -> dict:
+    """Queue a translation job and return it"""
+    now = datetime.now(timezone.utc)
+    job = TranslationJobs.insert(
+        username=username,
+        status=JOB_QUEUED,
+        request=request.model_dump(mode="json"),
+        created_at=now,
+        updated_at=now,
+        total_paragraphs=len(request.paragraphs),
+    ).returning(TranslationJobs).execute()[0]
+
+    logger.info("Queued translation job %d for %s (%d paragraphs)", job.id, username, len(request.paragraphs))
+    return job_to_dict(job)
+
+
+def get_job(job_id: int) -> dict | None:
+    job = TranslationJobs.get_or_none(TranslationJobs.id == job_id)
+    return job_to_dict(job) if job else None
+
+
+def job_to_dict(job: TranslationJobs) -> dict:
+    # The request and bulk state hold whole reference texts, don't send them back
+    return model_to_dict(job, exclude=[TranslationJobs.request, TranslationJobs.bulk_state])
+
+
+def requeue_stale_jobs():
+    """
+    Queue again running jobs whose worker stopped updating them (e.g. the process was
+    restarted). They resume from the checkpoint of their last finished batch.
+    """
+    now = datetime.now(timezone.utc)
+    stale_jobs = TranslationJobs.update(
+        status=JOB_QUEUED,
+        updated_at=now,
+    ).where(
+        (TranslationJobs.status == JOB_RUNNING)
+        & (TranslationJobs.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS))
+    ).returning(TranslationJobs.id).execute()
+    for job in stale_jobs:
+        logger.warning("Translation job %d is stale, queued again", job.id)
+
+
+def claim_next_job() -> TranslationJobs | None:
+    """
+    Mark the oldest queued job, or submitted bulk job due for a check, as running and return it.
+
+    SKIP LOCKED lets workers in several processes share the queue.
+    """
+    now = datetime.now(timezone.utc)
+    with db.atomic():
+        cursor = db.execute_sql(
+            """
+            UPDATE translation_jobs
+            SET status = %s, started_at = COALESCE(started_at, %s), updated_at = %s
+            WHERE id = (
+                SELECT id FROM translation_jobs
+                WHERE status = %s OR (status = %s AND updated_at < %s)
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+            """,
+            (JOB_RUNNING, now, now, JOB_QUEUED, JOB_SUBMITTED, now - timedelta(seconds=BULK_POLL_SECONDS)),
+        )
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+    return TranslationJobs.get(TranslationJobs.id == row[0])
+
+
+def run_job(job: TranslationJobs, create_provider):
+    """
+    Translate a claimed job batch by batch.
+
+    Args:
+        job: Job claimed by claim_next_job
+        create_provider: Callable(request) returning (TranslationServiceOptions, provider)
+    """
+    start_time = datetime.now(timezone.utc)
+    request = TranslationJobRequest(**job.request)
+    if request.bulk:
+        run_bulk_job(job, request, create_provider)
+        return
+    options, provider = create_provider(request)
+
+    progress = provider.start_translation(
+        original_language=request.original_language,
+        paragraphs=request.paragraphs,
+        additional_sources_languages=request.additional_sources_languages,
+        additional_sources_texts=request.additional_sources_texts,
+        translate_language=request.translate_language,
+        task_prompt=request.task_prompt,
+        checkpoint_store=translation_checkpoints,
+    )
+
+    lang_names = [LANGUAGES.get(lang_code, lang_code) for lang_code in request.additional_sources_languages]
+    # Token usage is only known once the job is done, it is reported in the result instead
+    segment_properties = {
+        "translation": provider.get_result_properties(with_usage=False, task_prompt=progress.task_prompt),
+        **request.segment_properties,
+    }
+    result = {
+        "translated_paragraphs": [],
+        "additional_sources_paragraphs": [[] for _ in lang_names],
+        "remaining_additional_sources_texts": request.additional_sources_texts,
+        "properties": provider.get_result_properties(task_prompt=progress.task_prompt),
+    }
+
+    def save_batch(start: int, translations: list[str], references: list[list[str]]):
+        """
+        Store the batch's segments and report progress.
+
+        Segments stored by an earlier attempt of the request (a failed or restarted job)
+        are skipped. The checkpoint is saved in the same transaction as the segments, so
+        it always records what was stored.
+        """
+        end = start + len(translations)
+        stored = max(start, min(progress.stored_paragraphs, end))
+        with db.atomic():
+            if request.translated_source_id is not None and stored < end:
+                store_translated_batch(
+                    username=job.username,
+                    translated_source_id=request.translated_source_id,
+                    original_segments=request.original_segments[stored:end],
+                    additional_sources_segments=request.additional_sources_segments,
+                    translations=translations[stored - start:],
+                    additional_sources_paragraphs=[refs[stored - start:] for refs in references],
+                    remaining_additional_sources_texts=progress.remaining_additional_sources_texts,
+                    properties=segment_properties,
+                )
+            progress.stored_paragraphs = max(progress.stored_paragraphs, end)
+            progress.save_checkpoint()
+
+        result["translated_paragraphs"].extend(translations)
+        for all_refs, refs in zip(result["additional_sources_paragraphs"], references):
+            all_refs.extend(refs)
+        result["remaining_additional_sources_texts"] = progress.remaining_additional_sources_texts
+        result["properties"] = provider.get_result_properties(task_prompt=progress.task_prompt)
+
+        TranslationJobs.update(
+            translated_paragraphs=len(result["translated_paragraphs"]),
+            batches_done=progress.batch_num,
+            input_tokens=provider.token_usage["input_tokens"],
+            output_tokens=provider.token_usage["output_tokens"],
+            result=result,
+            updated_at=datetime.now(timezone.utc),
+        ).where(TranslationJobs.id == job.id).execute()
+        logger.info("Translation job %d: batch %d done, %d/%d paragraphs",
+                    job.id, progress.batch_num, len(result["translated_paragraphs"]), len(request.paragraphs))
+
+    if progress.resumed_paragraphs:
+        # Batches finished by an earlier attempt of this request, stored unless that was a job
+        translations = progress.translated_paragraphs.copy()
+        references = [
+            [refs.get(lang_name, "") for refs in progress.paragraph_references]
+            for lang_name in lang_names
+        ]
+        save_batch(0, translations, references)
+
+    while (next_batch := progress.next_batch()) is not None:
+        batch, input_text = next_batch
+        # Shares the model's rate limit window with /translate and the other jobs
+        truncation = None
+        reservation = provider.reserve_batch(batch)
+        try:
+            translated_batch = provider.send_for_translation(
+                task_prompt=progress.task_prompt,
+                input_text=input_text,
+                max_output_tokens=batch["max_output_tokens"],
+            )
+        except TruncatedResponseError as e:
+            truncation = e
+        finally:
+            # A failed job must not hold its estimate in the window the other requests share
+            provider.settle_reservation(reservation)
+
+        if truncation:
+            # Nothing of the batch was kept, its paragraphs are retried in smaller batches
+            progress.split_batch(truncation)
+            continue
+
+        for para in translated_batch:
+            progress.add_paragraph(para)
+
+        translations = [para["translation"] for para in progress.batch_paragraphs]
+        references = [
+            [para.get("references", {}).get(lang_name, "") for para in progress.batch_paragraphs]
+            for lang_name in lang_names
+        ]
+        if len(translations) != len(batch["paragraphs"]):
+            raise ValueError(
+                f"Expected {len(batch['paragraphs'])} translated paragraphs in batch {progress.batch_num} "
+                f"but got {len(translations)}"
+            )
+
+        # The checkpoint is saved with the batch's segments
+        progress.advance_batch()
+        save_batch(batch["start"], translations, references)
+
+    # A later job of the same request stores its segments again
+    progress.finish()
+    end_time = datetime.now(timezone.utc)
+    result["total_segments_translated"] = len(result["translated_paragraphs"])
+    result["translation_time_seconds"] = (end_time - start_time).total_seconds()
+
+    TranslationJobs.update(
+        status=JOB_DONE,
+        result=result,
+        finished_at=end_time,
+        updated_at=end_time,
+    ).where(TranslationJobs.id == job.id).execute()
+    logger.info("Translation job %d done in %.2f seconds", job.id, result["translation_time_seconds"])
+
+
+def run_bulk_job(job: TranslationJobs, request: TranslationJobRequest, create_provider):
+    """
+    Submit a claimed bulk job to the provider's batch API, or check on a submitted one.
+
+    Either way the job is left "submitted" until the provider batch ended, then all
+    segments are stored at once and the job is done.
+    """
+    options, provider = create_provider(request)
+    now = datetime.now(timezone.utc)
+
+    if job.bulk_state is None:
+        # Batch API requests have their own rate limits, only an interactive first batch uses the window
+        bulk = provider.submit_bulk_translation(
+            original_language=request.original_language,
+            paragraphs=request.paragraphs,
+            additional_sources_languages=request.additional_sources_languages,
+            additional_sources_texts=request.additional_sources_texts,
+            translate_language=request.translate_language,
+            task_prompt=request.task_prompt,
+        )
+        job.bulk_state = bulk
+        TranslationJobs.update(
+            status=JOB_SUBMITTED,
+            provider_batch_id=bulk["batch_id"],
+            bulk_state=bulk,
+            input_tokens=provider.token_usage["input_tokens"],
+            output_tokens=provider.token_usage["output_tokens"],
+            updated_at=now,
+        ).where(TranslationJobs.id == job.id).execute()
+        logger.info("Translation job %d submitted as %s batch %s", job.id, options.provider.value, bulk["batch_id"])
+        if bulk["batch_id"]:
+            return
+
+    def keep_claimed():
+        # Sending many batches again can outlast JOB_STALE_SECONDS, another worker must not collect the job too
+        TranslationJobs.update(
+            input_tokens=provider.token_usage["input_tokens"],
+            output_tokens=provider.token_usage["output_tokens"],
+            updated_at=datetime.now(timezone.utc),
+        ).where(TranslationJobs.id == job.id).execute()
+
+    translation = provider.collect_bulk_translation(
+        job.bulk_state,
+        original_language=request.original_language,
+        additional_sources_languages=request.additional_sources_languages,
+        additional_sources_texts=request.additional_sources_texts,
+        translate_language=request.translate_language,
+        on_batch_sent=keep_claimed,
+    )
+    if translation is None:
+        TranslationJobs.update(status=JOB_SUBMITTED, updated_at=now).where(TranslationJobs.id == job.id).execute()
+        return
+
+    lang_names = [LANGUAGES.get(lang_code, lang_code) for lang_code in request.additional_sources_languages]
+    references = [translation["references_by_language"].get(lang_name, []) for lang_name in lang_names]
+    if request.translated_source_id is not None:
+        store_translated_batch(
+            username=job.username,
+            translated_source_id=request.translated_source_id,
+            original_segments=request.original_segments,
+            additional_sources_segments=request.additional_sources_segments,
+            translations=translation["translated_paragraphs"],
+            additional_sources_paragraphs=references,
+            remaining_additional_sources_texts=translation["remaining_additional_sources_texts"],
+            properties={
+                "translation": provider.get_result_properties(with_usage=False, task_prompt=job.bulk_state["task_prompt"]),
+                **request.segment_properties,
+            },
+        )
+
+    end_time = datetime.now(timezone.utc)
+    result = {
+        "translated_paragraphs": translation["translated_paragraphs"],
+        "additional_sources_paragraphs": references,
+        "remaining_additional_sources_texts": translation["remaining_additional_sources_texts"],
+        "properties": translation["properties"],
+        "total_segments_translated": len(translation["translated_paragraphs"]),
+        "translation_time_seconds": (end_time - job.started_at.replace(tzinfo=timezone.utc)).total_seconds(),
+    }
+    TranslationJobs.update(
+        status=JOB_DONE,
+        translated_paragraphs=len(translation["translated_paragraphs"]),
+        batches_done=len(job.bulk_state["batches"]) + (1 if job.bulk_state["first_batch"] else 0),
+        input_tokens=provider.token_usage["input_tokens"],
+        output_tokens=provider.token_usage["output_tokens"],
+        result=result,
+        bulk_state=None,
+        finished_at=end_time,
+        updated_at=end_time,
+    ).where(TranslationJobs.id == job.id).execute()
+    logger.info("Bulk translation job %d done, %d paragraphs", job.id, len(translation["translated_paragraphs"]))
+
+
+def run_next_job(create_provider) -> bool:
+    """
+    Claim and run one queued job.
+
+    Returns:
+        False if there was no queued job
+    """
+    requeue_stale_jobs()
+    job = claim_next_job()
+    if not job:
+        return False
+
+    try:
+        run_job(job, create_provider)
+    except Exception as e:
+        logger.error("Translation job %d failed: %s", job.id, e)
+        now = datetime.now(timezone.utc)
+        TranslationJobs.update(
+            status=JOB_FAILED,
+            error=str(e),
+            finished_at=now,
+            updated_at=now,
+        ).where(TranslationJobs.id == job.id).execute()
+
+    return True
+
+
+class TranslationJobWorkers:
+    """Pool of threads running queued translation jobs, one job per thread at a time"""
+
+    def __init__(self, num_workers: int, create_provider):
+        self.num_workers = num_workers
+        self.create_provider = create_provider
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.threads: list[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self.work, name=f"translation-job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info("Started %d translation job workers", self.num_workers)
+
+    def notify(self):
+        """Wake idle workers after a job was queued"""
+        self.wake.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                if run_next_job(self.create_provider):
+                    continue
+            except Exception as e:
+                logger.error("Translation job worker error: %s", e)
+
+            self.wake.wait(JOB_POLL_SECONDS)
+            self.wake.clear()
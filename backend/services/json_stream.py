@@ -0,0 +1,233 @@
+"""
+Incremental parsing of streamed JSON translation responses.
+
+The parser is a single pass state machine, so malformed responses (unescaped
+quotes, markdown fences, trailing commas) are repaired in linear time, also when
+the complete response is parsed at once (see repair_json).
+"""
+import json
+import re
+
+WHITESPACE = " \t\r\n"
+
+# Characters that end a run of plain string content
+STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class ParagraphStreamParser:
+    """
+    Incremental parser for the {"paragraphs": [{...}, ...]} responses requested by the task prompt.
+
+    feed() consumes response text deltas as they arrive and returns every paragraph
+    object that closed in them, already parsed. Anything before or after the top-level
+    object (such as markdown code fences) is ignored, so each delta is scanned only once.
+
+    It tolerates unescaped quotes inside strings: a quote only ends a string when
+    followed by what JSON allows there (":" after a key; "}", "]" or "," and the next
+    key or value after a value). Otherwise it is kept as text. Deciding may need a
+    few characters of lookahead, which can span deltas. Trailing commas are ignored.
+
+    Args:
+        stream_paragraphs: Return paragraph objects from feed() as they complete. When
+            False they stay in the parsed object, available as root once done.
+    """
+
+    def __init__(self, stream_paragraphs: bool = True):
+        self.stream_paragraphs = stream_paragraphs
+        # Open containers as [container, pending dict key]
+        self.stack: list[list] = []
+        # outside | value | string | quote | comma | literal | done
+        self.mode = "outside"
+        self.raw: list[str] = []  # Raw (still escaped) content of the current string
+        self.is_key = False
+        self.escaped = False
+        self.lookahead: list[str] = []  # Text after a quote that may or may not close the string
+        self.literal: list[str] = []
+        self.completed: list[dict] = []
+        self.root: dict | None = None
+
+    def feed(self, delta: str) -> list[dict]:
+        """
+        Consume the next piece of the response.
+
+        Returns:
+            Paragraph objects completed by this delta, in order
+        """
+        i = 0
+        n = len(delta)
+        while i < n:
+            if self.mode == "string" and not self.escaped:
+                # Fast path: copy plain string content up to the next quote or backslash
+                match = STRING_SPECIAL.search(delta, i)
+                end = match.start() if match else n
+                if end > i:
+                    self.raw.append(delta[i:end])
+                    i = end
+                    continue
+            self._consume(delta[i])
+            i += 1
+
+        completed, self.completed = self.completed, []
+        return completed
+
+    def finish(self) -> list[dict]:
+        """
+        Paragraphs completed by the end of the response, none: objects complete on their closing brace.
+
+        Raises:
+            ValueError: If the response ended before its top-level object was closed
+        """
+        if self.mode != "done":
+            raise ValueError("Incomplete JSON object in response")
+        return []
+
+    def _consume(self, char: str):
+        mode = self.mode
+
+        if mode == "outside":
+            if char == "{":
+                self.stack.append([{}, None])
+                self.mode = "value"
+
+        elif mode == "string":
+            if self.escaped:
+                self.raw.append(char)
+                self.escaped = False
+            elif char == "\\":
+                self.raw.append(char)
+                self.escaped = True
+            elif char == '"':
+                self.mode = "quote"
+                self.lookahead = []
+            else:
+                self.raw.append(char)
+
+        elif mode == "quote":
+            closing = ":" if self.is_key else "}]"
+            if char in WHITESPACE:
+                self.lookahead.append(char)
+            elif char == "," and not self.is_key:
+                self.lookahead.append(char)
+                self.mode = "comma"
+            elif char in closing:
+                self._end_string()
+                self._consume(char)
+            else:
+                self._keep_quote()
+                self._consume(char)
+
+        elif mode == "comma":
+            if char in WHITESPACE:
+                self.lookahead.append(char)
+            elif char == '"' or (isinstance(self.stack[-1][0], list) and char in '{[-0123456789tfn'):
+                self._end_string()
+                self._consume(",")
+                self._consume(char)
+            elif char in "}]":
+                # Trailing comma
+                self._end_string()
+                self._consume(char)
+            else:
+                self._keep_quote()
+                self._consume(char)
+
+        elif mode == "literal":
+            if char in ",}]" or char in WHITESPACE:
+                self._end_literal()
+                self._consume(char)
+            else:
+                self.literal.append(char)
+
+        elif mode == "value":
+            if char in WHITESPACE or char in ",:":
+                return
+            frame = self.stack[-1]
+            if char == '"':
+                self.is_key = isinstance(frame[0], dict) and frame[1] is None
+                self.raw = []
+                self.mode = "string"
+            elif char == "{":
+                self.stack.append([{}, None])
+            elif char == "[":
+                self.stack.append([[], None])
+            elif char in "}]":
+                if isinstance(frame[0], dict) != (char == "}"):
+                    raise ValueError(f"Unexpected {char!r} in JSON response")
+                self._close_container()
+            else:
+                self.literal = [char]
+                self.mode = "literal"
+
+    def _keep_quote(self):
+        """The quote did not end the string, keep it (escaped) with the text after it"""
+        self.raw.append('\\"')
+        self.raw.extend(self.lookahead)
+        self.mode = "string"
+
+    def _end_string(self):
+        raw = "".join(self.raw)
+        try:
+            value = json.loads(f'"{raw}"', strict=False)
+        except json.JSONDecodeError:
+            # Invalid escape sequence, keep the text as written
+            value = raw
+        self.mode = "value"
+
+        if self.is_key:
+            self.stack[-1][1] = value
+        else:
+            self._add_value(value)
+
+    def _end_literal(self):
+        token = "".join(self.literal)
+        try:
+            value = json.loads(token)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid JSON value {token!r} in response")
+        self.mode = "value"
+        self._add_value(value)
+
+    def _close_container(self):
+        container = self.stack.pop()[0]
+        if not self.stack:
+            self.root = container
+            self.mode = "done"
+        elif self.stream_paragraphs and self._is_paragraph(container):
+            self.completed.append(container)
+        else:
+            self._add_value(container)
+
+    def _is_paragraph(self, container) -> bool:
+        # root object > "paragraphs" list > paragraph object
+        return (
+            isinstance(container, dict)
+            and len(self.stack) == 2
+            and self.stack[0][1] == "paragraphs"
+            and isinstance(self.stack[1][0], list)
+        )
+
+    def _add_value(self, value):
+        frame = self.stack[-1]
+        if isinstance(frame[0], list):
+            frame[0].append(value)
+        elif frame[1] is not None:
+            frame[0][frame[1]] = value
+            frame[1] = None
+        else:
+            raise ValueError(f"Value without a key in JSON response: {value!r}")
+
+
+def repair_json(text: str) -> str:
+    """
+    Repair a complete JSON object response, in time linear in its length.
+
+    Text around the object (such as markdown code fences) is dropped, unescaped
+    quotes inside strings are escaped and trailing commas removed.
+
+    Raises:
+        ValueError: If the text holds no complete JSON object
+    """
+    parser = ParagraphStreamParser(stream_paragraphs=False)
+    parser.feed(text)
+    parser.finish()
+    return json.dumps(parser.root, ensure_ascii=False)
@@ -1,12 +1,15 @@
-import tiktoken
+import json
 import logging
-from openai import OpenAI
-from openai import OpenAIError, APITimeoutError
+from openai import AsyncOpenAI, OpenAIError, APITimeoutError
+from openai.types.chat import ChatCompletion
 from datetime import datetime
-import json
+from typing import AsyncIterator, Iterator
 
-from models import TranslationServiceOptions
-from services.base_provider import BaseTranslationProvider, TranslatedParagraph, OTHER_LANG_TEXT_MULTIPLIER, strip_markdown_json_fences, repair_json_quotes
+from models import OutputFormat, TranslationServiceOptions
+from services.base_provider import BaseTranslationProvider, BulkRequest, BulkResult, TruncatedResponseError
+from services.client_pool import get_async_openai_client, get_model_encoding, get_openai_client
+from services.prompt import get_input_reference_languages, get_prompt_hash, get_response_schema
+from services.token_cache import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,9 @@ PROVIDER_LABEL = "OpenAI"
 
 # Available models with their specifications
 # Pricing as of 2025-2026 (per MTok)
+# Default rate limits per minute (usage tier 1), 0 means no such limit.
+# Override them per deployment with RATE_LIMITS / RATE_LIMITS_FILE (see services/rate_limits.py)
+# Optional "output_format": default response format of the model (models.OutputFormat), JSON if not set
 OPENAI_MODELS = [
     {
         "value": "gpt-4o",
@@ -24,6 +30,9 @@ OPENAI_MODELS = [
         "max_output_tokens": 16384,
         "input_price": 2.5,    # $2.50/MTok
         "output_price": 10.0,  # $10/MTok
+        "cached_input_price": 1.25,  # Prompt cache reads
+        "rate_limits": {"rpm": 500, "itpm": 0, "otpm": 0, "tpm": 30000},
+        "structured_outputs": True,  # response_format json_schema
         "description": "Fast and capable, cost-effective"
     },
     {
@@ -33,6 +42,7 @@ OPENAI_MODELS = [
         "max_output_tokens": 4096,
         "input_price": 10.0,   # $10/MTok
         "output_price": 30.0,  # $30/MTok
+        "rate_limits": {"rpm": 500, "itpm": 0, "otpm": 0, "tpm": 30000},
         "description": "High capability, higher cost"
     },
     {
@@ -42,6 +52,7 @@ OPENAI_MODELS = [
         "max_output_tokens": 2048,
         "input_price": 30.0,   # $30/MTok
         "output_price": 60.0,  # $60/MTok
+        "rate_limits": {"rpm": 500, "itpm": 0, "otpm": 0, "tpm": 10000},
         "description": "Legacy GPT-4, expensive"
     },
     {
@@ -51,18 +62,27 @@ OPENAI_MODELS = [
         "max_output_tokens": 4096,
         "input_price": 0.5,    # $0.50/MTok
         "output_price": 1.5,   # $1.50/MTok
+        "rate_limits": {"rpm": 3500, "itpm": 0, "otpm": 0, "tpm": 200000},
         "description": "Most cost-effective"
     },
 ]
 
+# Batch API statuses after which no more results come (expired and cancelled batches keep the finished ones)
+BATCH_ENDED_STATUSES = {"completed", "expired", "cancelled"}
+
 
 class OpenAIProvider(BaseTranslationProvider):
     """OpenAI translation provider using GPT models"""
 
     def __init__(self, api_key: str, options: TranslationServiceOptions):
         super().__init__(api_key, options)
-        self.client = OpenAI(api_key=api_key)
-        self.encoding = tiktoken.encoding_for_model(self.options.model)
+        # Clients and encodings are shared by all requests, see services/client_pool.py
+        self.client = get_openai_client(api_key)
+        self.encoding = get_model_encoding(self.options.model)
+
+    def get_async_client(self) -> AsyncOpenAI:
+        """Shared async client of the running event loop, see services/client_pool.py"""
+        return get_async_openai_client(self.api_key)
 
     def get_model_token_limit(self) -> dict:
         """Return context window and max output tokens for OpenAI models"""
@@ -84,140 +104,191 @@ class OpenAIProvider(BaseTranslationProvider):
     ) -> int:
         """Calculate approximate token count for the input using tiktoken"""
         # Task prompt tokens
-        prompt_tokens = len(self.encoding.encode(task_prompt))
+        prompt_tokens = count_tokens(self.encoding, self.get_request_task_prompt(task_prompt))
 
-        # Original paragraphs tokens (estimate with XML overhead)
-        paragraphs_text = "\n".join(f'<p id="{i}">{p}</p>' for i, p in enumerate(original_paragraphs))
-        paragraphs_tokens = len(self.encoding.encode(paragraphs_text))
+        # Original paragraphs tokens (each paragraph cached separately, plus tag overhead)
+        paragraphs_tokens = sum(count_tokens(self.encoding, p) for p in original_paragraphs)
+        paragraphs_tokens += len(original_paragraphs) * count_tokens(self.encoding, self.get_paragraph_tag())
 
         # Additional sources tokens
         sources_tokens = 0
         if additional_sources_texts:
             for text in additional_sources_texts:
-                sources_tokens += len(self.encoding.encode(text))
+                sources_tokens += count_tokens(self.encoding, text)
 
         return prompt_tokens + paragraphs_tokens + sources_tokens
 
-    def estimate_output_tokens(self, original_paragraphs: list[str], num_references: int) -> int:
+    def estimate_output_tokens(
+        self,
+        original_paragraphs: list[str],
+        num_references: int,
+        original_language: str | None = None,
+        translate_language: str | None = None,
+    ) -> int:
         """Estimate output tokens based on input size"""
-        # Output includes: original text (1x) + translation (OTHER_LANG_TEXT_MULTIPLIER)
-        # + references from each source (num_references * OTHER_LANG_TEXT_MULTIPLIER)
-        base_estimate = sum(len(self.encoding.encode(p)) for p in original_paragraphs)
-        multiplier = 1 + OTHER_LANG_TEXT_MULTIPLIER + (num_references * OTHER_LANG_TEXT_MULTIPLIER)
-        return int(base_estimate * multiplier)
+        base_estimate = sum(count_tokens(self.encoding, p) for p in original_paragraphs)
+        return int(base_estimate * self.get_output_multiplier(num_references, original_language, translate_language))
+
+    def stream_request(self, task_prompt: str, input_text: str, max_output_tokens: int) -> dict:
+        """Arguments of a streamed chat completion request, shared by the sync and async clients"""
+        return dict(
+            model=self.options.model,
+            # The task prompt comes first and is the same for every batch, so batches after the
+            # first share a prefix that OpenAI caches automatically (prompts of 1024+ tokens)
+            messages=[
+                {"role": "system", "content": task_prompt},
+                {"role": "user", "content": input_text}
+            ],
+            max_tokens=max_output_tokens,
+            temperature=self.options.temperature,
+            timeout=600,
+            response_format=self.get_response_format(input_text),
+            stream=True,
+            stream_options={"include_usage": True},
+            # Routes requests with the same prompt to the same cache
+            extra_body={"prompt_cache_key": get_prompt_hash(task_prompt)},
+        )
+
+    def get_model_output_format(self) -> OutputFormat:
+        """Default response format of the model ("output_format" in OPENAI_MODELS)"""
+        model = next((model for model in OPENAI_MODELS if model["value"] == self.options.model), {})
+        return OutputFormat(model.get("output_format", OutputFormat.JSON))
+
+    def get_response_format(self, input_text: str) -> dict:
+        """
+        JSON mode, or the paragraphs schema in structured output mode on models that support it.
+        Plain text for the tagged output format.
+        """
+        if self.get_output_format() == OutputFormat.TAGGED:
+            return {"type": "text"}
+        if self.options.structured_output:
+            model = next((model for model in OPENAI_MODELS if model["value"] == self.options.model), {})
+            if model.get("structured_outputs"):
+                return {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "translation",
+                        "strict": True,
+                        "schema": get_response_schema(get_input_reference_languages(input_text), self.options.lean_response),
+                    },
+                }
+            logger.warning("%s does not support structured outputs, using JSON mode", self.options.model)
+        return {"type": "json_object"}
+
+    def get_usage(self, usage) -> dict:
+        """record_usage arguments for the usage of a chat completion"""
+        details = usage.prompt_tokens_details
+        return {
+            "input_tokens": usage.prompt_tokens,
+            "output_tokens": usage.completion_tokens,
+            "cached_input_tokens": (details.cached_tokens if details else 0) or 0,
+        }
+
+    def check_stream_end(self, finish_reason: str | None, usage, max_output_tokens: int):
+        """Log token usage of a finished stream and raise if the response was truncated"""
+        if usage:
+            recorded = self.get_usage(usage)
+            self.record_usage(**recorded)
+            logger.info(f"OpenAI token usage: input={usage.prompt_tokens}, "
+                      f"cached={recorded['cached_input_tokens']}, "
+                      f"output={usage.completion_tokens}, "
+                      f"total={usage.total_tokens}, "
+                      f"max_tokens_requested={max_output_tokens}")
+
+        if finish_reason == "length":
+            error_msg = (
+                f"Translation response was truncated due to max_tokens limit. "
+                f"Input tokens: {usage.prompt_tokens if usage else 'unknown'}, "
+                f"Output tokens: {usage.completion_tokens if usage else 'unknown'}/{max_output_tokens}."
+            )
+            logger.warning(error_msg)
+            raise TruncatedResponseError(error_msg)
 
-    def send_for_translation(
+    def stream_translation_text(
         self,
         task_prompt: str,
         input_text: str,
         max_output_tokens: int,
-    ) -> list[TranslatedParagraph]:
+    ) -> Iterator[str]:
         """
-        Send paragraphs to OpenAI for translation.
+        Send paragraphs to OpenAI with streaming and yield response text deltas.
 
         Args:
             task_prompt: Task prompt (Part 1) - system message
             input_text: Input text (Part 2) - user message
             max_output_tokens: Maximum tokens to allocate for output
 
-        Returns:
-            List of TranslatedParagraph objects from LLM response
+        Yields:
+            Response text as it is generated
         """
+        logger.debug("Sending translation request to OpenAI")
+        logger.debug("Task prompt:\n%s", task_prompt)
+        logger.debug("Input:\n%s", input_text)
 
-        messages = [
-            {"role": "system", "content": task_prompt},
-            {"role": "user", "content": input_text}
-        ]
+        try:
+            start_time = datetime.utcnow()
+            stream = self.client.chat.completions.create(**self.stream_request(task_prompt, input_text, max_output_tokens))
+
+            finish_reason = None
+            usage = None
+            for chunk in stream:
+                # The last chunk carries usage only, with no choices
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    yield choice.delta.content
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
 
-        logger.debug("Sending translation request to OpenAI")
+            duration = (datetime.utcnow() - start_time).total_seconds()
+            logger.debug("API call duration: %.2f seconds", duration)
+
+            self.check_stream_end(finish_reason, usage, max_output_tokens)
+
+        except APITimeoutError:
+            logger.error("Request to OpenAI timed out")
+            raise ValueError("Translation request timed out")
+
+        except OpenAIError as e:
+            logger.error("OpenAI API error: %s", str(e))
+            raise ValueError(f"OpenAI API error: {e}")
+
+    async def astream_translation_text(
+        self,
+        task_prompt: str,
+        input_text: str,
+        max_output_tokens: int,
+    ) -> AsyncIterator[str]:
+        """Async version of stream_translation_text, using AsyncOpenAI"""
+        logger.debug("Sending async translation request to OpenAI")
         logger.debug("Task prompt:\n%s", task_prompt)
         logger.debug("Input:\n%s", input_text)
 
         try:
             start_time = datetime.utcnow()
-            response = self.client.chat.completions.create(
-                model=self.options.model,
-                messages=messages,
-                max_tokens=max_output_tokens,
-                temperature=self.options.temperature,
-                timeout=600,
-                response_format={"type": "json_object"}
-            )
+            stream = await self.get_async_client().chat.completions.create(**self.stream_request(task_prompt, input_text, max_output_tokens))
+
+            finish_reason = None
+            usage = None
+            async for chunk in stream:
+                # The last chunk carries usage only, with no choices
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    yield choice.delta.content
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+
             duration = (datetime.utcnow() - start_time).total_seconds()
             logger.debug("API call duration: %.2f seconds", duration)
 
-            # Log actual token usage
-            if response.usage:
-                logger.info(f"OpenAI token usage: input={response.usage.prompt_tokens}, "
-                          f"output={response.usage.completion_tokens}, "
-                          f"total={response.usage.total_tokens}, "
-                          f"max_tokens_requested={max_output_tokens}")
-
-            if not response or not response.choices or not response.choices[0].message.content:
-                logger.error("OpenAI returned an empty response")
-                raise ValueError("OpenAI returned an empty response")
-
-            # Check if response was truncated due to max_tokens limit
-            finish_reason = response.choices[0].finish_reason
-            if finish_reason == "length":
-                actual_input = response.usage.prompt_tokens if response.usage else "unknown"
-                actual_output = response.usage.completion_tokens if response.usage else "unknown"
-                actual_total = response.usage.total_tokens if response.usage else "unknown"
-
-                error_msg = (
-                    f"Translation response was truncated due to max_tokens limit. "
-                    f"Input tokens: {actual_input}, "
-                    f"Output tokens: {actual_output}/{max_output_tokens}, "
-                    f"Total tokens: {actual_total}. "
-                    f"Try translating fewer paragraphs at a time."
-                )
-
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-
-            text = response.choices[0].message.content.strip()
-            logger.debug("Raw response:\n%s", text)
-
-            # Strip markdown code fences if present
-            json_text = strip_markdown_json_fences(text)
-
-            try:
-                response_json = json.loads(json_text)
-            except json.JSONDecodeError as e:
-                logger.warning("Failed to parse JSON response: %s", e)
-                # Log the problematic area around the error position
-                error_pos = e.pos if hasattr(e, 'pos') else 0
-                start = max(0, error_pos - 200)
-                end = min(len(json_text), error_pos + 200)
-                context = json_text[start:end]
-                logger.warning("Context around error position %d:", error_pos)
-                logger.warning("...%s...", context)
-
-                # Try to repair common JSON issues (unescaped quotes)
-                logger.info("Attempting to repair JSON with unescaped quotes...")
-                try:
-                    repaired_json = repair_json_quotes(json_text)
-                    response_json = json.loads(repaired_json)
-                    logger.info("Successfully repaired and parsed JSON")
-                except json.JSONDecodeError as repair_error:
-                    logger.error("Failed to repair JSON: %s", repair_error)
-                    logger.error("Full response length: %d characters", len(json_text))
-                    logger.error("First 1000 chars of response: %s", json_text[:1000])
-                    raise ValueError(f"Failed to parse JSON response even after repair: {repair_error}")
-
-            paragraphs = response_json.get("paragraphs", [])
-            if not paragraphs:
-                logger.error("No paragraphs in response")
-                raise ValueError("No paragraphs in response")
-
-            # Validate response structure
-            for i, para in enumerate(paragraphs):
-                if "id" not in para:
-                    raise ValueError(f"Missing 'id' in paragraph {i}")
-                if "translation" not in para:
-                    raise ValueError(f"Missing 'translation' in paragraph {i}")
-
-            return paragraphs
+            self.check_stream_end(finish_reason, usage, max_output_tokens)
 
         except APITimeoutError:
             logger.error("Request to OpenAI timed out")
@@ -226,3 +297,75 @@ class OpenAIProvider(BaseTranslationProvider):
         except OpenAIError as e:
             logger.error("OpenAI API error: %s", str(e))
             raise ValueError(f"OpenAI API error: {e}")
+
+    def submit_bulk_requests(self, requests: list[BulkRequest]) -> str:
+        """Upload the requests as a JSONL file and create a Batch API job for them"""
+        lines = []
+        for request in requests:
+            body = self.stream_request(request["task_prompt"], request["input_text"], request["max_output_tokens"])
+            for key in ("stream", "stream_options", "timeout"):
+                del body[key]
+            body.update(body.pop("extra_body"))
+            lines.append(json.dumps({
+                "custom_id": request["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }, ensure_ascii=False))
+
+        try:
+            input_file = self.client.files.create(
+                file=("translation_batches.jsonl", "\n".join(lines).encode("utf-8")),
+                purpose="batch",
+            )
+            batch = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+        except OpenAIError as e:
+            logger.error("OpenAI API error: %s", str(e))
+            raise ValueError(f"OpenAI API error: {e}")
+
+        return batch.id
+
+    def get_bulk_results(self, batch_id: str) -> dict[str, BulkResult] | None:
+        """Read the output (and error) file of an ended Batch API job"""
+        try:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status == "failed":
+                raise ValueError(f"OpenAI batch {batch_id} failed: {batch.errors}")
+            if batch.status not in BATCH_ENDED_STATUSES:
+                logger.info("OpenAI batch %s is %s (%s)", batch_id, batch.status, batch.request_counts)
+                return None
+
+            lines = []
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    lines.extend(self.client.files.content(file_id).text.splitlines())
+        except OpenAIError as e:
+            logger.error("OpenAI API error: %s", str(e))
+            raise ValueError(f"OpenAI API error: {e}")
+
+        results: dict[str, BulkResult] = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or response.get("body", {}).get("error")
+                results[item["custom_id"]] = BulkResult(text=None, truncated=False, error=str(error), usage=None)
+                continue
+
+            completion = ChatCompletion.model_validate(response["body"])
+            choice = completion.choices[0]
+            results[item["custom_id"]] = BulkResult(
+                text=choice.message.content or "",
+                truncated=choice.finish_reason == "length",
+                error=None,
+                usage=self.get_usage(completion.usage) if completion.usage else None,
+            )
+
+        logger.info("OpenAI batch %s %s with %d results", batch_id, batch.status, len(results))
+        return results
@@ -0,0 +1,114 @@
+"""
+Output token estimates calibrated from real usage.
+
+Every successful response records output tokens (as reported by the API) per
+token of original paragraphs, keyed by (model, original language, target
+language, number of references, output format, lean responses, compact input).
+Once a key has enough samples, batches are planned with a high percentile of the
+observed ratios instead of the fixed OTHER_LANG_TEXT_MULTIPLIER based multiplier.
+"""
+from collections import deque
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Percentile of observed ratios used for estimates (higher is safer, lower packs tighter)
+OUTPUT_CALIBRATION_PERCENTILE = float(os.getenv("OUTPUT_CALIBRATION_PERCENTILE", "90"))
+
+# Samples needed before a key's ratios replace the default multiplier
+OUTPUT_CALIBRATION_MIN_SAMPLES = int(os.getenv("OUTPUT_CALIBRATION_MIN_SAMPLES", "5"))
+
+# Most recent samples kept per key
+OUTPUT_CALIBRATION_WINDOW = int(os.getenv("OUTPUT_CALIBRATION_WINDOW", "200"))
+
+CalibrationKey = tuple[str, str, str, int, str, bool, bool]
+
+
+class OutputCalibrator:
+    """Thread-safe per-key window of output/input token ratios."""
+
+    def __init__(self, window: int, min_samples: int, percentile: float):
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self._ratios: dict[CalibrationKey, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        model: str,
+        original_language: str,
+        translate_language: str,
+        num_references: int,
+        paragraph_tokens: int,
+        output_tokens: int,
+        output_format: str = "json",
+        lean: bool = False,
+        compact: bool = False,
+    ):
+        """Record a response with output_tokens for paragraphs of paragraph_tokens tokens"""
+        if paragraph_tokens <= 0:
+            return
+        key = (model, original_language, translate_language, num_references, output_format, lean, compact)
+        with self._lock:
+            ratios = self._ratios.setdefault(key, deque(maxlen=self.window))
+            ratios.append(output_tokens / paragraph_tokens)
+
+    def multiplier(
+        self,
+        model: str,
+        original_language: str | None,
+        translate_language: str | None,
+        num_references: int,
+        default: float,
+        output_format: str = "json",
+        lean: bool = False,
+        compact: bool = False,
+    ) -> float:
+        """Calibrated output tokens per paragraph token, or default while there are too few samples"""
+        key = (model, original_language, translate_language, num_references, output_format, lean, compact)
+        with self._lock:
+            ratios = list(self._ratios.get(key, ()))
+        if len(ratios) < self.min_samples:
+            return default
+        return self.percentile_of(ratios)
+
+    def percentile_of(self, ratios: list[float]) -> float:
+        # Nearest rank
+        ordered = sorted(ratios)
+        rank = math.ceil(self.percentile / 100 * len(ordered))
+        return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            items = [(key, list(ratios)) for key, ratios in self._ratios.items()]
+        return [
+            {
+                "model": model,
+                "original_language": original_language,
+                "translate_language": translate_language,
+                "num_references": num_references,
+                "output_format": output_format,
+                "lean": lean,
+                "compact": compact,
+                "samples": len(ratios),
+                "calibrated": len(ratios) >= self.min_samples,
+                "multiplier": round(self.percentile_of(ratios), 4),
+            }
+            for (model, original_language, translate_language, num_references, output_format, lean, compact), ratios
+            in items
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._ratios.clear()
+
+
+output_calibrator = OutputCalibrator(
+    OUTPUT_CALIBRATION_WINDOW,
+    OUTPUT_CALIBRATION_MIN_SAMPLES,
+    OUTPUT_CALIBRATION_PERCENTILE,
+)
@@ -1,8 +1,11 @@
 from fastapi import HTTPException
+import hashlib
 from peewee import (
     JOIN,
     fn,
 )
+import json
+import re
 import textwrap
 import logging
 
@@ -14,6 +17,7 @@ from services.utils import (
     microseconds,
 )
 from services.dictionary import get_rules
+from services.tagged_output import ORIGINAL_SECTION, TRANSLATION_SECTION, format_tagged_paragraph
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +31,10 @@ SEGMENTS_SUFFIX = "\n\nNow translate the following paragraphs:\n"
 def clean(s: str) -> str:
     return textwrap.dedent(s).strip('\n')
 
+def get_prompt_hash(task_prompt: str) -> str:
+    """Short stable hash identifying a task prompt (and so its dictionary version)"""
+    return hashlib.sha256(task_prompt.encode("utf-8")).hexdigest()[:32]
+
 # =============================================================================
 # LANGUAGES
 # =============================================================================
@@ -209,7 +217,8 @@ def format_input(
     original_paragraphs: list[str],
     additional_sources_languages: list[str],
     additional_sources_texts: list[str],
-    translate_language: str
+    translate_language: str,
+    compact: bool = False,
 ) -> str:
     """
     Format the input for translation (Part 2).
@@ -220,6 +229,8 @@ def format_input(
         additional_sources_languages: List of language codes for references
         additional_sources_texts: List of reference texts (full text, not split)
         translate_language: Target language code
+        compact: Number paragraphs as "N|text" lines instead of wrapping each in a
+            <p id="N"> tag, for task prompts made compact by get_compact_task_prompt
 
     Returns:
         Formatted XML-like input string
@@ -229,10 +240,13 @@ def format_input(
     translate_lang_name = validate_language(translate_language)
 
     # Build original source section
-    paragraphs_xml = "\n".join(
-        f'    <p id="{i+1}">{para}</p>'
-        for i, para in enumerate(original_paragraphs)
-    )
+    if compact:
+        paragraphs_xml = "\n".join(f"{i+1}|{para}" for i, para in enumerate(original_paragraphs))
+    else:
+        paragraphs_xml = "\n".join(
+            f'    <p id="{i+1}">{para}</p>'
+            for i, para in enumerate(original_paragraphs)
+        )
     original_section = f'<original_source language="{original_lang_name}">\n{paragraphs_xml}\n</original_source>'
 
     # Build additional sources section
@@ -251,6 +265,158 @@ def format_input(
     return f"{original_section}\n\n{additional_section}\n\n{translate_section}"
 
 
+def get_input_reference_languages(input_text: str) -> list[str]:
+    """Language names of the reference texts in an input built by format_input"""
+    return re.findall(r'^    <text language="([^"]+)">', input_text, re.MULTILINE)
+
+
+def get_input_paragraphs(input_text: str) -> dict[int, str]:
+    """Original paragraphs by id in an input built by format_input"""
+    paragraphs = re.findall(r'<p id="(\d+)">(.*?)</p>', input_text, re.DOTALL)
+    if not paragraphs:
+        # Compact input, a paragraph runs until the next numbered line
+        section = re.search(r'<original_source[^>]*>\n(.*?)\n</original_source>', input_text, re.DOTALL)
+        if section:
+            paragraphs = re.findall(r'^(\d+)\|(.*?)(?=\n\d+\||\Z)', section.group(1), re.DOTALL | re.MULTILINE)
+    return {int(para_id): text for para_id, text in paragraphs}
+
+
+def get_compact_task_prompt(task_prompt: str) -> str:
+    """
+    Task prompt for compact input, see format_input.
+
+    Rewrites the description and example of the <p id="N"> paragraphs in the
+    default prompt (and custom prompts edited from it) to "N|text" lines.
+    """
+    compact = re.sub(r'^[ \t]*<p id="(\d+)">(.*?)</p>$', r"\1|\2", task_prompt, flags=re.MULTILINE)
+    for old, new in (
+        ('numbered <p id="N"> paragraphs', 'numbered paragraphs, each starting on a new line as "N|text"'),
+        ("<p> tag", "numbered paragraph"),
+        ("<p> content", "paragraph text"),
+        ("p id", "paragraph number"),
+    ):
+        compact = compact.replace(old, new)
+    return compact
+
+
+def get_lean_task_prompt(task_prompt: str) -> str:
+    """
+    Task prompt for lean responses, without the "original_paragraph" field.
+
+    The original paragraphs are in the request, echoing them back costs about as
+    many output tokens as the translation. Custom prompts edited from the default
+    one are made lean the same way, prompts without the field are kept as they are.
+    """
+    lean = re.sub(r'^[ \t]*"original_paragraph": .*\n', "", task_prompt, flags=re.MULTILINE)
+    return re.sub(
+        r'^(\d+)\. PRESERVE ORIGINAL: .*$',
+        r'\1. NO ECHO: Do not repeat the original paragraph, its "id" identifies it.',
+        lean,
+        flags=re.MULTILINE,
+    )
+
+
+TAGGED_OUTPUT_FORMAT = clean("""
+OUTPUT FORMAT - Return plain text only, no JSON, no markdown:
+Start each paragraph with a line "@@ <id>" and follow it with each of its sections:
+a line "@ <section name>" and the section's text on the next lines, in this order:
+{sections}
+Write the text exactly as it is, quotes included, without escaping anything.
+""")
+
+# "key": "<placeholder>" lines of the OUTPUT FORMAT JSON
+JSON_FORMAT_FIELD = re.compile(r'^\s*"([^"]+)": "(.*)",?$', re.MULTILINE)
+
+
+def get_tagged_task_prompt(task_prompt: str) -> str:
+    """
+    Task prompt for the tagged plain-text output format (see services.tagged_output).
+
+    The JSON OUTPUT FORMAT and EXAMPLE OUTPUT of the default prompt (and custom
+    prompts edited from it) are rewritten as tagged blocks with the same fields.
+    Prompts without them get the tagged OUTPUT FORMAT appended.
+    """
+    def section_name(key: str) -> str:
+        return {"original_paragraph": ORIGINAL_SECTION, "translation": TRANSLATION_SECTION}.get(key, key)
+
+    def output_format(match: re.Match) -> str:
+        fields = [(section_name(key), placeholder) for key, placeholder in JSON_FORMAT_FIELD.findall(match.group(1))]
+        id_placeholder = re.search(r'"id": (<[^>]*>)', match.group(1))
+        block = format_tagged_paragraph(id_placeholder.group(1) if id_placeholder else "<id>", fields)
+        return TAGGED_OUTPUT_FORMAT.format(sections=block)
+
+    def example_output(match: re.Match) -> str:
+        try:
+            paragraphs = json.loads(match.group(1))["paragraphs"]
+        except (ValueError, KeyError, TypeError):
+            return ""
+        blocks = []
+        for para in paragraphs:
+            sections = []
+            if "original_paragraph" in para:
+                sections.append((ORIGINAL_SECTION, para["original_paragraph"]))
+            sections.extend(para.get("references", {}).items())
+            sections.append((TRANSLATION_SECTION, para.get("translation", "")))
+            blocks.append(format_tagged_paragraph(para.get("id"), sections))
+        return "EXAMPLE OUTPUT:\n" + "\n".join(blocks)
+
+    tagged, found = re.subn(
+        r"^OUTPUT FORMAT[^\n]*\n(\{\n.*?\n\})$", output_format, task_prompt, count=1, flags=re.MULTILINE | re.DOTALL
+    )
+    if not found:
+        return f"{task_prompt}\n\n" + TAGGED_OUTPUT_FORMAT.format(
+            sections=format_tagged_paragraph("<id>", [(TRANSLATION_SECTION, "<translation>")])
+        )
+    tagged = re.sub(r"^EXAMPLE OUTPUT:\n(\{\n.*?\n\})$", example_output, tagged, count=1, flags=re.MULTILINE | re.DOTALL)
+    for old, new in (
+        ("one object per", "one paragraph block per"),
+        ('The "original_paragraph" field', 'The "original" section'),
+        ('use empty string ""', "leave its section empty"),
+        ("include these keys in 'references'", "include a section for each of them"),
+        ("The 'references' object will be empty {}.", "Paragraphs have no reference sections."),
+    ):
+        tagged = tagged.replace(old, new)
+    return tagged
+
+
+def get_response_schema(reference_languages: list[str], lean: bool = False) -> dict:
+    """
+    JSON schema of the OUTPUT FORMAT in the task prompt, for structured outputs.
+
+    Follows the rules of OpenAI strict mode (every property required, no additional
+    properties), which Claude tool input schemas accept as well.
+
+    Args:
+        reference_languages: Language names expected in each paragraph's references
+        lean: Without "original_paragraph", see get_lean_task_prompt
+    """
+    paragraph = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "original_paragraph": {"type": "string"},
+            "references": {
+                "type": "object",
+                "properties": {language: {"type": "string"} for language in reference_languages},
+                "required": list(reference_languages),
+                "additionalProperties": False,
+            },
+            "translation": {"type": "string"},
+        },
+        "required": ["id", "original_paragraph", "references", "translation"],
+        "additionalProperties": False,
+    }
+    if lean:
+        del paragraph["properties"]["original_paragraph"]
+        paragraph["required"].remove("original_paragraph")
+    return {
+        "type": "object",
+        "properties": {"paragraphs": {"type": "array", "items": paragraph}},
+        "required": ["paragraphs"],
+        "additionalProperties": False,
+    }
+
+
 def get_full_prompt(
     original_language: str,
     original_paragraphs: list[str],
@@ -0,0 +1,224 @@
+"""
+Process-wide sliding-window rate limiter, one per provider model.
+
+Every request to a model reserves its estimated input and output tokens in the
+model's window before it is sent, and reconciles the reservation with the usage
+the API reported once the response is in. Requests from different users and
+jobs run at the same time whenever the last minute's requests and tokens leave
+room for them under every configured limit (RPM, ITPM, OTPM and total TPM),
+instead of waiting on a per-provider lock.
+
+The limiter is shared by threads (jobs, concurrent batches) and asyncio tasks
+(/translate handlers): state is guarded by a threading.Lock that is never held
+while waiting, sync callers sleep and async callers await.
+"""
+from collections import deque
+from typing import TypedDict
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Window (seconds) over which the per-minute limits are enforced
+TPM_WINDOW_SECONDS = 60
+
+
+class RateLimits(TypedDict):
+    """Per-minute limits of a model, 0 disables a limit"""
+    rpm: int  # Requests
+    itpm: int  # Input tokens
+    otpm: int  # Output tokens
+    tpm: int  # Input + output tokens
+
+
+def window_amounts(input_tokens: int, output_tokens: int) -> RateLimits:
+    """What a single request counts towards each limit"""
+    return RateLimits(rpm=1, itpm=input_tokens, otpm=output_tokens, tpm=input_tokens + output_tokens)
+
+
+class Reservation:
+    """Tokens reserved in a limiter's window for one request"""
+
+    def __init__(self, limiter: "SlidingWindowLimiter", entry: list | None, input_tokens: int, output_tokens: int):
+        self.limiter = limiter
+        # [monotonic time, input tokens, output tokens, still in window], None if no limit is set
+        self.entry = entry
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    def reconcile(self, input_tokens: int, output_tokens: int = 0):
+        """Replace the estimate with the tokens the request actually used"""
+        self.limiter.reconcile(self, input_tokens, output_tokens)
+
+
+class SlidingWindowLimiter:
+    """Admits requests while the requests and tokens sent in the last TPM_WINDOW_SECONDS stay within limits"""
+
+    def __init__(self, name: str, limits: RateLimits, window_seconds: float = TPM_WINDOW_SECONDS):
+        self.name = name
+        self.limits = limits
+        self.window_seconds = window_seconds
+        self.entries: deque[list] = deque()
+        self.used = RateLimits(rpm=0, itpm=0, otpm=0, tpm=0)
+        self.lock = threading.Lock()
+
+        self.reservations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.waiting = 0
+
+    def fits(self, used: dict, amounts: RateLimits) -> bool:
+        return all(limit <= 0 or used[key] + amounts[key] <= limit for key, limit in self.limits.items())
+
+    def add_used(self, amounts: RateLimits, sign: int = 1):
+        for key in self.used:
+            self.used[key] += sign * amounts[key]
+
+    def try_reserve(self, input_tokens: int, output_tokens: int = 0) -> tuple[Reservation | None, float]:
+        """
+        Reserve a request's tokens if they fit in the window now.
+
+        Returns:
+            Tuple of (reservation, 0) or (None, seconds until enough of the window expires)
+        """
+        with self.lock:
+            if all(limit <= 0 for limit in self.limits.values()):
+                self.reservations += 1
+                return Reservation(self, None, input_tokens, output_tokens), 0
+
+            now = time.monotonic()
+            while self.entries and now - self.entries[0][0] >= self.window_seconds:
+                expired = self.entries.popleft()
+                expired[3] = False
+                self.add_used(window_amounts(expired[1], expired[2]), -1)
+
+            # A request larger than a limit can only go alone
+            amounts = window_amounts(input_tokens, output_tokens)
+            if self.fits(self.used, amounts) or not self.entries:
+                entry = [now, input_tokens, output_tokens, True]
+                self.entries.append(entry)
+                self.add_used(amounts)
+                self.reservations += 1
+                return Reservation(self, entry, input_tokens, output_tokens), 0
+
+            # Wait until the oldest requests leave the window and free enough of every limit
+            remaining = dict(self.used)
+            for sent_at, sent_input, sent_output, _ in self.entries:
+                for key, amount in window_amounts(sent_input, sent_output).items():
+                    remaining[key] -= amount
+                if self.fits(remaining, amounts):
+                    break
+            return None, max(sent_at + self.window_seconds - now, 0.001)
+
+    def reconcile(self, reservation: Reservation, input_tokens: int, output_tokens: int):
+        with self.lock:
+            entry = reservation.entry
+            if entry is not None:
+                # Entries that already left the window no longer count towards used
+                if entry[3]:
+                    self.add_used(window_amounts(entry[1], entry[2]), -1)
+                    self.add_used(window_amounts(input_tokens, output_tokens))
+                entry[1] = input_tokens
+                entry[2] = output_tokens
+            reservation.input_tokens = input_tokens
+            reservation.output_tokens = output_tokens
+
+    def record_wait(self, waited: float):
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def log_wait(self, wait: float, input_tokens: int, output_tokens: int):
+        logger.info("%s rate limit reached (used %s of %s), waiting %.1f seconds for %d + %d tokens",
+                    self.name, self.used, self.limits, wait, input_tokens, output_tokens)
+
+    def reserve(self, input_tokens: int, output_tokens: int = 0) -> Reservation:
+        """Block until the request fits in the window and reserve its tokens"""
+        reservation, wait = self.try_reserve(input_tokens, output_tokens)
+        if reservation:
+            return reservation
+
+        started = time.monotonic()
+        with self.lock:
+            self.waiting += 1
+        try:
+            while not reservation:
+                self.log_wait(wait, input_tokens, output_tokens)
+                time.sleep(wait)
+                reservation, wait = self.try_reserve(input_tokens, output_tokens)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        self.record_wait(time.monotonic() - started)
+        return reservation
+
+    async def areserve(self, input_tokens: int, output_tokens: int = 0) -> Reservation:
+        """Async version of reserve"""
+        reservation, wait = self.try_reserve(input_tokens, output_tokens)
+        if reservation:
+            return reservation
+
+        started = time.monotonic()
+        with self.lock:
+            self.waiting += 1
+        try:
+            while not reservation:
+                self.log_wait(wait, input_tokens, output_tokens)
+                await asyncio.sleep(wait)
+                reservation, wait = self.try_reserve(input_tokens, output_tokens)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        self.record_wait(time.monotonic() - started)
+        return reservation
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            used = RateLimits(rpm=0, itpm=0, otpm=0, tpm=0)
+            for sent_at, sent_input, sent_output, _ in self.entries:
+                if now - sent_at < self.window_seconds:
+                    for key, amount in window_amounts(sent_input, sent_output).items():
+                        used[key] += amount
+            return {
+                "limits": dict(self.limits),
+                "window_seconds": self.window_seconds,
+                "used": used,
+                "reservations": self.reservations,
+                "waiting": self.waiting,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "max_wait_seconds": round(self.max_wait_seconds, 3),
+            }
+
+
+_limiters: dict[str, SlidingWindowLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, limits: RateLimits) -> SlidingWindowLimiter:
+    """Get or create the process-wide limiter for a provider model, with the latest limits"""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = SlidingWindowLimiter(name, limits)
+        elif limiter.limits != limits:
+            logger.info("%s rate limits changed from %s to %s", name, limiter.limits, limits)
+            limiter.limits = limits
+        return limiter
+
+
+def get_rate_limiter_stats() -> dict:
+    """Window usage and wait counters of every limiter"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+def clear_rate_limiters():
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,92 @@
+"""
+Rate limits per provider and model.
+
+Defaults come from the "rate_limits" of each model in OPENAI_MODELS and
+CLAUDE_MODELS. Deployments on a higher usage tier override them with a JSON
+file (RATE_LIMITS_FILE) and/or inline JSON (RATE_LIMITS, applied last), keyed
+by provider and then model, where "*" applies to all models of the provider:
+
+    {"claude": {"*": {"rpm": 1000}, "claude-haiku-4-5-20251001": {"itpm": 400000, "otpm": 80000}}}
+
+The limits feed both the batch planner (a single request must fit) and the
+process-wide sliding-window limiter (requests in the last minute must fit).
+"""
+import json
+import logging
+import os
+
+from models import Provider
+from services.claude_provider import CLAUDE_MODELS
+from services.openai_provider import OPENAI_MODELS
+from services.rate_limiter import RateLimits
+
+logger = logging.getLogger(__name__)
+
+# Limits of models without defaults or overrides
+DEFAULT_RATE_LIMITS = RateLimits(rpm=0, itpm=0, otpm=0, tpm=30000)
+
+_overrides: dict | None = None
+
+
+def load_rate_limit_overrides() -> dict:
+    """Read RATE_LIMITS_FILE and RATE_LIMITS, merged per provider and model"""
+    overrides: dict = {}
+    sources = []
+    path = os.getenv("RATE_LIMITS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            sources.append(json.load(f))
+    if os.getenv("RATE_LIMITS"):
+        sources.append(json.loads(os.getenv("RATE_LIMITS")))
+
+    for source in sources:
+        for provider, models in source.items():
+            for model, limits in models.items():
+                unknown = set(limits) - set(RateLimits.__annotations__)
+                if unknown:
+                    raise ValueError(f"Unknown rate limits {sorted(unknown)} for {provider} {model}")
+                overrides.setdefault(provider, {}).setdefault(model, {}).update(limits)
+    return overrides
+
+
+def get_rate_limit_overrides() -> dict:
+    global _overrides
+    if _overrides is None:
+        _overrides = load_rate_limit_overrides()
+        if _overrides:
+            logger.info("Rate limit overrides: %s", _overrides)
+    return _overrides
+
+
+def reload_rate_limits():
+    """Forget loaded overrides, they are read again on next use"""
+    global _overrides
+    _overrides = None
+
+
+def get_model_rate_limits(provider: Provider, model: str) -> RateLimits:
+    """
+    Get the per-minute rate limits of a provider/model combination.
+
+    Args:
+        provider: Provider enum
+        model: Model identifier string (e.g., "gpt-4o", "claude-sonnet-4-5-20250929")
+
+    Returns:
+        RateLimits with rpm, itpm, otpm and tpm (0 disables a limit)
+    """
+    if provider == Provider.CLAUDE:
+        models_list = CLAUDE_MODELS
+    else:
+        # SIMPLE_GPT_1 and DEFAULT_DEV use OpenAI as well
+        models_list = OPENAI_MODELS
+
+    limits = RateLimits(**DEFAULT_RATE_LIMITS)
+    for model_info in models_list:
+        if model_info["value"] == model:
+            limits.update(model_info.get("rate_limits", {}))
+
+    provider_overrides = get_rate_limit_overrides().get(provider.value, {})
+    limits.update(provider_overrides.get("*", {}))
+    limits.update(provider_overrides.get(model, {}))
+    return limits
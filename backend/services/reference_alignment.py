@@ -0,0 +1,196 @@
+"""
+Length-based alignment of reference texts to the original paragraphs.
+
+Follows Gale & Church (1993): the lengths of mutual translations are roughly
+proportional, so a dynamic program over lengths alone finds the most likely
+pairing of original paragraphs with units of a reference text. Units are the
+lines of the reference, or its sentences when it has too few lines to follow
+the paragraphs.
+
+Reference texts usually go on past the paragraphs being translated, only the
+prefix they cover is aligned. The char ratio between the languages is not
+known up front, it is re-estimated from a first alignment and aligned again.
+"""
+from bisect import bisect_right
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Prior probability of each match (original paragraphs, reference units), from Gale & Church
+LINE_MATCH_PRIORS = {
+    (1, 1): 0.89,
+    (1, 0): 0.0099,
+    (2, 1): 0.0445,
+    (1, 2): 0.0445,
+    (2, 2): 0.011,
+    (3, 1): 0.005,
+    (1, 3): 0.005,
+}
+
+# A paragraph usually holds several sentences, let the lengths decide how many
+SENTENCE_MATCH_PRIORS = {
+    (1, 0): 0.01,
+    (2, 1): 0.02,
+    **{(1, units): 0.1 for units in range(1, 9)},
+}
+
+# Variance of the reference length per original char (Gale & Church)
+LENGTH_VARIANCE = 6.8
+
+# Cap on the length cost of a paragraph or unit left without counterpart
+MAX_SKIP_LENGTH_COST = 10.0
+
+# Reference chars per original char assumed for the first alignment
+INITIAL_CHAR_RATIO = 1.5
+
+# Units of the reference (e.g. a title) that may precede the first paragraph's reference
+MAX_LEADING_UNITS = 3
+
+# Lowest cost states kept per paragraph, bounds the work to O(paragraphs)
+BEAM_WIDTH = 24
+
+# Only this multiple of the expected reference length is considered
+PREFIX_FACTOR = 2.0
+
+SENTENCE_END = re.compile(r"(?<=[.!?:;׃。])\s+")
+LINE_END = re.compile(r"\n+")
+
+
+def split_units(text: str, pattern: re.Pattern) -> list[int]:
+    """Boundaries [0, ..., len(text)] of the units of text, each ending after its separator"""
+    boundaries = [0]
+    for match in pattern.finditer(text):
+        if match.end() > boundaries[-1] and match.end() < len(text):
+            boundaries.append(match.end())
+    if len(text) > boundaries[-1]:
+        boundaries.append(len(text))
+    return boundaries
+
+
+def length_cost(original_length: int, reference_length: int, ratio: float) -> float:
+    """-log probability that texts of these lengths are translations of each other"""
+    if original_length == 0 and reference_length == 0:
+        return 0.0
+    mean = (original_length + reference_length / ratio) / 2
+    z = abs(ratio * original_length - reference_length) / math.sqrt(max(mean, 1.0) * LENGTH_VARIANCE)
+    cost = -math.log(max(math.erfc(z / math.sqrt(2)), 1e-300))
+    if original_length == 0 or reference_length == 0:
+        # Text without counterpart, a long one is not much less likely than a short one
+        return min(cost, MAX_SKIP_LENGTH_COST)
+    return cost
+
+
+def align_units(
+    lengths: list[int],
+    unit_lengths: list[int],
+    ratio: float,
+    priors: dict[tuple[int, int], float],
+) -> list[tuple[int, int]]:
+    """
+    Most likely alignment of paragraphs with a prefix of the units.
+
+    Returns:
+        Unit range [first, end) matched with each paragraph, empty for a paragraph
+        without reference. Paragraphs matched together share their range.
+    """
+    paragraph_sums = [0]
+    for length in lengths:
+        paragraph_sums.append(paragraph_sums[-1] + length)
+    unit_sums = [0]
+    for length in unit_lengths:
+        unit_sums.append(unit_sums[-1] + length)
+    num_units = len(unit_lengths)
+    match_costs = [(match, -math.log(prior)) for match, prior in priors.items()]
+    skip_cost = -math.log(LINE_MATCH_PRIORS[(1, 0)])
+
+    # costs[i][j]: best cost of matching paragraphs[:i] with units[:j]
+    costs: list[dict[int, float]] = [{0: 0.0}]
+    matches: list[dict[int, tuple[int, int]]] = [{0: (0, 0)}]
+    for j in range(1, min(MAX_LEADING_UNITS, num_units) + 1):
+        costs[0][j] = costs[0][j - 1] + skip_cost + length_cost(0, unit_lengths[j - 1], ratio)
+        matches[0][j] = (0, 1)
+
+    for i in range(1, len(lengths) + 1):
+        row: dict[int, float] = {}
+        row_matches: dict[int, tuple[int, int]] = {}
+        for (paragraphs, units), match_cost in match_costs:
+            if paragraphs > i:
+                continue
+            original_length = paragraph_sums[i] - paragraph_sums[i - paragraphs]
+            for previous, cost in costs[i - paragraphs].items():
+                j = previous + units
+                if j > num_units:
+                    continue
+                cost += match_cost + length_cost(original_length, unit_sums[j] - unit_sums[previous], ratio)
+                if cost < row.get(j, math.inf):
+                    row[j] = cost
+                    row_matches[j] = (paragraphs, units)
+        if len(row) > BEAM_WIDTH:
+            row = dict(sorted(row.items(), key=lambda item: item[1])[:BEAM_WIDTH])
+        costs.append(row)
+        matches.append({j: row_matches[j] for j in row})
+
+    ranges: list[tuple[int, int]] = [(0, 0)] * len(lengths)
+    i, j = len(lengths), min(costs[-1], key=costs[-1].get)
+    while i > 0:
+        paragraphs, units = matches[i][j]
+        for index in range(i - paragraphs, i):
+            ranges[index] = (j - units, j)
+        i -= paragraphs
+        j -= units
+    return ranges
+
+
+def align_reference(paragraphs: list[str], text: str) -> list[tuple[int, int]] | None:
+    """
+    Align a reference text to the original paragraphs.
+
+    Args:
+        paragraphs: Original paragraphs, in order
+        text: Reference text, starting at the first paragraph's reference
+
+    Returns:
+        Char span [start, end) in text of each paragraph's reference (empty when it
+        has none), None when the text has too little structure to align
+    """
+    if not paragraphs or not text:
+        return None
+    lengths = [len(paragraph.strip()) for paragraph in paragraphs]
+    expected_length = sum(lengths) * INITIAL_CHAR_RATIO
+
+    for pattern, priors in ((LINE_END, LINE_MATCH_PRIORS), (SENTENCE_END, SENTENCE_MATCH_PRIORS)):
+        boundaries = split_units(text, pattern)
+        # Enough units where the paragraphs' references are expected
+        if bisect_right(boundaries, expected_length) * 2 >= len(paragraphs):
+            break
+    else:
+        logger.info("Reference text has too few lines or sentences to align %d paragraphs", len(paragraphs))
+        return None
+
+    prefix = bisect_right(boundaries, expected_length * PREFIX_FACTOR) + MAX_LEADING_UNITS
+    boundaries = boundaries[:prefix + 1]
+    unit_lengths = [len(text[start:end].strip()) for start, end in zip(boundaries, boundaries[1:])]
+
+    ratio = INITIAL_CHAR_RATIO
+    ranges = align_units(lengths, unit_lengths, ratio, priors)
+    aligned_length = sum(unit_lengths[:ranges[-1][1]])
+    if aligned_length and sum(lengths):
+        learned_ratio = aligned_length / sum(lengths)
+        if abs(learned_ratio - ratio) > 0.15 * ratio:
+            ratio = learned_ratio
+            ranges = align_units(lengths, unit_lengths, ratio, priors)
+
+    logger.debug("Aligned %d paragraphs with %d reference units (ratio %.2f)",
+                 len(paragraphs), ranges[-1][1], ratio)
+
+    spans = []
+    position = 0
+    for first, end in ranges:
+        if end > first:
+            spans.append((boundaries[first], boundaries[end]))
+            position = boundaries[end]
+        else:
+            spans.append((position, position))
+    return spans
@@ -0,0 +1,180 @@
+"""
+On-disk cache of complete provider responses.
+
+Responses are stored as files named by a hash of everything that determines them
+(provider, model, temperature, task prompt and input text), so an identical batch
+sent again, when a selection is re-run or a translation resumes after a crash, is
+answered from disk without a request and costs nothing. Only complete responses
+that translated every paragraph of their request are stored, failed, truncated and
+partial ones are not.
+
+When the files exceed RESPONSE_CACHE_MAX_BYTES the least recently used are removed.
+Sizes are tracked per process, files written by other processes are counted when
+the index is first loaded.
+"""
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "safot-response-cache"))
+
+# Max total size of the cached responses, 0 disables the cache
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def response_cache_key(provider: str, model: str, temperature: float, task_prompt: str, input_text: str) -> str:
+    digest = hashlib.sha256()
+    for part in (provider, model, repr(temperature), task_prompt, input_text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of response texts, one file per response."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Size of each cached file by key, least recently used first (loaded on first use)
+        self._sizes: OrderedDict[str, int] | None = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self):
+        if self._sizes is not None:
+            return
+        entries = []
+        if os.path.isdir(self.directory):
+            for subdirectory in os.scandir(self.directory):
+                if not subdirectory.is_dir():
+                    continue
+                for entry in os.scandir(subdirectory.path):
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        entries.sort()
+        self._sizes = OrderedDict((key, size) for _, key, size in entries)
+        self._total_bytes = sum(self._sizes.values())
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> str | None:
+        """Cached response text, None on a miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            # Modification time orders files for eviction when the index is loaded
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError as e:
+            logger.warning("Response cache read failed for %s: %s", key, e)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._load_index()
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return text
+
+    def put(self, key: str, text: str):
+        """Store a complete response text"""
+        data = text.encode("utf-8")
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            # Readers never see a partially written response
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("Response cache write failed for %s: %s", key, e)
+            return
+
+        with self._lock:
+            self._load_index()
+            self._total_bytes += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            self._evict()
+
+    def delete(self, key: str):
+        """Remove a cached response, if stored"""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Response cache delete failed for %s: %s", key, e)
+            return
+
+        with self._lock:
+            self._load_index()
+            self._total_bytes -= self._sizes.pop(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._load_index()
+            for key in list(self._sizes):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._sizes.clear()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._sizes),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_BYTES)
@@ -1,13 +1,14 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from docx import Document
 from io import BytesIO
 from peewee import fn
 from playhouse.shortcuts import model_to_dict
 import logging
 
-from models import Segments
+from db import db
+from models import Segments, SegmentsOrigins
 from services.source_service import create_or_update_sources
-from services.utils import microseconds
+from services.utils import microseconds, to_datetime
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
@@ -85,3 +86,90 @@ def store_segments(segments: list[dict]) -> list[dict]:
     create_or_update_sources(list(sources_to_update.values()))
 
     return saved_segments
+
+
+def store_segment_origin_links(relations: list[dict]) -> list[dict]:
+    """
+    Save segment origin links.
+    Each relation has origin_segment_id, origin_segment_timestamp, translated_segment_id
+    and translated_segment_timestamp (datetime, ISO string or epoch microseconds).
+    """
+    created_links = []
+    for rel in relations:
+        cursor = db.execute_sql("SELECT nextval('segments_origins_id_seq')")
+        link_id = cursor.fetchone()[0]
+
+        link = SegmentsOrigins.create(
+            id=link_id,
+            origin_segment_id=rel["origin_segment_id"],
+            origin_segment_timestamp=to_datetime(rel["origin_segment_timestamp"]),
+            translated_segment_id=rel["translated_segment_id"],
+            translated_segment_timestamp=to_datetime(rel["translated_segment_timestamp"]),
+        )
+        created_links.append(model_to_dict(link))
+
+    return created_links
+
+
+def store_translated_batch(
+    username: str,
+    translated_source_id: int,
+    original_segments: list[dict],
+    additional_sources_segments: list[dict],
+    translations: list[str],
+    additional_sources_paragraphs: list[list[str]],
+    remaining_additional_sources_texts: list[str],
+    properties: dict,
+) -> list[dict]:
+    """
+    Save one translated batch the way the frontend does after /translate:
+    translated segments, the paragraphs extracted from each additional source,
+    a new rest_of_text segment per additional source, and origin links from
+    each translated segment to its original and additional source segments.
+
+    original_segments are the batch's original segments ({id, timestamp, order}),
+    additional_sources_segments the current rest_of_text segment of each
+    additional source ({source_id, properties}).
+    """
+    now = datetime.now(timezone.utc)
+    first_order = original_segments[0]["order"]
+    next_order = original_segments[-1]["order"] + 1
+
+    def build_segments(paragraphs: list[str], source_id: int, segment_properties: dict, initial_order: int) -> list[dict]:
+        return [
+            {
+                "text": text,
+                "source_id": source_id,
+                "order": initial_order + index,
+                "properties": segment_properties,
+                "username": username,
+                "timestamp": now,
+            }
+            for index, text in enumerate(paragraphs)
+        ]
+
+    segments = build_segments(translations, translated_source_id, properties, first_order)
+    for source_segment, paragraphs in zip(additional_sources_segments, additional_sources_paragraphs):
+        segments.extend(build_segments(paragraphs, source_segment["source_id"], properties, first_order))
+    for source_segment, rest_of_text in zip(additional_sources_segments, remaining_additional_sources_texts):
+        segments.extend(build_segments([rest_of_text], source_segment["source_id"], source_segment.get("properties") or {}, next_order))
+
+    saved_segments = store_segments(segments)
+
+    # Link each translated segment to its original segment and additional source segments
+    count = len(translations)
+    relations = []
+    for i, translated_segment in enumerate(saved_segments[:count]):
+        origins = [original_segments[i]] + [
+            saved_segments[count * (j + 1) + i] for j in range(len(additional_sources_paragraphs))
+        ]
+        for origin in origins:
+            relations.append({
+                "origin_segment_id": origin["id"],
+                "origin_segment_timestamp": origin["timestamp"],
+                "translated_segment_id": translated_segment["id"],
+                "translated_segment_timestamp": translated_segment["timestamp"],
+            })
+    store_segment_origin_links(relations)
+
+    return saved_segments
@@ -0,0 +1,138 @@
+"""
+Tagged plain-text output format, an alternative to JSON responses.
+
+Each paragraph is a block of lines:
+
+    @@ 1
+    @ original
+    text of the original paragraph
+    @ English
+    its reference
+    @ translation
+    its translation
+
+Section text is written as is, so quotes (frequent in Hebrew gershayim) need no
+escaping and cannot break the response. Paragraphs are parsed line by line while
+the response streams, a paragraph is complete when the next one starts. Only
+"@ <name>" lines naming a section of the request start a section, other lines
+(a translated "@ mention" for one) are text.
+"""
+import re
+
+PARAGRAPH_MARKER = "@@"
+SECTION_MARKER = "@"
+
+# Section names of the TranslatedParagraph fields, other sections are references
+ORIGINAL_SECTION = "original"
+TRANSLATION_SECTION = "translation"
+
+PARAGRAPH_HEADER = re.compile(r"^@@ *(\d+)\s*$")
+SECTION_HEADER = re.compile(r"^@ +(\S.*?)\s*$")
+FENCE = re.compile(r"^```\w*\s*$")
+
+
+def format_tagged_paragraph(para_id, sections: list[tuple[str, str]]) -> str:
+    """Block of a paragraph with its (section name, text) sections"""
+    lines = [f"{PARAGRAPH_MARKER} {para_id}"]
+    for name, text in sections:
+        lines.append(f"{SECTION_MARKER} {name}")
+        lines.append(text)
+    return "\n".join(lines)
+
+
+class TaggedStreamParser:
+    """
+    Incremental parser for tagged responses, with the interface of ParagraphStreamParser.
+
+    feed() consumes response text deltas and returns the paragraphs completed by
+    them, finish() the last one once the response ended. Text before the first
+    paragraph and markdown code fence lines after the last one are ignored.
+    """
+
+    def __init__(self, reference_languages: list[str] | None = None):
+        """
+        Args:
+            reference_languages: Language names of the request's reference sections
+        """
+        self.pending: list[str] = []  # Start of a line not complete yet
+        # Section names by lowercase name, references keep the request's spelling
+        self.sections = {name.lower(): name for name in reference_languages or []}
+        self.sections.update({ORIGINAL_SECTION: ORIGINAL_SECTION, TRANSLATION_SECTION: TRANSLATION_SECTION})
+        self.paragraph: dict | None = None
+        self.section: str | None = None
+        self.lines: list[str] = []
+        # Fence lines (and blank lines after them) in a paragraph, text unless the response ends
+        self.fence_lines: list[str] = []
+
+    def feed(self, delta: str) -> list[dict]:
+        """
+        Consume the next piece of the response.
+
+        Returns:
+            Paragraph objects completed by this delta, in order
+        """
+        if "\n" not in delta:
+            self.pending.append(delta)
+            return []
+        self.pending.append(delta)
+        lines = "".join(self.pending).split("\n")
+        self.pending = [lines.pop()]
+
+        completed = []
+        for line in lines:
+            self._line(line.rstrip("\r"), completed)
+        return completed
+
+    def finish(self) -> list[dict]:
+        """Paragraphs completed by the end of the response"""
+        completed = []
+        self._line("".join(self.pending).rstrip("\r"), completed)
+        self.pending = []
+        self.fence_lines = []
+        self._end_paragraph(completed)
+        return completed
+
+    def _line(self, line: str, completed: list[dict]):
+        if self.paragraph is not None and (FENCE.match(line) or (self.fence_lines and not line.strip())):
+            self.fence_lines.append(line)
+            return
+        if self.fence_lines:
+            # More of the response follows, the fence is part of the text
+            self.lines.extend(self.fence_lines)
+            self.fence_lines = []
+
+        header = PARAGRAPH_HEADER.match(line)
+        if header:
+            self._end_paragraph(completed)
+            self.paragraph = {"id": int(header.group(1)), "references": {}}
+            return
+        if self.paragraph is None:
+            return
+        header = SECTION_HEADER.match(line)
+        if header and header.group(1).lower() in self.sections:
+            self._end_section()
+            self.section = self.sections[header.group(1).lower()]
+            self.lines = []
+        elif self.section is not None:
+            self.lines.append(line)
+
+    def _end_section(self):
+        if self.section is None:
+            return
+        text = "\n".join(self.lines).strip()
+        name = self.section
+        if name == ORIGINAL_SECTION:
+            self.paragraph["original_paragraph"] = text
+        elif name == TRANSLATION_SECTION:
+            self.paragraph["translation"] = text
+        else:
+            self.paragraph["references"][name] = text
+        self.section = None
+        self.lines = []
+
+    def _end_paragraph(self, completed: list[dict]):
+        if self.paragraph is None:
+            return
+        self._end_section()
+        completed.append(self.paragraph)
+        self.paragraph = None
@@ -0,0 +1,114 @@
+"""
+Process-wide token counting cache shared by all providers.
+
+Token counts are keyed by encoding name and a hash of the text, so the same
+paragraphs counted by /estimate-cost, by batch planning and by /translate
+are encoded with tiktoken only once.
+"""
+from array import array
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Max number of cached token counts (one per distinct text and encoding)
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "200000"))
+
+# Max number of cached token offset tables (one per reference text, can be large)
+TOKEN_OFFSETS_CACHE_SIZE = int(os.getenv("TOKEN_OFFSETS_CACHE_SIZE", "64"))
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with hit/miss counters."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+
+        # Compute outside the lock, concurrent misses on the same key are harmless
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_token_counts = LRUCache(TOKEN_COUNT_CACHE_SIZE)
+_token_offsets = LRUCache(TOKEN_OFFSETS_CACHE_SIZE)
+
+
+def _key(encoding, text: str) -> tuple[str, bytes]:
+    return encoding.name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def count_tokens(encoding, text: str) -> int:
+    """Return len(encoding.encode(text)), cached per encoding and text."""
+    if not text:
+        return 0
+    return _token_counts.get_or_compute(_key(encoding, text), lambda: len(encoding.encode(text)))
+
+
+def token_offsets(encoding, text: str) -> array:
+    """
+    Return the char offset of every token of text, cached per encoding and text.
+
+    Offsets are stored as a compact unsigned int array since reference texts
+    can be whole books.
+    """
+    def compute():
+        offsets = encoding.decode_with_offsets(encoding.encode(text))[1]
+        # Seed the count cache too, the offsets already tell how many tokens there are
+        _token_counts.put(_key(encoding, text), len(offsets))
+        return array("I", offsets)
+
+    return _token_offsets.get_or_compute(_key(encoding, text), compute)
+
+
+def get_token_cache_stats() -> dict:
+    """Hit/miss counters and sizes of the token caches."""
+    return {
+        "token_counts": _token_counts.stats(),
+        "token_offsets": _token_offsets.stats(),
+    }
+
+
+def clear_token_caches():
+    """Drop all cached entries and reset counters."""
+    _token_counts.clear()
+    _token_offsets.clear()
@@ -0,0 +1,188 @@
+"""
+Translation memory over the stored segments.
+
+Our corpus repeats headings, quotations and boilerplate. Before a translation is
+planned, paragraphs whose exact text was translated before, between the same
+languages and with the same task prompt, are taken from the stored segments and
+only the others are sent to the model.
+
+Original segments are found by md5(text) (expression index, see migration 014)
+and followed through segments_origins to the latest version of their translated
+segment, so corrections made by translators are reused too. The translated
+segment must belong to a source in the target language, and its latest version
+produced by a provider must carry the same properties.translation.prompt_hash (see
+BaseTranslationProvider.get_result_properties), which changes with the dictionary
+version the prompt was built from. Edited versions saved by the frontend have no
+translation properties, they inherit the hash of the version they correct.
+
+Near matches are found with a pg_trgm trigram index on segment text (migration
+015), which Postgres keeps up to date as store_segments inserts new segments.
+They are suggestions for translators, whatever prompt produced them.
+"""
+from typing import TypedDict
+import hashlib
+import logging
+
+from db import db
+from services.prompt import get_prompt_hash
+
+logger = logging.getLogger(__name__)
+
+# Longer segments (e.g. the rest of a reference text) are not in the trigram index
+FUZZY_MAX_TEXT_LENGTH = 4000
+
+
+class SimilarTranslation(TypedDict):
+    original_text: str
+    translation: str  # Latest version of the translated segment
+    similarity: float  # pg_trgm similarity to the searched text, 0 to 1
+    original_segment_id: int
+    translated_segment_id: int
+    translated_source_id: int
+
+
+def text_hash(text: str) -> str:
+    """Same as Postgres md5(text), used to look up original segments"""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def lookup_translations(
+    paragraphs: list[str],
+    original_language: str,
+    translate_language: str,
+    task_prompt: str,
+) -> dict[str, str]:
+    """
+    Find earlier translations of paragraphs.
+
+    Args:
+        paragraphs: Original paragraphs to translate
+        original_language: Language code of the paragraphs
+        translate_language: Target language code
+        task_prompt: Task prompt the paragraphs would be translated with
+
+    Returns:
+        Translation by original paragraph text, for the paragraphs found
+    """
+    if not paragraphs:
+        return {}
+
+    cursor = db.execute_sql(
+        """
+        SELECT DISTINCT ON (original.text) original.text, translated.text
+        FROM segments original
+        JOIN sources original_source ON original_source.id = original.source_id
+        JOIN segments_origins link
+            ON link.origin_segment_id = original.id
+            AND link.origin_segment_timestamp = original.timestamp
+        JOIN LATERAL (
+            SELECT text, source_id, timestamp
+            FROM segments
+            WHERE segments.id = link.translated_segment_id
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ) translated ON TRUE
+        JOIN LATERAL (
+            SELECT properties -> 'translation' ->> 'prompt_hash' AS prompt_hash
+            FROM segments
+            WHERE segments.id = link.translated_segment_id
+                AND properties -> 'translation' ->> 'prompt_hash' IS NOT NULL
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ) produced ON TRUE
+        JOIN sources translated_source ON translated_source.id = translated.source_id
+        WHERE md5(original.text) = ANY(%s)
+            AND original_source.language = %s
+            AND translated_source.language = %s
+            AND produced.prompt_hash = %s
+            AND translated.text <> ''
+        ORDER BY original.text, translated.timestamp DESC
+        """,
+        (
+            sorted({text_hash(paragraph) for paragraph in paragraphs}),
+            original_language,
+            translate_language,
+            get_prompt_hash(task_prompt),
+        ),
+    )
+
+    wanted = set(paragraphs)
+    translations = {original: translation for original, translation in cursor.fetchall() if original in wanted}
+    logger.info("Translation memory: %d of %d paragraphs (%d distinct) translated before",
+                sum(1 for paragraph in paragraphs if paragraph in translations), len(paragraphs), len(wanted))
+    return translations
+
+
+def find_similar_translations(
+    texts: list[str],
+    original_language: str,
+    translate_language: str,
+    limit: int = 5,
+    min_similarity: float = 0.5,
+) -> list[list[SimilarTranslation]]:
+    """
+    Find translations of paragraphs similar to each of texts.
+
+    Args:
+        texts: Paragraphs to find earlier translations for
+        original_language: Language code of texts
+        translate_language: Target language code
+        limit: Maximum matches per text
+        min_similarity: Lowest trigram similarity returned
+
+    Returns:
+        Best matches of each text, most similar first
+    """
+    results = []
+    with db.atomic():
+        # Used by the % operator, which is what the trigram index can answer
+        db.execute_sql("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", (str(min_similarity),))
+        for text in texts:
+            cursor = db.execute_sql(
+                """
+                SELECT * FROM (
+                    -- A translated segment can be linked from several versions of its original
+                    SELECT DISTINCT ON (translated.id)
+                        original.text, translated.text, similarity(original.text, %s) AS similarity,
+                        original.id, translated.id, translated.source_id
+                    FROM segments original
+                    JOIN sources original_source ON original_source.id = original.source_id
+                    JOIN segments_origins link
+                        ON link.origin_segment_id = original.id
+                        AND link.origin_segment_timestamp = original.timestamp
+                    JOIN LATERAL (
+                        SELECT id, text, source_id
+                        FROM segments
+                        WHERE segments.id = link.translated_segment_id
+                        ORDER BY timestamp DESC
+                        LIMIT 1
+                    ) translated ON TRUE
+                    JOIN sources translated_source ON translated_source.id = translated.source_id
+                    WHERE original.text %% %s
+                        AND length(original.text) <= %s
+                        AND original_source.language = %s
+                        AND translated_source.language = %s
+                        AND translated.text <> ''
+                    ORDER BY translated.id, similarity DESC
+                ) matches
+                ORDER BY similarity DESC
+                LIMIT %s
+                """,
+                (text, text, FUZZY_MAX_TEXT_LENGTH, original_language, translate_language, limit),
+            )
+            results.append([
+                SimilarTranslation(
+                    original_text=original_text,
+                    translation=translation,
+                    similarity=round(similarity, 4),
+                    original_segment_id=original_segment_id,
+                    translated_segment_id=translated_segment_id,
+                    translated_source_id=translated_source_id,
+                )
+                for original_text, translation, similarity, original_segment_id, translated_segment_id, translated_source_id
+                in cursor.fetchall()
+            ])
+
+    logger.info("Translation memory: similar translations for %d texts, %d found",
+                len(texts), sum(len(matches) for matches in results))
+    return results
@@ -1,26 +1,15 @@
-import threading
 import tiktoken
 import logging
 from openai import OpenAI
 from openai import OpenAIError, APITimeoutError
 from datetime import datetime
 from models import TranslationServiceOptions
+from services.json_stream import repair_json
 from services.prompt import get_task_prompt, format_input, LANGUAGES
 from typing import List, TypedDict
 import re
 import json
 
-# Global locks per provider to prevent concurrent translations that would exceed TPM limits
-_provider_locks = {}
-_locks_lock = threading.Lock()
-
-def get_provider_lock(provider: str) -> threading.Lock:
-    """Get or create a lock for the given provider (thread-safe)"""
-    with _locks_lock:
-        if provider not in _provider_locks:
-            _provider_locks[provider] = threading.Lock()
-        return _provider_locks[provider]
-
 logger = logging.getLogger(__name__)
 
 # Multiplier for translated text in other languages (including references)
@@ -292,9 +281,13 @@ class TranslationService:
             try:
                 response_json = json.loads(json_text)
             except json.JSONDecodeError as e:
-                logger.error("Failed to parse JSON response: %s", e)
-                logger.error("Response text: %s", json_text[:500])
-                raise ValueError(f"Failed to parse JSON response: {e}")
+                try:
+                    response_json = json.loads(repair_json(text))
+                    logger.debug("Repaired malformed JSON response")
+                except ValueError:
+                    logger.error("Failed to parse JSON response: %s", e)
+                    logger.error("Response text: %s", json_text[:500])
+                    raise ValueError(f"Failed to parse JSON response: {e}")
 
             paragraphs = response_json.get("paragraphs", [])
             if not paragraphs:
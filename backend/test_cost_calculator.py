@@ -129,5 +129,51 @@ class TestCalculateCost:
         assert claude_cost["total_cost"] > openai_cost["total_cost"]
 
 
+    def test_openai_cached_input_tokens(self):
+        """Tokens read from the prompt cache are billed at the cached input price"""
+        result = calculate_cost(
+            input_tokens=100000,
+            output_tokens=0,
+            provider=Provider.OPENAI,
+            model="gpt-4o",
+            cached_input_tokens=80000,
+        )
+
+        # Input: (20000 * 2.5 + 80000 * 1.25) / 1M = 0.05 + 0.1 = 0.15
+        assert result["cached_input_tokens"] == 80000
+        assert result["input_cost"] == 0.15
+
+    def test_claude_cache_reads_and_writes(self):
+        """Claude bills cache writes above and cache reads well below the input price"""
+        result = calculate_cost(
+            input_tokens=100000,
+            output_tokens=0,
+            provider=Provider.CLAUDE,
+            model="claude-sonnet-4-5-20250929",
+            cached_input_tokens=80000,
+            cache_write_tokens=10000,
+        )
+
+        # Input: (10000 * 3.0 + 80000 * 0.3 + 10000 * 3.75) / 1M = 0.03 + 0.024 + 0.0375 = 0.0915
+        assert result["cache_write_tokens"] == 10000
+        assert result["input_cost"] == 0.0915
+
+    def test_model_without_prompt_caching(self):
+        """Cached tokens of models without a cached price cost the same as regular input"""
+        cached = calculate_cost(10000, 0, Provider.OPENAI, "gpt-4", cached_input_tokens=5000)
+        uncached = calculate_cost(10000, 0, Provider.OPENAI, "gpt-4")
+
+        assert cached["input_cost"] == uncached["input_cost"]
+
+    def test_bulk_discount(self):
+        """Batch API requests cost half of both input and output"""
+        result = calculate_cost(1000000, 1000000, Provider.CLAUDE, "claude-sonnet-4-5-20250929", bulk=True)
+
+        # (3.0 + 15.0) / 2
+        assert result["input_cost"] == 1.5
+        assert result["output_cost"] == 7.5
+        assert result["total_cost"] == 9.0
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "-s"])
@@ -2,13 +2,54 @@
 Tests for provider abstraction and both OpenAI/Claude providers
 """
 import pytest
+import copy
+import asyncio
 import logging
 import json
-from unittest.mock import MagicMock, patch
-from services.base_provider import OTHER_LANG_TEXT_MULTIPLIER, repair_json_quotes
-from services.openai_provider import OpenAIProvider
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, PropertyMock, patch
+from anthropic import Anthropic
+from openai import OpenAI
+from services import base_provider, client_pool, rate_limiter
+from services.token_cache import LRUCache, count_tokens, clear_token_caches, get_token_cache_stats
+from services.json_stream import ParagraphStreamParser
+from services.output_calibration import OutputCalibrator
+from services.rate_limiter import (
+    TPM_WINDOW_SECONDS,
+    RateLimits,
+    SlidingWindowLimiter,
+    get_rate_limiter,
+    get_rate_limiter_stats,
+)
+from services.rate_limits import get_model_rate_limits, reload_rate_limits
+from services.reference_alignment import align_reference
+from services.response_cache import ResponseCache
+from services.base_provider import (
+    BatchPlanner,
+    CheckpointStore,
+    OTHER_LANG_TEXT_MULTIPLIER,
+    TranslationResult,
+    TruncatedResponseError,
+    dedupe_paragraphs,
+    get_truncation_stats,
+    repair_json_quotes,
+)
+from services.openai_provider import OPENAI_MODELS, OpenAIProvider
 from services.claude_provider import ClaudeProvider
-from models import TranslationServiceOptions, Provider
+from services.prompt import (
+    format_input,
+    get_compact_task_prompt,
+    get_input_paragraphs,
+    get_input_reference_languages,
+    get_lean_task_prompt,
+    get_response_schema,
+    get_tagged_task_prompt,
+    get_task_prompt,
+)
+from services.tagged_output import TaggedStreamParser
+from models import OutputFormat, TranslationServiceOptions, Provider
 
 # Setup logging for test visibility
 logging.basicConfig(level=logging.DEBUG, format='%(message)s')
@@ -627,6 +668,2111 @@ class TestJSONRepair:
         assert "свят" in parsed["paragraphs"][0]["references"]["Bulgarian"]
         assert "world" in parsed["paragraphs"][0]["translation"]
 
+    def test_repair_json_quotes_fences_and_trailing_commas(self):
+        """Fenced compact JSON with gershayim and trailing commas is repaired"""
+        malformed_json = (
+            '```json\n{"paragraphs":[{"id":1,"original_paragraph":"אמר הרמב"ם ורש"י",'
+            '"references":{"English":"said "yes" "no"",},"translation":"сказал "да"",},]}\n```'
+        )
+
+        parsed = json.loads(repair_json_quotes(malformed_json))
+
+        assert parsed["paragraphs"] == [{
+            "id": 1,
+            "original_paragraph": 'אמר הרמב"ם ורש"י',
+            "references": {"English": 'said "yes" "no"'},
+            "translation": 'сказал "да"',
+        }]
+
+    def test_repair_json_quotes_incomplete(self):
+        """A response without a complete object cannot be repaired"""
+        with pytest.raises(ValueError, match="Incomplete"):
+            repair_json_quotes('{"paragraphs": [{"id": 1, "translation": "cut')
+
+    def test_repair_json_quotes_long_response(self):
+        """A ~16k token response with unescaped quotes is repaired in one pass"""
+        paragraphs = [
+            {"id": i, "original_paragraph": f'צה"ל {i}', "references": {}, "translation": f'the "army" {i}'}
+            for i in range(1, 1500)
+        ]
+        malformed_json = json.dumps({"paragraphs": paragraphs}, ensure_ascii=False).replace('\\"', '"')
+
+        assert json.loads(repair_json_quotes(malformed_json))["paragraphs"] == paragraphs
+
+
+class TestBatchPlanner:
+    """Test prefix-sum batch planning"""
+
+    def test_planned_batches_fit_limits(self, translation_provider):
+        """Every planned batch fits TPM when counted the regular (joined) way"""
+        task_prompt = "Translate:"
+        paragraphs = create_paragraphs(300, words_per_paragraph=40)
+        sources = [create_paragraph(15000)]
+        planner = BatchPlanner(translation_provider, task_prompt, paragraphs, sources)
+
+        start = 0
+        batches = []
+        while start < len(paragraphs):
+            batch = planner.plan(start, [start * 100])
+            batches.append(batch)
+            start += len(batch["paragraphs"])
+
+            input_tokens = translation_provider.calculate_input_tokens(
+                task_prompt, batch["paragraphs"], batch["additional_sources_texts"]
+            )
+            output_tokens = translation_provider.estimate_output_tokens(batch["paragraphs"], 1)
+            assert input_tokens + output_tokens <= batch["estimated_tokens"] <= translation_provider.options.tpm_limit
+            assert batch["max_output_tokens"] >= output_tokens
+
+        logger.info(f"Planned {len(batches)} batches: {[len(b['paragraphs']) for b in batches]}")
+        assert len(batches) > 1
+        assert sum(len(b["paragraphs"]) for b in batches) == len(paragraphs)
+
+    def test_planned_batches_fit_input_and_output_limits(self, translation_provider):
+        """ITPM and OTPM cap each batch's input and output, max_output_tokens stays under OTPM"""
+        translation_provider.options.tpm_limit = 0
+        translation_provider.options.itpm_limit = 4000
+        translation_provider.options.otpm_limit = 1500
+        paragraphs = create_paragraphs(100, words_per_paragraph=40)
+        planner = BatchPlanner(translation_provider, "Translate:", paragraphs, None)
+
+        start = 0
+        while start < len(paragraphs):
+            batch = planner.plan(start)
+            start += len(batch["paragraphs"])
+
+            assert batch["input_tokens"] <= 4000
+            assert batch["estimated_tokens"] - batch["input_tokens"] <= 1500
+            assert batch["max_output_tokens"] <= 1500
+
+    def test_tokenizes_each_text_once(self, translation_provider):
+        """Planning a whole document encodes every paragraph, prompt and reference once"""
+        task_prompt = "Translate:"
+        paragraphs = create_paragraphs(500, words_per_paragraph=40)
+        sources = [create_paragraph(20000), create_paragraph(20000)]
+        encoding = translation_provider.encoding
+        clear_token_caches()
+
+        with patch.object(translation_provider, "encoding", MagicMock(wraps=encoding)) as counted:
+            counted.name = encoding.name
+            planner = BatchPlanner(translation_provider, task_prompt, paragraphs, sources)
+            start = 0
+            while start < len(paragraphs):
+                start += len(planner.plan(start, [0, 0])["paragraphs"])
+
+        # prompt + paragraph tag + each distinct paragraph and reference
+        assert counted.encode.call_count == 2 + len(set(paragraphs)) + len(set(sources))
+
+        # Planning again is served entirely from the token cache
+        with patch.object(translation_provider, "encoding", MagicMock(wraps=encoding)) as counted:
+            counted.name = encoding.name
+            BatchPlanner(translation_provider, task_prompt, paragraphs, sources).plan(0, [0, 0])
+        assert counted.encode.call_count == 0
+
+    def test_no_paragraphs_fit(self, translation_provider):
+        """A prompt larger than the TPM limit cannot fit anything"""
+        task_prompt = "Translate: " * 40000
+        planner = BatchPlanner(translation_provider, task_prompt, create_paragraphs(3), None)
+
+        with pytest.raises(ValueError, match="Cannot fit any paragraphs"):
+            planner.plan(0)
+
+
+class FakeClock:
+    """Deterministic replacement for the time module used by TPM budgeting"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def fake_send_for_translation(task_prompt, input_text, max_output_tokens):
+    """Echo translation: 'T:' + paragraph, references matched by paragraph number"""
+    sources = re.findall(r'<text language="([^"]+)">(.*?)</text>', input_text, re.DOTALL)
+    paragraphs = []
+    for para_id, text in re.findall(r'<p id="(\d+)">(.*?)</p>', input_text, re.DOTALL):
+        number = text.split(" ")[0][1:]
+        references = {}
+        for language, source_text in sources:
+            match = re.search(rf"r{number} [^|]*\|", source_text)
+            references[language] = match.group(0) if match else ""
+        paragraphs.append({
+            "id": int(para_id),
+            "original_paragraph": text,
+            "references": references,
+            "translation": f"T:{text}",
+        })
+    return paragraphs
+
+
+class TestConcurrentTranslation:
+    """Test concurrent batch dispatch in translate_paragraphs"""
+
+    @pytest.fixture(params=[
+        (Provider.OPENAI, "gpt-4o"),
+        (Provider.CLAUDE, "claude-sonnet-4-5-20250929"),
+    ])
+    def concurrent_provider(self, request):
+        provider_type, model = request.param
+        options = TranslationServiceOptions(
+            model=model,
+            provider=provider_type,
+            temperature=0.2,
+            tpm_limit=3000,
+            max_concurrent_batches=4,
+        )
+        if provider_type == Provider.OPENAI:
+            return OpenAIProvider(api_key="test_key", options=options)
+        return ClaudeProvider(api_key="test_key", options=options)
+
+    def test_results_in_paragraph_order(self, concurrent_provider):
+        """Batches sent in parallel are reassembled in paragraph order"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(60)]
+        clock = FakeClock()
+
+        with patch.object(concurrent_provider, "send_for_translation", side_effect=fake_send_for_translation) as send, \
+                patch.object(rate_limiter, "time", clock):
+            result = concurrent_provider.translate_paragraphs("he", paragraphs, [], [], "en")
+
+        logger.info(f"Sent {send.call_count} batches, slept {clock.sleeps}")
+        assert send.call_count > 1
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert result["remaining_additional_sources_texts"] == []
+
+    def test_references_follow_learned_ratio(self, concurrent_provider):
+        """Later batches get reference slices at their position, without sequential consumption"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        # Reference is ~20% longer than the original
+        reference = "".join(f"r{i} " + create_paragraph(24) + "|" for i in range(40))
+
+        with patch.object(concurrent_provider, "send_for_translation", side_effect=fake_send_for_translation) as send, \
+                patch.object(rate_limiter, "time", FakeClock()):
+            result = concurrent_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        assert send.call_count > 2
+        english = result["references_by_language"]["English"]
+        assert len(english) == len(paragraphs)
+        assert english == [f"r{i} " + create_paragraph(24) + "|" for i in range(40)]
+        assert result["remaining_additional_sources_texts"] == [""]
+
+    def test_batches_wait_for_tpm_budget(self, concurrent_provider):
+        """Concurrent batches beyond tpm_limit wait for the shared window to free up"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(60)]
+        clock = FakeClock()
+
+        with patch.object(concurrent_provider, "send_for_translation", side_effect=fake_send_for_translation) as send, \
+                patch.object(rate_limiter, "time", clock):
+            result = concurrent_provider.translate_paragraphs("he", paragraphs, [], [], "en")
+
+        stats = get_rate_limiter_stats()[concurrent_provider.rate_limiter.name]
+        logger.info(f"Sent {send.call_count} batches, slept {clock.sleeps}, stats {stats}")
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert clock.sleeps
+        assert stats["reservations"] == send.call_count
+        assert stats["waits"] > 0
+        assert stats["waiting"] == 0
+
+
+def tpm_limits(tpm: int) -> RateLimits:
+    return RateLimits(rpm=0, itpm=0, otpm=0, tpm=tpm)
+
+
+class TestRateLimiter:
+    """Test the sliding-window limiter shared by all requests to a provider model"""
+
+    def test_admits_within_limit(self):
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", tpm_limits(3000))
+
+        with patch.object(rate_limiter, "time", clock):
+            limiter.reserve(2000)
+            limiter.reserve(900)
+
+        assert clock.sleeps == []
+        assert limiter.stats()["reservations"] == 2
+
+    def test_waits_for_window_to_expire(self):
+        """A request beyond the limit waits until the oldest requests leave the window"""
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", tpm_limits(3000))
+
+        with patch.object(rate_limiter, "time", clock):
+            limiter.reserve(2000)
+            clock.now = 10
+            limiter.reserve(900)
+            limiter.reserve(500)
+            stats = limiter.stats()
+
+        # Only the first request has to expire to make room
+        assert clock.sleeps == [TPM_WINDOW_SECONDS - 10]
+        assert [tokens for _, tokens, _, _ in limiter.entries] == [900, 500]
+        assert stats["used"]["tpm"] == 1400
+        assert stats["waits"] == 1
+        assert stats["max_wait_seconds"] == TPM_WINDOW_SECONDS - 10
+
+    def test_oversized_request_goes_alone(self):
+        """A request larger than the limit is admitted once the window is empty"""
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", tpm_limits(1000))
+
+        with patch.object(rate_limiter, "time", clock):
+            limiter.reserve(5000)
+            limiter.reserve(100)
+
+        assert clock.sleeps == [TPM_WINDOW_SECONDS]
+
+    def test_reconcile_with_actual_usage(self):
+        """Reservations are corrected to the reported usage, freeing over-estimated tokens"""
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", tpm_limits(3000))
+
+        with patch.object(rate_limiter, "time", clock):
+            reservation = limiter.reserve(2500)
+            reservation.reconcile(1200)
+            limiter.reserve(1500)
+
+            assert clock.sleeps == []
+            assert limiter.used["tpm"] == 2700
+
+            # Reconciling after the entry left the window does not touch used
+            clock.now = TPM_WINDOW_SECONDS + 1
+            limiter.reserve(100)
+            reservation.reconcile(5000)
+
+        assert limiter.used["tpm"] == 100
+
+    def test_disabled_limit(self):
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", tpm_limits(0))
+
+        with patch.object(rate_limiter, "time", clock):
+            for _ in range(10):
+                limiter.reserve(100000)
+
+        assert clock.sleeps == []
+        assert limiter.stats()["reservations"] == 10
+
+    def test_async_reserve_waits(self):
+        """Async callers sleep on the event loop while the window is full"""
+        limiter = SlidingWindowLimiter("test", tpm_limits(1000), window_seconds=0.05)
+
+        async def run():
+            await limiter.areserve(800)
+            await limiter.areserve(800)
+
+        asyncio.run(run())
+
+        stats = limiter.stats()
+        assert stats["waits"] == 1
+        assert stats["wait_seconds"] > 0
+        assert stats["waiting"] == 0
+
+    def test_separate_input_and_output_limits(self):
+        """Input and output tokens are limited separately, the tightest limit decides"""
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", RateLimits(rpm=0, itpm=1000, otpm=200, tpm=0))
+
+        with patch.object(rate_limiter, "time", clock):
+            limiter.reserve(800, 100)
+            limiter.reserve(100, 50)
+            assert clock.sleeps == []
+
+            # Input still fits, output does not
+            limiter.reserve(50, 100)
+
+        assert clock.sleeps == [TPM_WINDOW_SECONDS]
+        assert limiter.used == {"rpm": 1, "itpm": 50, "otpm": 100, "tpm": 150}
+
+    def test_requests_per_minute(self):
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter("test", RateLimits(rpm=2, itpm=0, otpm=0, tpm=0))
+
+        with patch.object(rate_limiter, "time", clock):
+            for _ in range(5):
+                limiter.reserve(10, 10)
+
+        assert clock.sleeps == [TPM_WINDOW_SECONDS, TPM_WINDOW_SECONDS]
+
+    def test_registry_shares_limiter_per_model(self):
+        """All requests to a provider model share one limiter, with the latest limits"""
+        limiter = get_rate_limiter("openai:gpt-4o", tpm_limits(30000))
+
+        assert get_rate_limiter("openai:gpt-4o", tpm_limits(50000)) is limiter
+        assert limiter.limits["tpm"] == 50000
+        assert get_rate_limiter("openai:gpt-4", tpm_limits(10000)) is not limiter
+        assert set(get_rate_limiter_stats()) == {"openai:gpt-4o", "openai:gpt-4"}
+
+    def test_providers_share_window(self, translation_provider):
+        """Two provider instances of the same model reserve in the same window"""
+        other = type(translation_provider)(api_key="test_key", options=translation_provider.options.model_copy())
+
+        assert other.rate_limiter is translation_provider.rate_limiter
+
+
+class TestRateLimits:
+    """Test the per-model rate limit registry"""
+
+    @pytest.fixture(autouse=True)
+    def no_overrides(self, monkeypatch):
+        monkeypatch.delenv("RATE_LIMITS", raising=False)
+        monkeypatch.delenv("RATE_LIMITS_FILE", raising=False)
+        reload_rate_limits()
+        yield
+        reload_rate_limits()
+
+    def test_defaults_from_model_list(self):
+        haiku = get_model_rate_limits(Provider.CLAUDE, "claude-haiku-4-5-20251001")
+        opus = get_model_rate_limits(Provider.CLAUDE, "claude-opus-4-6")
+
+        assert haiku == {"rpm": 50, "itpm": 50000, "otpm": 10000, "tpm": 0}
+        assert opus["otpm"] < haiku["otpm"]
+        assert get_model_rate_limits(Provider.OPENAI, "gpt-4o")["tpm"] == 30000
+
+    def test_unknown_model_uses_default(self):
+        assert get_model_rate_limits(Provider.OPENAI, "gpt-unknown") == {"rpm": 0, "itpm": 0, "otpm": 0, "tpm": 30000}
+
+    def test_file_and_env_overrides(self, monkeypatch, tmp_path):
+        """The file overrides model defaults, RATE_LIMITS overrides the file, "*" applies to all models"""
+        path = tmp_path / "rate_limits.json"
+        path.write_text(json.dumps({
+            "claude": {
+                "*": {"rpm": 1000},
+                "claude-haiku-4-5-20251001": {"itpm": 400000, "otpm": 80000},
+            },
+        }))
+        monkeypatch.setenv("RATE_LIMITS_FILE", str(path))
+        monkeypatch.setenv("RATE_LIMITS", json.dumps({"claude": {"claude-haiku-4-5-20251001": {"otpm": 90000}}}))
+        reload_rate_limits()
+
+        assert get_model_rate_limits(Provider.CLAUDE, "claude-haiku-4-5-20251001") == {
+            "rpm": 1000, "itpm": 400000, "otpm": 90000, "tpm": 0,
+        }
+        assert get_model_rate_limits(Provider.CLAUDE, "claude-opus-4-6")["rpm"] == 1000
+        assert get_model_rate_limits(Provider.OPENAI, "gpt-4o")["rpm"] == 500
+
+    def test_unknown_limit_name(self, monkeypatch):
+        monkeypatch.setenv("RATE_LIMITS", json.dumps({"openai": {"gpt-4o": {"tokens": 1}}}))
+        reload_rate_limits()
+
+        with pytest.raises(ValueError, match="Unknown rate limits"):
+            get_model_rate_limits(Provider.OPENAI, "gpt-4o")
+
+
+class TestClientPool:
+    """Test that providers share API clients and encodings across requests"""
+
+    def test_providers_share_clients(self, translation_provider):
+        other = type(translation_provider)(api_key="test_key", options=translation_provider.options.model_copy())
+
+        assert other.client is translation_provider.client
+        assert other.encoding is translation_provider.encoding
+
+    def test_async_clients_per_event_loop(self, translation_provider):
+        """Async clients are shared within an event loop, each loop gets its own"""
+        other = type(translation_provider)(api_key="test_key", options=translation_provider.options.model_copy())
+
+        async def clients():
+            return translation_provider.get_async_client(), other.get_async_client()
+
+        first, same_loop = asyncio.run(clients())
+        second, _ = asyncio.run(clients())
+
+        assert first is same_loop
+        assert second is not first
+        # Clients of the first, closed loop were dropped when the second loop needed one
+        assert len({loop for _, _, loop in client_pool._async_clients}) == 1
+
+    def test_api_keys_get_separate_clients(self, translation_provider):
+        other = type(translation_provider)(api_key="other_key", options=translation_provider.options.model_copy())
+
+        assert other.client is not translation_provider.client
+        assert other.client.api_key == "other_key"
+
+    def test_keep_alive_limits(self):
+        limits = client_pool.connection_limits()
+
+        assert limits.max_keepalive_connections == client_pool.PROVIDER_MAX_KEEPALIVE_CONNECTIONS
+        assert limits.keepalive_expiry == client_pool.PROVIDER_KEEPALIVE_SECONDS
+
+    def test_http2_needs_h2(self):
+        """HTTP/2 falls back to HTTP/1.1 when the optional h2 package is missing"""
+        with patch.object(client_pool, "PROVIDER_HTTP2", True), \
+                patch.object(client_pool.importlib.util, "find_spec", return_value=None):
+            assert client_pool.http2_enabled() is False
+
+        with patch.object(client_pool, "PROVIDER_HTTP2", False):
+            assert client_pool.http2_enabled() is False
+
+
+class WordEncoding:
+    """Minimal tiktoken-like encoding, one token per word"""
+    name = "words"
+
+    def __init__(self):
+        self.encode = MagicMock(side_effect=lambda text: text.split())
+
+
+class TestTokenCache:
+    """Test the shared token-count cache"""
+
+    def test_hits_and_misses(self):
+        """Repeated texts are encoded once and counted as hits"""
+        clear_token_caches()
+        encoding = WordEncoding()
+
+        assert count_tokens(encoding, "one two three") == 3
+        assert count_tokens(encoding, "one two three") == 3
+        assert count_tokens(encoding, "four") == 1
+        assert count_tokens(encoding, "") == 0
+
+        assert encoding.encode.call_count == 2
+        stats = get_token_cache_stats()["token_counts"]
+        assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 2)
+
+    def test_keyed_by_encoding(self):
+        """The same text under another encoding is counted separately"""
+        clear_token_caches()
+        words, other = WordEncoding(), WordEncoding()
+        other.name = "other"
+
+        count_tokens(words, "same text")
+        count_tokens(other, "same text")
+
+        assert words.encode.call_count == 1
+        assert other.encode.call_count == 1
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted first"""
+        cache = LRUCache(max_size=2)
+        cache.get_or_compute("a", lambda: 1)
+        cache.get_or_compute("b", lambda: 2)
+        cache.get_or_compute("a", lambda: 1)
+        cache.get_or_compute("c", lambda: 3)
+
+        compute = MagicMock(return_value=0)
+        assert cache.get_or_compute("a", compute) == 1
+        assert cache.get_or_compute("c", compute) == 3
+        assert compute.call_count == 0
+
+        assert cache.get_or_compute("b", compute) == 0
+        assert compute.call_count == 1
+        assert cache.stats()["size"] == 2
+
+    def test_input_tokens_reuse_cache(self, translation_provider):
+        """Estimating cost and translating the same paragraphs share cache entries"""
+        clear_token_caches()
+        paragraphs = create_paragraphs(20)
+        sources = [create_paragraph(500)]
+
+        first = translation_provider.calculate_input_tokens("Translate:", paragraphs, sources)
+        misses = get_token_cache_stats()["token_counts"]["misses"]
+        second = translation_provider.calculate_input_tokens("Translate:", paragraphs, sources)
+        stats = get_token_cache_stats()["token_counts"]
+
+        logger.info("Token cache after two estimates: %s", stats)
+        assert first == second
+        assert stats["misses"] == misses
+        assert stats["hits"] >= len(paragraphs) + 3
+
+
+def fake_stream_translation_text(task_prompt, input_text, max_output_tokens):
+    """Streams the fake_send_for_translation response in small fenced chunks"""
+    text = "```json\n" + json.dumps({"paragraphs": fake_send_for_translation(task_prompt, input_text, max_output_tokens)}) + "\n```"
+    for i in range(0, len(text), 7):
+        yield text[i:i + 7]
+
+
+class TestParagraphStreamParser:
+    """Test incremental parsing of streamed paragraph responses"""
+
+    def test_parser_yields_each_paragraph_when_closed(self):
+        """Objects are cut out as soon as their closing brace arrives"""
+        paragraphs = [
+            {"id": 1, "original_paragraph": "a {b} [c]", "references": {"English": 'say \\"hi\\"'}, "translation": "x}"},
+            {"id": 2, "original_paragraph": "d", "references": {}, "translation": "y"},
+        ]
+        text = "```json\n" + json.dumps({"paragraphs": paragraphs}, indent=2) + "\n```"
+        first_end = text.index('"x}"') + len('"x}"\n    }')
+
+        parser = ParagraphStreamParser()
+        completed = []
+        for i, char in enumerate(text):
+            for para in parser.feed(char):
+                completed.append((i, para))
+
+        assert [para for _, para in completed] == paragraphs
+        assert completed[0][0] == first_end - 1
+
+    @pytest.mark.parametrize("chunk_size", [1, 5, 10000])
+    def test_unescaped_quotes(self, chunk_size):
+        """Unescaped quotes are kept as text whatever the chunking, as repair_json_quotes does"""
+        text = (
+            '{"paragraphs": [\n'
+            '  {"id": 1, "original_paragraph": "He said "hi", then left", '
+            '"references": {"English": "a "quoted" word"}, "translation": "the "note": here"},\n'
+            '  {"id": 2, "original_paragraph": "ends with "quote"", "references": {}, "translation": "ok"}\n'
+            ']}'
+        )
+        parser = ParagraphStreamParser()
+        paragraphs = []
+        for i in range(0, len(text), chunk_size):
+            paragraphs.extend(parser.feed(text[i:i + chunk_size]))
+
+        assert [para["original_paragraph"] for para in paragraphs] == ['He said "hi", then left', 'ends with "quote"']
+        assert paragraphs[0]["references"] == {"English": 'a "quoted" word'}
+        assert paragraphs[0]["translation"] == 'the "note": here'
+
+    def test_send_for_translation_parses_streamed_response(self, translation_provider):
+        """send_for_translation collects the incrementally parsed paragraphs"""
+        input_text = '<p id="1">one</p>\n<p id="2">two</p>'
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+            paragraphs = translation_provider.send_for_translation("", input_text, 100)
+
+        assert [para["translation"] for para in paragraphs] == ["T:one", "T:two"]
+
+    def test_missing_translation(self, translation_provider):
+        """Paragraph objects without a translation are rejected"""
+        with patch.object(translation_provider, "stream_translation_text", return_value=iter(['{"paragraphs": [{"id": 1}]}'])):
+            with pytest.raises(ValueError, match="Missing 'translation' in paragraph 0"):
+                translation_provider.send_for_translation("", "", 100)
+
+    def test_incomplete_response(self, translation_provider):
+        """A response that ends inside the JSON is rejected, even after complete paragraphs"""
+        text = '{"paragraphs": [{"id": 1, "translation": "T:one"}, {"id": 2, "transl'
+        with patch.object(translation_provider, "stream_translation_text", return_value=iter([text])):
+            with pytest.raises(ValueError, match="Incomplete JSON object in response"):
+                translation_provider.send_for_translation("", '<p id="1">one</p>\n<p id="2">two</p>', 100)
+
+    def test_missing_paragraphs(self, translation_provider):
+        """A complete response without every paragraph of the request is rejected"""
+        text = '{"paragraphs": [{"id": 1, "translation": "T:one"}]}'
+        with patch.object(translation_provider, "stream_translation_text", return_value=iter([text])):
+            with pytest.raises(ValueError, match="Response has 1 paragraphs, the request has 2"):
+                translation_provider.send_for_translation("", '<p id="1">one</p>\n<p id="2">two</p>', 100)
+
+    def test_short_batch_does_not_advance(self, translation_provider):
+        """A batch is only finished once all of its paragraphs are translated"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(3)]
+
+        def short_send(task_prompt, input_text, max_output_tokens):
+            return fake_send_for_translation(task_prompt, input_text, max_output_tokens)[:-1]
+
+        progress = translation_provider.start_translation("he", paragraphs, [], [], "ru")
+        with patch.object(translation_provider, "send_for_translation", side_effect=short_send):
+            with pytest.raises(ValueError, match="Response has 2 paragraphs, the request has 3"):
+                list(translation_provider.iter_translation(progress))
+
+        assert progress.paragraph_offset == 0
+
+
+class TestStreaming:
+    """Test streamed translation responses"""
+
+    def test_stream_for_translation_yields_before_response_ends(self, translation_provider):
+        """The first paragraph is available while the rest of the response is still streaming"""
+        input_text = '<p id="1">one</p>\n<p id="2">two</p>'
+        chunks = []
+
+        def tracked_stream(*args):
+            for chunk in fake_stream_translation_text("", input_text, 0):
+                chunks.append(chunk)
+                yield chunk
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=tracked_stream):
+            paragraphs = translation_provider.stream_for_translation("", input_text, 100)
+            first = next(paragraphs)
+            chunks_for_first = len(chunks)
+            rest = list(paragraphs)
+
+        assert first["translation"] == "T:one"
+        assert [para["translation"] for para in rest] == ["T:two"]
+        assert chunks_for_first < len(chunks)
+
+    def test_stream_matches_translate_paragraphs(self, translation_provider):
+        """Streaming yields the same translations, references and remaining texts as translate_paragraphs"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(40)]
+        reference = "".join(f"r{i} " + create_paragraph(30) + "|" for i in range(40)) + " tail"
+
+        with patch.object(translation_provider, "send_for_translation", side_effect=fake_send_for_translation):
+            result = translation_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+            progress = translation_provider.start_translation("he", paragraphs, ["en"], [reference], "ru")
+            events = list(translation_provider.iter_translation(progress, stream=True))
+
+        assert [event["index"] for event in events[:-1]] == list(range(len(paragraphs)))
+        assert [event["translation"] for event in events[:-1]] == result["translated_paragraphs"]
+        assert [event["references"]["English"] for event in events[:-1]] == result["references_by_language"]["English"]
+        assert events[-1] == {"type": "done", "remaining_additional_sources_texts": result["remaining_additional_sources_texts"]}
+
+    def test_openai_stream_truncation(self):
+        """OpenAI streams deltas and raises once the stream reports finish_reason=length"""
+        provider = OpenAIProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="gpt-4o", provider=Provider.OPENAI, temperature=0.2, tpm_limit=30000
+        ))
+
+        def chunk(content, finish_reason=None):
+            return MagicMock(usage=None, choices=[MagicMock(delta=MagicMock(content=content), finish_reason=finish_reason)])
+
+        with patch.object(provider, "client") as client:
+            client.chat.completions.create.return_value = iter([chunk('{"par'), chunk('agraphs"', "length")])
+            stream = provider.stream_translation_text("prompt", "input", 10)
+            assert next(stream) == '{"par'
+            assert next(stream) == 'agraphs"'
+            with pytest.raises(ValueError, match="truncated"):
+                next(stream)
+
+        assert client.chat.completions.create.call_args.kwargs["stream"] is True
+
+    def test_claude_stream(self):
+        """Claude streams text_stream deltas and checks the final message stop_reason"""
+        provider = ClaudeProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="claude-sonnet-4-5-20250929", provider=Provider.CLAUDE, temperature=0.2, tpm_limit=30000
+        ))
+
+        with patch.object(provider, "client") as client:
+            stream = client.messages.stream.return_value.__enter__.return_value
+            stream.text_stream = iter(['{"paragraphs"', ': []}'])
+            stream.get_final_message.return_value = MagicMock(stop_reason="end_turn")
+            assert "".join(provider.stream_translation_text("prompt", "input", 10)) == '{"paragraphs": []}'
+
+            stream.text_stream = iter(['{"par'])
+            stream.get_final_message.return_value = MagicMock(stop_reason="max_tokens")
+            with pytest.raises(ValueError, match="truncated"):
+                list(provider.stream_translation_text("prompt", "input", 10))
+
+
+async def fake_astream_translation_text(task_prompt, input_text, max_output_tokens):
+    """Async version of fake_stream_translation_text"""
+    for chunk in fake_stream_translation_text(task_prompt, input_text, max_output_tokens):
+        await asyncio.sleep(0)
+        yield chunk
+
+
+class TestAsyncTranslation:
+    """Test the async translation path used by the /translate handler"""
+
+    def test_matches_sync_translation(self, translation_provider):
+        """atranslate_paragraphs returns the same result as translate_paragraphs"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(40)]
+        reference = "".join(f"r{i} " + create_paragraph(30) + "|" for i in range(40)) + " tail"
+        # Send both translations, the second would be answered from the response cache
+        translation_provider.options.use_response_cache = False
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+            expected = translation_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        with patch.object(translation_provider, "astream_translation_text", side_effect=fake_astream_translation_text):
+            result = asyncio.run(translation_provider.atranslate_paragraphs("he", paragraphs, ["en"], [reference], "ru"))
+
+        assert result == expected
+
+    def test_concurrent_batches_share_event_loop(self, translation_provider):
+        """Concurrent batches overlap on the event loop, limited by max_concurrent_batches"""
+        translation_provider.options.tpm_limit = 3000
+        translation_provider.options.max_concurrent_batches = 3
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(60)]
+        in_flight = []
+        peak = []
+
+        async def slow_stream(task_prompt, input_text, max_output_tokens):
+            in_flight.append(input_text)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            async for chunk in fake_astream_translation_text(task_prompt, input_text, max_output_tokens):
+                yield chunk
+            in_flight.remove(input_text)
+
+        # TPM budgeting is covered by TestRateLimiter, admit every batch here
+        with patch.object(translation_provider, "astream_translation_text", side_effect=slow_stream), \
+                patch.object(type(translation_provider), "rate_limiter", new_callable=PropertyMock,
+                             return_value=SlidingWindowLimiter("test", tpm_limits(0))):
+            result = asyncio.run(translation_provider.atranslate_paragraphs("he", paragraphs, [], [], "en"))
+
+        logger.info(f"Peak batches in flight: {max(peak)}, {len(peak)} batches")
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert 1 < max(peak) <= 3
+
+    def test_openai_async_stream(self):
+        """OpenAI async streaming reads deltas from AsyncOpenAI"""
+        provider = OpenAIProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="gpt-4o", provider=Provider.OPENAI, temperature=0.2, tpm_limit=30000
+        ))
+
+        async def chunks():
+            for content, finish_reason in [('{"paragraphs"', None), (': []}', "stop")]:
+                yield MagicMock(usage=None, choices=[MagicMock(delta=MagicMock(content=content), finish_reason=finish_reason)])
+
+        async def collect():
+            return [delta async for delta in provider.astream_translation_text("prompt", "input", 10)]
+
+        with patch.object(provider, "get_async_client") as get_client:
+            client = get_client.return_value
+            client.chat.completions.create = MagicMock(side_effect=lambda **kwargs: asyncio.sleep(0, chunks()))
+            assert "".join(asyncio.run(collect())) == '{"paragraphs": []}'
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    """In-memory CheckpointStore recording what was saved"""
+
+    def __init__(self):
+        self.checkpoints = {}
+        self.saves = 0
+
+    def load(self, key):
+        return self.checkpoints.get(key)
+
+    def save(self, key, checkpoint):
+        self.checkpoints[key] = copy.deepcopy(checkpoint)
+        self.saves += 1
+
+    def delete(self, key):
+        self.checkpoints.pop(key, None)
+
+
+class TestCheckpoints:
+    """Test per-batch checkpointing and resuming of sequential translations"""
+
+    @pytest.fixture(params=[
+        (Provider.OPENAI, "gpt-4o"),
+        (Provider.CLAUDE, "claude-sonnet-4-5-20250929"),
+    ])
+    def small_batch_provider(self, request):
+        provider_type, model = request.param
+        options = TranslationServiceOptions(model=model, provider=provider_type, temperature=0.2, tpm_limit=3000)
+        if provider_type == Provider.OPENAI:
+            return OpenAIProvider(api_key="test_key", options=options)
+        return ClaudeProvider(api_key="test_key", options=options)
+
+    @pytest.fixture(autouse=True)
+    def fake_clock(self):
+        """Retries resend batches within the same TPM window, don't wait for it in real time"""
+        with patch.object(rate_limiter, "time", FakeClock()):
+            yield
+
+    @staticmethod
+    def failing_on_call(call_number):
+        calls = []
+
+        def send(task_prompt, input_text, max_output_tokens):
+            calls.append(input_text)
+            if len(calls) == call_number:
+                raise ValueError("Failed to parse JSON response")
+            return fake_send_for_translation(task_prompt, input_text, max_output_tokens)
+        return send, calls
+
+    def test_retry_resumes_from_first_unfinished_batch(self, small_batch_provider):
+        """A retry sends only the batches after the last checkpoint and returns the full result"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        reference = "".join(f"r{i} " + create_paragraph(24) + "|" for i in range(40)) + " tail"
+        store = MemoryCheckpointStore()
+
+        with patch.object(small_batch_provider, "send_for_translation", side_effect=fake_send_for_translation) as send:
+            expected = small_batch_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+        total_batches = send.call_count
+        assert total_batches > 2
+
+        failing_send, calls = self.failing_on_call(3)
+        with patch.object(small_batch_provider, "send_for_translation", side_effect=failing_send):
+            with pytest.raises(ValueError, match="parse"):
+                small_batch_provider.translate_paragraphs(
+                    "he", paragraphs, ["en"], [reference], "ru", checkpoint_store=store
+                )
+        # Batches 1 and 2 were checkpointed before batch 3 failed
+        assert store.saves == 2
+        assert len(store.checkpoints) == 1
+
+        with patch.object(small_batch_provider, "send_for_translation", side_effect=fake_send_for_translation) as send:
+            result = small_batch_provider.translate_paragraphs(
+                "he", paragraphs, ["en"], [reference], "ru", checkpoint_store=store
+            )
+
+        logger.info(f"{total_batches} batches, retry sent {send.call_count}")
+        assert send.call_count == total_batches - 2
+        assert send.call_args_list[0].kwargs["input_text"] == calls[2]
+        assert result["translated_paragraphs"] == expected["translated_paragraphs"]
+        assert result["references_by_language"] == expected["references_by_language"]
+        assert result["remaining_additional_sources_texts"] == expected["remaining_additional_sources_texts"]
+        # Finished translations drop their checkpoint
+        assert store.checkpoints == {}
+
+    def test_other_requests_do_not_resume(self, small_batch_provider):
+        """Checkpoints are keyed by the request, a different request starts from scratch"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        store = MemoryCheckpointStore()
+
+        failing_send, _ = self.failing_on_call(2)
+        with patch.object(small_batch_provider, "send_for_translation", side_effect=failing_send):
+            with pytest.raises(ValueError):
+                small_batch_provider.translate_paragraphs("he", paragraphs, [], [], "en", checkpoint_store=store)
+
+        progress = small_batch_provider.start_translation("he", paragraphs, [], [], "ru", checkpoint_store=store)
+        assert progress.paragraph_offset == 0
+        progress = small_batch_provider.start_translation("he", paragraphs, [], [], "en", checkpoint_store=store)
+        assert progress.paragraph_offset > 0
+
+    def test_stream_replays_restored_paragraphs(self, small_batch_provider):
+        """iter_translation yields the checkpointed paragraphs before translating the rest"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        store = MemoryCheckpointStore()
+
+        failing_send, _ = self.failing_on_call(2)
+        with patch.object(small_batch_provider, "send_for_translation", side_effect=failing_send):
+            with pytest.raises(ValueError):
+                small_batch_provider.translate_paragraphs("he", paragraphs, [], [], "en", checkpoint_store=store)
+
+        with patch.object(small_batch_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+            progress = small_batch_provider.start_translation("he", paragraphs, [], [], "en", checkpoint_store=store)
+            events = list(small_batch_provider.iter_translation(progress, stream=True))
+
+        assert [event["index"] for event in events[:-1]] == list(range(len(paragraphs)))
+        assert [event["translation"] for event in events[:-1]] == [f"T:{p}" for p in paragraphs]
+
+    def test_checkpoint_errors_do_not_fail_translation(self, small_batch_provider):
+        """A broken checkpoint store only costs the ability to resume"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        store = MagicMock(spec=CheckpointStore)
+        store.load.side_effect = Exception("database is down")
+        store.save.side_effect = Exception("database is down")
+
+        with patch.object(small_batch_provider, "send_for_translation", side_effect=fake_send_for_translation):
+            result = small_batch_provider.translate_paragraphs("he", paragraphs, [], [], "en", checkpoint_store=store)
+
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+
+    def test_async_translation_saves_off_the_event_loop(self, small_batch_provider):
+        """The checkpoint store is blocking (database), async translations call it in worker threads"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        store = MemoryCheckpointStore()
+        threads = []
+        save, delete = store.save, store.delete
+        store.save = lambda *args: (threads.append(threading.get_ident()), save(*args))
+        store.delete = lambda *args: (threads.append(threading.get_ident()), delete(*args))
+
+        async def translate():
+            loop_thread = threading.get_ident()
+            result = await small_batch_provider.atranslate_paragraphs(
+                "he", paragraphs, [], [], "en", checkpoint_store=store
+            )
+            return loop_thread, result
+
+        async def send(task_prompt, input_text, max_output_tokens):
+            return fake_send_for_translation(task_prompt, input_text, max_output_tokens)
+
+        async def wait(seconds):
+            # Waits for the TPM window advance the fake clock
+            rate_limiter.time.sleep(seconds)
+
+        with patch.object(small_batch_provider, "asend_for_translation", side_effect=send), \
+                patch.object(rate_limiter.asyncio, "sleep", wait):
+            loop_thread, result = asyncio.run(translate())
+
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert store.saves > 1
+        assert len(threads) == store.saves + 1
+        assert loop_thread not in threads
+        assert store.checkpoints == {}
+
+
+def truncating_send(max_paragraphs):
+    """fake_send_for_translation that truncates responses to batches of more than max_paragraphs"""
+    sizes = []
+
+    def send(task_prompt, input_text, max_output_tokens):
+        size = len(re.findall(r'<p id="', input_text))
+        sizes.append(size)
+        if size > max_paragraphs:
+            raise TruncatedResponseError("Translation response was truncated due to max_tokens limit.")
+        return fake_send_for_translation(task_prompt, input_text, max_output_tokens)
+    return send, sizes
+
+
+class TestTruncationRetry:
+    """Test splitting and retrying batches whose response was truncated"""
+
+    def test_sequential_batches_are_bisected(self, translation_provider):
+        """A truncated batch is retried in halves until each part fits, results stay in order"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(20)]
+        reference = "".join(f"r{i} " + create_paragraph(24) + "|" for i in range(20)) + " tail"
+        send, sizes = truncating_send(3)
+        stats_before = get_truncation_stats()
+
+        with patch.object(translation_provider, "send_for_translation", side_effect=send):
+            result = translation_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        logger.info(f"Batch sizes sent: {sizes}")
+        assert sizes[0] == 20
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert result["references_by_language"]["English"] == [f"r{i} " + create_paragraph(24) + "|" for i in range(20)]
+        assert result["remaining_additional_sources_texts"] == [" tail"]
+        stats = get_truncation_stats()
+        assert stats["truncated_batches"] - stats_before["truncated_batches"] == len([size for size in sizes if size > 3])
+
+    def test_single_paragraph_truncation_fails(self, translation_provider):
+        """A paragraph that is truncated on its own cannot be split further"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(4)]
+        send, sizes = truncating_send(0)
+
+        with patch.object(translation_provider, "send_for_translation", side_effect=send):
+            with pytest.raises(TruncatedResponseError, match="Paragraph 1 alone"):
+                translation_provider.translate_paragraphs("he", paragraphs, [], [], "en")
+
+        assert sizes == [4, 2, 1]
+
+    def test_stream_keeps_completed_paragraphs(self, translation_provider):
+        """Paragraphs streamed before the cut are kept, only the rest is sent again"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(8)]
+        sizes = []
+
+        def stream(task_prompt, input_text, max_output_tokens):
+            texts = re.findall(r'<p id="\d+">(.*?)</p>', input_text, re.DOTALL)
+            sizes.append(len(texts))
+            chunks = fake_stream_translation_text(task_prompt, input_text, max_output_tokens)
+            if len(texts) <= 2:
+                yield from chunks
+                return
+            # Cut the response in the middle of the third paragraph
+            text = "".join(chunks)
+            yield text[:text.index(f"T:{texts[2]}")]
+            raise TruncatedResponseError("Translation response was truncated due to max_tokens limit.")
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=stream):
+            progress = translation_provider.start_translation("he", paragraphs, [], [], "en")
+            events = list(translation_provider.iter_translation(progress, stream=True))
+
+        logger.info(f"Batch sizes sent: {sizes}")
+        assert [event["index"] for event in events[:-1]] == list(range(8))
+        assert [event["translation"] for event in events[:-1]] == [f"T:{p}" for p in paragraphs]
+        # 2 kept from the first response, 2 more from the retried half, then the last 4 in halves
+        assert sizes == [8, 4, 2, 2]
+
+    def test_stream_settles_reservation_when_stopped(self, translation_provider):
+        """A failed request or a consumer that stops reading still settles its reservation"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(4)]
+
+        def failing_send(task_prompt, input_text, max_output_tokens):
+            raise ValueError("Failed to parse JSON response")
+
+        with patch.object(translation_provider, "settle_reservation") as settle:
+            with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+                events = translation_provider.iter_translation(
+                    translation_provider.start_translation("he", paragraphs, [], [], "en"), stream=True
+                )
+                next(events)
+                events.close()
+            assert settle.call_count == 1
+
+            with patch.object(translation_provider, "send_for_translation", side_effect=failing_send):
+                with pytest.raises(ValueError, match="parse"):
+                    list(translation_provider.iter_translation(
+                        translation_provider.start_translation("he", paragraphs, [], [], "en")
+                    ))
+            assert settle.call_count == 2
+
+    def test_concurrent_batches_are_bisected(self):
+        """Concurrent batches split on truncation and are reassembled in paragraph order"""
+        provider = OpenAIProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="gpt-4o", provider=Provider.OPENAI, temperature=0.2, tpm_limit=3000, max_concurrent_batches=4
+        ))
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        reference = "".join(f"r{i} " + create_paragraph(24) + "|" for i in range(40))
+        send, sizes = truncating_send(2)
+
+        with patch.object(provider, "send_for_translation", side_effect=send), \
+                patch.object(rate_limiter, "time", FakeClock()):
+            result = provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        assert max(sizes) > 2
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert result["references_by_language"]["English"] == [f"r{i} " + create_paragraph(24) + "|" for i in range(40)]
+        assert result["remaining_additional_sources_texts"] == [""]
+
+    def test_halves_are_estimated_separately(self, translation_provider):
+        """Each half reserves its own paragraphs' tokens, with or without the planner"""
+        paragraphs = [f"p{i} " + create_paragraph(20 + i) for i in range(9)]
+        planner = BatchPlanner(translation_provider, "prompt", paragraphs, None, "he", "ru")
+        batch = planner.plan(0)
+        error = TruncatedResponseError("Translation response was truncated due to max_tokens limit.")
+
+        halves = translation_provider.split_planned_batch(batch, error, planner)
+
+        assert [len(half["paragraphs"]) for half in halves] == [4, 5]
+        for half in halves:
+            end = half["start"] + len(half["paragraphs"])
+            _, input_tokens, total_tokens, _ = planner.check_fit(half["start"], end, [])
+            assert half["input_tokens"] == input_tokens
+            assert abs(half["estimated_tokens"] - total_tokens) <= 1
+        assert halves == translation_provider.split_planned_batch(batch, error)
+
+    def test_failed_retry_settles_reservation(self, translation_provider):
+        """A half that fails after its response arrived is settled with the reported usage"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(4)]
+        planner = BatchPlanner(translation_provider, "prompt", paragraphs)
+        calls = []
+
+        def send(task_prompt, input_text, max_output_tokens):
+            calls.append(input_text)
+            if len(calls) == 1:
+                raise TruncatedResponseError("Translation response was truncated due to max_tokens limit.")
+            translation_provider.record_usage(10, 20)
+            raise ValueError("Failed to parse JSON response")
+
+        with patch.object(translation_provider, "send_for_translation", side_effect=send), \
+                patch.object(rate_limiter, "time", FakeClock()):
+            used = translation_provider.rate_limiter.used["tpm"]
+            with pytest.raises(ValueError, match="parse"):
+                translation_provider.translate_batch("he", planner.plan(0), [], "ru", "prompt", planner)
+            used = translation_provider.rate_limiter.used["tpm"] - used
+
+        assert len(calls) == 2
+        # The truncated request keeps its estimate, the failed half counts what it used
+        assert used == planner.plan(0)["estimated_tokens"] + 30
+
+    def test_planner_respects_max_paragraphs(self, translation_provider):
+        """Capped plans never exceed max_paragraphs"""
+        paragraphs = create_paragraphs(10, words_per_paragraph=5)
+        planner = BatchPlanner(translation_provider, "prompt", paragraphs)
+
+        assert len(planner.plan(0)["paragraphs"]) == 10
+        assert len(planner.plan(0, max_paragraphs=3)["paragraphs"]) == 3
+        assert len(planner.plan(8, max_paragraphs=3)["paragraphs"]) == 2
+
+
+class TestOutputCalibration:
+    """Test output token estimates calibrated from reported usage"""
+
+    def test_percentile_after_min_samples(self):
+        """The default is used until min_samples, then the configured percentile of the window"""
+        calibrator = OutputCalibrator(window=10, min_samples=3, percentile=90)
+        key = ("gpt-4o", "he", "en", 0)
+
+        calibrator.record(*key, paragraph_tokens=100, output_tokens=200)
+        calibrator.record(*key, paragraph_tokens=100, output_tokens=210)
+        assert calibrator.multiplier(*key, default=2.5) == 2.5
+
+        for output_tokens in [220, 230, 240, 250, 260, 270, 280, 290, 300]:
+            calibrator.record(*key, paragraph_tokens=100, output_tokens=output_tokens)
+
+        # Window keeps the last 10 ratios: 2.1 .. 3.0, 90th percentile by nearest rank
+        assert calibrator.multiplier(*key, default=2.5) == pytest.approx(2.9)
+        assert calibrator.multiplier("gpt-4o", "he", "ru", 0, default=2.5) == 2.5
+        assert calibrator.stats()[0]["samples"] == 10
+
+    def test_translation_records_usage(self, translation_provider):
+        """Complete responses record output tokens per paragraph token for the request's key"""
+        calibrator = OutputCalibrator(window=10, min_samples=1, percentile=100)
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(5)]
+        paragraph_tokens = sum(count_tokens(translation_provider.encoding, p) for p in paragraphs)
+
+        def send(task_prompt, input_text, max_output_tokens):
+            translation_provider.record_usage(1000, paragraph_tokens * 3)
+            return fake_send_for_translation(task_prompt, input_text, max_output_tokens)
+
+        with patch.object(base_provider, "output_calibrator", calibrator), \
+                patch.object(translation_provider, "send_for_translation", side_effect=send):
+            translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+            assert translation_provider.get_output_multiplier(0, "he", "ru") == pytest.approx(3.0)
+
+        assert [(item["original_language"], item["translate_language"]) for item in calibrator.stats()] == [("he", "ru")]
+        assert translation_provider.token_usage["output_tokens"] == paragraph_tokens * 3
+
+    def test_response_options_are_calibrated_separately(self, translation_provider):
+        """Tagged, lean and compact responses do not share the ratios of default JSON ones"""
+        calibrator = OutputCalibrator(window=10, min_samples=1, percentile=100)
+        model = translation_provider.options.model
+
+        with patch.object(base_provider, "output_calibrator", calibrator):
+            calibrator.record(model, "he", "en", 0, paragraph_tokens=100, output_tokens=300)
+            assert translation_provider.get_output_multiplier(0, "he", "en") == pytest.approx(3.0)
+            for option, value in (("output_format", OutputFormat.TAGGED), ("lean_response", True), ("compact_input", True)):
+                with patch.object(translation_provider, "options", translation_provider.options.model_copy(update={option: value})):
+                    assert translation_provider.get_output_multiplier(0, "he", "en") != pytest.approx(3.0)
+
+        assert calibrator.stats()[0]["output_format"] == "json"
+
+    def test_calibrated_ratio_packs_batches(self, translation_provider):
+        """A lower observed ratio than the default lets more paragraphs into a batch"""
+        calibrator = OutputCalibrator(window=10, min_samples=1, percentile=90)
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(200)]
+
+        with patch.object(base_provider, "output_calibrator", calibrator):
+            default_batch = BatchPlanner(translation_provider, "prompt", paragraphs, None, "he", "en").plan(0)
+            calibrator.record(translation_provider.options.model, "he", "en", 0, paragraph_tokens=100, output_tokens=150)
+            calibrated_batch = BatchPlanner(translation_provider, "prompt", paragraphs, None, "he", "en").plan(0)
+
+        assert len(calibrated_batch["paragraphs"]) > len(default_batch["paragraphs"])
+
+
+class TestPromptCaching:
+    """Test prompt cache markup, cached token accounting and cache estimates"""
+
+    @pytest.fixture
+    def openai_provider(self):
+        return OpenAIProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="gpt-4o", provider=Provider.OPENAI, temperature=0.2, tpm_limit=30000
+        ))
+
+    @pytest.fixture
+    def claude_provider(self):
+        return ClaudeProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="claude-sonnet-4-5-20250929", provider=Provider.CLAUDE, temperature=0.2,
+            tpm_limit=0, itpm_limit=30000, otpm_limit=8000,
+        ))
+
+    def test_claude_marks_system_prompt(self, claude_provider):
+        request = claude_provider.stream_request("Long task prompt", "input", 100)
+
+        assert request["system"] == [
+            {"type": "text", "text": "Long task prompt", "cache_control": {"type": "ephemeral"}}
+        ]
+        assert request["messages"] == [{"role": "user", "content": "input"}]
+
+    def test_openai_prompt_is_a_shared_prefix(self, openai_provider):
+        """Batches start with the same system message and cache key, only the user message differs"""
+        first = openai_provider.stream_request("Long task prompt", "batch 1", 100)
+        second = openai_provider.stream_request("Long task prompt", "batch 2", 100)
+        other = openai_provider.stream_request("Other prompt", "batch 1", 100)
+
+        assert first["messages"][0] == second["messages"][0] == {"role": "system", "content": "Long task prompt"}
+        assert first["extra_body"] == second["extra_body"]
+        assert first["extra_body"]["prompt_cache_key"] != other["extra_body"]["prompt_cache_key"]
+
+    def test_openai_records_cached_tokens(self, openai_provider):
+        usage = MagicMock(prompt_tokens=5000, completion_tokens=300, total_tokens=5300)
+        usage.prompt_tokens_details.cached_tokens = 4096
+
+        openai_provider.check_stream_end("stop", usage, 1000)
+        openai_provider.check_stream_end("stop", MagicMock(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None), 1000)
+
+        assert openai_provider.token_usage == {
+            "input_tokens": 5100, "output_tokens": 310, "cached_input_tokens": 4096, "cache_write_tokens": 0,
+        }
+
+    def test_claude_records_cache_reads_and_writes(self, claude_provider):
+        """Claude reports cached tokens apart from input_tokens, token_usage counts them as input"""
+        for cache_read, cache_write in [(0, 3000), (3000, 0)]:
+            response = MagicMock(stop_reason="end_turn")
+            response.usage = MagicMock(
+                input_tokens=500, output_tokens=200,
+                cache_read_input_tokens=cache_read, cache_creation_input_tokens=cache_write,
+            )
+            claude_provider.check_stream_end(response, 1000)
+
+        assert claude_provider.token_usage == {
+            "input_tokens": 7000, "output_tokens": 400, "cached_input_tokens": 3000, "cache_write_tokens": 3000,
+        }
+        assert claude_provider.get_result_properties()["token_usage"] == claude_provider.token_usage
+        assert "token_usage" not in claude_provider.get_result_properties(with_usage=False)
+
+    def test_claude_cache_reads_free_rate_limit(self, claude_provider):
+        """Tokens read from Claude's prompt cache are released from the ITPM window"""
+        reservation = claude_provider.rate_limiter.reserve(3500, 200)
+        claude_provider.record_usage(3500, 150, cached_input_tokens=3000)
+        claude_provider.settle_reservation(reservation)
+
+        assert claude_provider.rate_limiter.used["itpm"] == 500
+        assert claude_provider.rate_limiter.used["otpm"] == 150
+
+    def test_estimate_prompt_cache_tokens(self, openai_provider, claude_provider):
+        # Short prompts are not cached, nor are single batches
+        assert openai_provider.estimate_prompt_cache_tokens(500, 10) == (0, 0)
+        assert openai_provider.estimate_prompt_cache_tokens(2000, 1) == (0, 0)
+
+        assert openai_provider.estimate_prompt_cache_tokens(2000, 5) == (8000, 0)
+        assert claude_provider.estimate_prompt_cache_tokens(2000, 5) == (8000, 2000)
+
+    def test_estimate_num_batches(self, translation_provider):
+        paragraphs = create_paragraphs(300, words_per_paragraph=40)
+        planner = BatchPlanner(translation_provider, "Translate:", paragraphs, None)
+        start = 0
+        planned = 0
+        while start < len(paragraphs):
+            start += len(planner.plan(start)["paragraphs"])
+            planned += 1
+
+        assert planned > 1
+        assert translation_provider.estimate_num_batches("Translate:", paragraphs) == planned
+        assert translation_provider.estimate_num_batches("Translate: " * 40000, paragraphs) == 0
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "-s"])  # -s to show print/logging output
+
+
+class BatchAPIStandIn:
+    """
+    Local stand-in for the OpenAI Batch API and the Anthropic Message Batches API.
+
+    Batches are processed when created, but report being in progress for the first
+    pending_polls status checks. Every request is answered by respond(custom_id,
+    system, user), which returns (response text, finish reason) with finish reason
+    "stop", "length" (truncated) or None (the request failed).
+    """
+
+    def __init__(self, pending_polls: int = 1):
+        self.pending_polls = pending_polls
+        self.final_status = "completed"  # Status of OpenAI batches once they are no longer in progress
+        self.respond = self.echo
+        self.requests: list[tuple[str, dict]] = []  # (custom_id, request body) in order received
+        self.files: dict[str, str] = {}
+        self.batches: dict[str, dict] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @staticmethod
+    def echo(custom_id, system, user):
+        return json.dumps({"paragraphs": fake_send_for_translation(system, user, 0)}), "stop"
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug("Batch API stand-in: " + format, *args)
+
+            def send(self, payload, content_type="application/json"):
+                body = payload.encode("utf-8") if isinstance(payload, str) else json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.path == "/v1/files":
+                    self.send(stand_in.upload_file(body, self.headers["Content-Type"]))
+                elif self.path == "/v1/batches":
+                    self.send(stand_in.create_openai_batch(json.loads(body)))
+                elif self.path == "/v1/messages/batches":
+                    self.send(stand_in.create_claude_batch(json.loads(body)))
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                parts = self.path.split("/")
+                if self.path.startswith("/v1/files/") and parts[-1] == "content":
+                    self.send(stand_in.files[parts[3]], "application/octet-stream")
+                elif self.path.startswith("/v1/batches/"):
+                    self.send(stand_in.get_batch(parts[3]))
+                elif self.path.startswith("/v1/messages/batches/") and parts[-1] == "results":
+                    self.send(stand_in.batches[parts[4]]["results"], "application/x-jsonl")
+                elif self.path.startswith("/v1/messages/batches/"):
+                    self.send(stand_in.get_batch(parts[4]))
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def upload_file(self, body: bytes, content_type: str) -> dict:
+        boundary = content_type.split("boundary=")[1].encode()
+        for part in body.split(b"--" + boundary):
+            if b'name="file"' in part:
+                content = part.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n", 1)[0]
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = content.decode("utf-8")
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": 0,
+                "filename": "translation_batches.jsonl", "purpose": "batch", "status": "processed"}
+
+    def create_openai_batch(self, params: dict) -> dict:
+        output = []
+        for line in self.files[params["input_file_id"]].splitlines():
+            request = json.loads(line)
+            body = request["body"]
+            self.requests.append((request["custom_id"], body))
+            text, finish_reason = self.respond(
+                request["custom_id"], body["messages"][0]["content"], body["messages"][1]["content"]
+            )
+            if finish_reason is None:
+                response = {"status_code": 500, "request_id": "req", "body": {"error": {"message": "Server error"}}}
+            else:
+                response = {"status_code": 200, "request_id": "req", "body": {
+                    "id": "chatcmpl", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": finish_reason,
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150,
+                              "prompt_tokens_details": {"cached_tokens": 10}},
+                }}
+            output.append(json.dumps({"id": "batch_req", "custom_id": request["custom_id"], "response": response, "error": None}))
+
+        batch_id = f"batch_{len(self.batches)}"
+        output_file_id = f"file-{len(self.files)}"
+        self.files[output_file_id] = "\n".join(output) + "\n"
+        self.batches[batch_id] = {"polls": self.pending_polls, "object": {
+            "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions",
+            "input_file_id": params["input_file_id"], "completion_window": "24h", "created_at": 0,
+            "status": "in_progress", "output_file_id": None, "error_file_id": None,
+            "request_counts": {"total": len(output), "completed": 0, "failed": 0},
+        }, "output_file_id": output_file_id}
+        return self.batches[batch_id]["object"]
+
+    def create_claude_batch(self, params: dict) -> dict:
+        results = []
+        for request in params["requests"]:
+            message_params = request["params"]
+            self.requests.append((request["custom_id"], message_params))
+            text, finish_reason = self.respond(
+                request["custom_id"], message_params["system"][0]["text"], message_params["messages"][0]["content"]
+            )
+            if finish_reason is None:
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": "Server error"}}}
+            else:
+                result = {"type": "succeeded", "message": {
+                    "id": "msg", "type": "message", "role": "assistant", "model": message_params["model"],
+                    "content": [{"type": "text", "text": text}],
+                    "stop_reason": "max_tokens" if finish_reason == "length" else "end_turn", "stop_sequence": None,
+                    "usage": {"input_tokens": 90, "output_tokens": 50,
+                              "cache_read_input_tokens": 10, "cache_creation_input_tokens": 0},
+                }}
+            results.append(json.dumps({"custom_id": request["custom_id"], "result": result}))
+
+        batch_id = f"msgbatch_{len(self.batches)}"
+        self.batches[batch_id] = {"polls": self.pending_polls, "results": "\n".join(results) + "\n", "object": {
+            "id": batch_id, "type": "message_batch", "processing_status": "in_progress",
+            "request_counts": {"processing": len(results), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": "2026-01-01T00:00:00Z", "expires_at": "2026-01-02T00:00:00Z", "ended_at": None,
+            "archived_at": None, "cancel_initiated_at": None, "results_url": None,
+        }}
+        return self.batches[batch_id]["object"]
+
+    def get_batch(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        if batch["polls"] > 0:
+            batch["polls"] -= 1
+            return batch["object"]
+        if batch_id.startswith("msgbatch_"):
+            return dict(batch["object"], processing_status="ended", ended_at="2026-01-01T01:00:00Z",
+                        results_url=f"{self.url}/v1/messages/batches/{batch_id}/results")
+        return dict(batch["object"], status=self.final_status,
+                    output_file_id=batch["output_file_id"] if self.final_status != "failed" else None)
+
+
+class TestBulkTranslation:
+    """Test bulk translation through the batch APIs, against a local stand-in server"""
+
+    @pytest.fixture
+    def stand_in(self):
+        with BatchAPIStandIn() as stand_in:
+            yield stand_in
+
+    @pytest.fixture(params=[
+        (Provider.OPENAI, "gpt-4o"),
+        (Provider.CLAUDE, "claude-sonnet-4-5-20250929"),
+    ])
+    def bulk_provider(self, request, stand_in):
+        provider_type, model = request.param
+        options = TranslationServiceOptions(model=model, provider=provider_type, temperature=0.2, tpm_limit=3000)
+        if provider_type == Provider.OPENAI:
+            provider = OpenAIProvider(api_key="test_key", options=options)
+            provider.client = OpenAI(api_key="test_key", base_url=f"{stand_in.url}/v1", max_retries=0)
+        else:
+            provider = ClaudeProvider(api_key="test_key", options=options)
+            provider.client = Anthropic(api_key="test_key", base_url=stand_in.url, max_retries=0)
+        return provider
+
+    @pytest.fixture(autouse=True)
+    def fake_clock(self):
+        """Batches sent interactively share a small TPM window, don't wait for it in real time"""
+        with patch.object(rate_limiter, "time", FakeClock()):
+            yield
+
+    def test_batches_submitted_and_collected(self, bulk_provider, stand_in):
+        """All batches go in one provider batch, results are assembled once it ended"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(60)]
+
+        bulk = bulk_provider.submit_bulk_translation("he", paragraphs, [], [], "en")
+        # Kept in the job row between polls
+        bulk = json.loads(json.dumps(bulk))
+
+        logger.info(f"Submitted {len(bulk['batches'])} batches as {bulk['batch_id']}")
+        assert bulk["batch_id"]
+        assert len(bulk["batches"]) > 1
+        assert [custom_id for custom_id, _ in stand_in.requests] == [str(i) for i in range(len(bulk["batches"]))]
+        for (_, body), batch in zip(stand_in.requests, bulk["batches"]):
+            assert body["max_tokens"] == batch["max_output_tokens"]
+            assert "stream" not in body
+        # Batch API requests don't use the interactive rate limit window
+        assert bulk_provider.rate_limiter.stats()["reservations"] == 0
+
+        assert bulk_provider.collect_bulk_translation(bulk, "he", [], [], "en") is None
+        result = bulk_provider.collect_bulk_translation(bulk, "he", [], [], "en")
+
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        usage = result["properties"]["token_usage"]
+        assert usage["input_tokens"] == 100 * len(bulk["batches"])
+        assert usage["output_tokens"] == 50 * len(bulk["batches"])
+        assert usage["cached_input_tokens"] == 10 * len(bulk["batches"])
+
+    def test_references_learned_from_interactive_first_batch(self, bulk_provider, stand_in):
+        """With references the first batch is sent interactively, the rest in bulk"""
+        paragraphs = [f"p{i} " + create_paragraph(20) for i in range(40)]
+        reference = "".join(f"r{i} " + create_paragraph(24) + "|" for i in range(40))
+
+        stand_in.pending_polls = 0
+        with patch.object(bulk_provider, "send_for_translation", side_effect=fake_send_for_translation) as send:
+            bulk = bulk_provider.submit_bulk_translation("he", paragraphs, ["en"], [reference], "ru")
+        result = bulk_provider.collect_bulk_translation(json.loads(json.dumps(bulk)), "he", ["en"], [reference], "ru")
+
+        assert send.call_count == 1
+        assert len(stand_in.requests) == len(bulk["batches"]) > 1
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert result["references_by_language"]["English"] == [f"r{i} " + create_paragraph(24) + "|" for i in range(40)]
+        assert result["remaining_additional_sources_texts"] == [""]
+
+    def test_failed_and_truncated_requests_sent_again(self, bulk_provider, stand_in):
+        """A failed request is resent interactively, a truncated one as two halves"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(60)]
+
+        def respond(custom_id, system, user):
+            if custom_id == "0":
+                return None, None
+            if custom_id == "1":
+                return '{"paragraphs": [{"id": 1, "translation": "cut', "length"
+            return BatchAPIStandIn.echo(custom_id, system, user)
+
+        stand_in.respond = respond
+        stand_in.pending_polls = 0
+        truncated_before = get_truncation_stats()["truncated_batches"]
+
+        bulk = bulk_provider.submit_bulk_translation("he", paragraphs, [], [], "en")
+        sent = MagicMock()
+        with patch.object(bulk_provider, "send_for_translation", side_effect=fake_send_for_translation) as send:
+            result = bulk_provider.collect_bulk_translation(bulk, "he", [], [], "en", on_batch_sent=sent)
+
+        assert send.call_count == 3
+        # Once per resent batch, a job keeps its claim while they are sent
+        assert sent.call_count == 2
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert get_truncation_stats()["truncated_batches"] == truncated_before + 1
+
+    def test_failed_provider_batch(self, bulk_provider, stand_in):
+        """A batch the provider rejected as a whole fails the translation"""
+        if bulk_provider.options.provider != Provider.OPENAI:
+            pytest.skip("Only OpenAI batches fail as a whole")
+        stand_in.final_status = "failed"
+        stand_in.pending_polls = 0
+
+        bulk = bulk_provider.submit_bulk_translation("he", ["p0 one", "p1 two"], [], [], "en")
+        with pytest.raises(ValueError, match="failed"):
+            bulk_provider.collect_bulk_translation(bulk, "he", [], [], "en")
+
+
+class TestResponseCache:
+    """Test answering identical requests from the on-disk response cache"""
+
+    def test_identical_translation_is_not_sent_again(self, translation_provider, response_cache):
+        """Re-running the same translation reads every batch from the cache"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(40)]
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text) as stream:
+            first = translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+            sent = stream.call_count
+            second = translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+
+        logger.info("Response cache after two translations: %s", response_cache.stats())
+        assert sent >= 1
+        assert stream.call_count == sent
+        assert second["translated_paragraphs"] == first["translated_paragraphs"]
+        assert second["properties"]["cached_responses"] == sent
+        assert response_cache.stats()["hits"] == sent
+
+    def test_async_translation_reads_cache(self, translation_provider):
+        """Responses cached by a sync translation answer the async one"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(10)]
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+            expected = translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+        with patch.object(translation_provider, "astream_translation_text", side_effect=fake_astream_translation_text) as stream:
+            result = asyncio.run(translation_provider.atranslate_paragraphs("he", paragraphs, [], [], "ru"))
+
+        assert stream.call_count == 0
+        assert result["translated_paragraphs"] == expected["translated_paragraphs"]
+
+    def test_bypass(self, translation_provider):
+        """With use_response_cache off every request is sent"""
+        translation_provider.options.use_response_cache = False
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text) as stream:
+            translation_provider.send_for_translation("Translate:", '<p id="1">one</p>', 1000)
+            translation_provider.send_for_translation("Translate:", '<p id="1">one</p>', 1000)
+
+        assert stream.call_count == 2
+
+    def test_key_covers_prompt_and_options(self, translation_provider):
+        """Another task prompt or temperature is a different request"""
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text) as stream:
+            translation_provider.send_for_translation("Translate:", '<p id="1">one</p>', 1000)
+            translation_provider.send_for_translation("Translate!", '<p id="1">one</p>', 1000)
+            translation_provider.options.temperature = 0.7
+            translation_provider.send_for_translation("Translate:", '<p id="1">one</p>', 1000)
+            translation_provider.send_for_translation("Translate:", '<p id="1">one</p>', 5)
+
+        assert stream.call_count == 3
+
+    def test_truncated_response_is_not_cached(self, translation_provider, response_cache):
+        """Only complete responses are stored"""
+        def truncated(task_prompt, input_text, max_output_tokens):
+            yield '{"paragraphs": [{"id": 1, "translation": "cut'
+            raise TruncatedResponseError("Translation response was truncated due to max_tokens limit.")
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=truncated) as stream:
+            for _ in range(2):
+                with pytest.raises(TruncatedResponseError):
+                    translation_provider.send_for_translation("Translate:", '<p id="1">one</p>', 5)
+
+        assert stream.call_count == 2
+        assert response_cache.stats()["entries"] == 0
+
+    @pytest.mark.parametrize("text", [
+        '{"paragraphs": [{"id": 1, "translation": "T:one"}, {"id": 2, "transl',
+        '{"paragraphs": [{"id": 1, "translation": "T:one"}]}',
+    ])
+    def test_partial_response_is_not_cached(self, translation_provider, response_cache, text):
+        """A response that stopped early without truncation, or skipped paragraphs, is not stored"""
+        input_text = '<p id="1">one</p>\n<p id="2">two</p>'
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=lambda *args: iter([text])) as stream:
+            for _ in range(2):
+                with pytest.raises(ValueError):
+                    translation_provider.send_for_translation("Translate:", input_text, 1000)
+
+        assert stream.call_count == 2
+        assert response_cache.stats()["entries"] == 0
+
+    def test_invalid_cached_response_is_removed(self, translation_provider, response_cache):
+        """A cached response that does not answer its request is dropped, the retry is sent"""
+        input_text = '<p id="1">one</p>\n<p id="2">two</p>'
+        cache_key = translation_provider.get_response_cache_key(
+            translation_provider.get_request_task_prompt("Translate:"), input_text
+        )
+        response_cache.put(cache_key, '{"paragraphs": [{"id": 1, "translation": "T:one"}]}')
+
+        with pytest.raises(ValueError, match="Response has 1 paragraphs"):
+            translation_provider.send_for_translation("Translate:", input_text, 1000)
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text) as stream:
+            paragraphs = translation_provider.send_for_translation("Translate:", input_text, 1000)
+
+        assert stream.call_count == 1
+        assert [para["translation"] for para in paragraphs] == ["T:one", "T:two"]
+
+    def test_cached_response_releases_reservation(self, translation_provider):
+        """A batch answered from the cache uses nothing of the rate limit window"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(5)]
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=fake_stream_translation_text):
+            translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+            used = dict(translation_provider.rate_limiter.used)
+            translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+
+        assert translation_provider.rate_limiter.used["tpm"] == used["tpm"]
+
+    def test_size_eviction(self, tmp_path):
+        """The least recently used responses are removed once the cache exceeds its size"""
+        cache = ResponseCache(str(tmp_path), max_bytes=25)
+        cache.put("aa1", "x" * 10)
+        cache.put("bb2", "y" * 10)
+        assert cache.get("aa1") == "x" * 10
+        cache.put("cc3", "z" * 10)
+
+        assert cache.get("bb2") is None
+        assert cache.get("aa1") == "x" * 10
+        assert cache.get("cc3") == "z" * 10
+        stats = cache.stats()
+        assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 20, 1)
+
+    def test_survives_restart(self, tmp_path):
+        """Responses stored by an earlier process are found and counted"""
+        ResponseCache(str(tmp_path), max_bytes=1000).put("aa1", "stored")
+
+        cache = ResponseCache(str(tmp_path), max_bytes=1000)
+        assert cache.get("aa1") == "stored"
+        assert cache.stats()["bytes"] == len("stored")
+
+
+class TestParagraphDeduplication:
+    """Test translating repeated paragraphs of a request once"""
+
+    @pytest.fixture
+    def sent_paragraphs(self, translation_provider):
+        """Record the paragraphs of every request, sync and async"""
+        sent = []
+
+        def stream(task_prompt, input_text, max_output_tokens):
+            sent.extend(re.findall(r'<p id="\d+">(.*?)</p>', input_text, re.DOTALL))
+            yield from fake_stream_translation_text(task_prompt, input_text, max_output_tokens)
+
+        async def astream(task_prompt, input_text, max_output_tokens):
+            for chunk in stream(task_prompt, input_text, max_output_tokens):
+                yield chunk
+
+        # Every request is sent, not answered from the response cache
+        translation_provider.options.use_response_cache = False
+        with patch.object(translation_provider, "stream_translation_text", side_effect=stream), \
+                patch.object(translation_provider, "astream_translation_text", side_effect=astream):
+            yield sent
+
+    @staticmethod
+    def repetitive_paragraphs():
+        heading = "p0 " + create_paragraph(5)
+        refrain = "p1 " + create_paragraph(30)
+        paragraphs = []
+        for i in range(2, 12):
+            paragraphs += [heading, f"p{i} " + create_paragraph(30), refrain]
+        return paragraphs
+
+    @pytest.mark.parametrize("max_concurrent_batches", [1, 3])
+    def test_duplicates_are_sent_once(self, translation_provider, sent_paragraphs, max_concurrent_batches):
+        """Each distinct paragraph is sent once and its translation fills every position"""
+        translation_provider.options.max_concurrent_batches = max_concurrent_batches
+        paragraphs = self.repetitive_paragraphs()
+
+        result = translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru")
+
+        logger.info(f"Sent {len(sent_paragraphs)} of {len(paragraphs)} paragraphs")
+        assert sorted(sent_paragraphs) == sorted(set(paragraphs))
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert result["properties"]["duplicate_paragraphs"] == len(paragraphs) - len(set(paragraphs))
+
+    def test_async_duplicates_are_sent_once(self, translation_provider, sent_paragraphs):
+        """atranslate_paragraphs deduplicates the same way"""
+        paragraphs = self.repetitive_paragraphs()
+
+        result = asyncio.run(translation_provider.atranslate_paragraphs("he", paragraphs, [], [], "ru"))
+
+        assert len(sent_paragraphs) == len(set(paragraphs))
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+
+    def test_references_keep_every_occurrence(self, translation_provider, sent_paragraphs):
+        """With reference sources each occurrence is sent with its own reference"""
+        paragraphs = ["p0 same", "p0 same", "p1 other"]
+        reference = "r0 first|r0 second|r1 third| tail"
+
+        result = translation_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        assert sent_paragraphs == paragraphs
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert "duplicate_paragraphs" not in result["properties"]
+
+    def test_missing_deduplicated_translation(self, translation_provider):
+        """Fewer translations than distinct paragraphs is a response error, not an IndexError"""
+        _, positions = dedupe_paragraphs(["a", "b", "a", "c"])
+        result = TranslationResult(
+            translated_paragraphs=["T:a", "T:b"],
+            references_by_language={},
+            remaining_additional_sources_texts=[],
+            properties={},
+        )
+
+        with pytest.raises(ValueError, match="Response has 2 paragraphs, the request has 3"):
+            translation_provider.expand_duplicate_paragraphs(result, positions)
+
+    def test_dedupe_paragraphs(self):
+        """Distinct paragraphs keep the order of their first occurrence"""
+        assert dedupe_paragraphs(["a", "b", "a", "c", "b"]) == (["a", "b", "c"], [0, 1, 0, 2, 1])
+
+
+class TestReferenceAlignment:
+    """Test length-based alignment of reference texts and the batches cut from it"""
+
+    @staticmethod
+    def aligned_texts(num: int) -> tuple[list[str], list[str]]:
+        """Paragraphs of varying length, and a reference line about 1.3 times as long for each"""
+        words = [10 + (i * 7) % 40 for i in range(num)]
+        paragraphs = [f"p{i} " + create_paragraph(count) for i, count in enumerate(words)]
+        lines = [f"r{i} " + create_paragraph(int(count * 1.3)) + "|" for i, count in enumerate(words)]
+        return paragraphs, lines
+
+    def test_align_reference(self):
+        """Each paragraph gets the span of its reference line, despite a title and a split line"""
+        paragraphs, lines = self.aligned_texts(30)
+        split = lines[10]
+        lines = ["Title"] + lines[:10] + [split[:len(split) // 2], split[len(split) // 2:]] + lines[11:]
+        text = "\n".join(lines + ["tail " + create_paragraph(40)] * 20)
+
+        spans = align_reference(paragraphs, text)
+
+        references = [text[start:end].strip() for start, end in spans]
+        logger.info(f"Aligned references: {[ref[:8] for ref in references]}")
+        assert references[10] == split[:len(split) // 2] + "\n" + split[len(split) // 2:]
+        for i, reference in enumerate(references):
+            assert reference.split("\n")[-1].startswith(f"r{i} ") or i == 10
+        assert spans[-1][1] <= text.index("tail")
+
+    def test_missing_reference_stays_within_neighbors(self):
+        """Around a paragraph without reference, every reference is within one paragraph of its own"""
+        paragraphs, lines = self.aligned_texts(40)
+        text = "\n".join(lines[:20] + lines[21:])
+
+        spans = align_reference(paragraphs, text)
+
+        for i in range(len(paragraphs)):
+            if i != 20:
+                neighbors = text[spans[max(i - 1, 0)][0]:spans[min(i + 1, len(spans) - 1)][1]]
+                assert f"r{i} " in neighbors
+
+    def test_unstructured_reference_is_not_aligned(self):
+        """A reference without lines or sentences keeps the proportional windows"""
+        paragraphs, lines = self.aligned_texts(10)
+        assert align_reference(paragraphs, "".join(lines)) is None
+
+    @pytest.mark.parametrize("max_concurrent_batches", [1, 3])
+    def test_batches_carry_aligned_references(self, translation_provider, max_concurrent_batches):
+        """Every batch's slice holds the references of its paragraphs, without drift"""
+        translation_provider.options.tpm_limit = 3000
+        translation_provider.options.max_concurrent_batches = max_concurrent_batches
+        paragraphs, lines = self.aligned_texts(40)
+        tail = "tail " + create_paragraph(40)
+        reference = "\n".join(lines + [tail])
+        inputs = []
+
+        def send(task_prompt, input_text, max_output_tokens):
+            inputs.append(input_text)
+            return fake_send_for_translation(task_prompt, input_text, max_output_tokens)
+
+        with patch.object(translation_provider, "send_for_translation", side_effect=send), \
+                patch.object(rate_limiter, "time", FakeClock()):
+            result = translation_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        logger.info(f"Sent {len(inputs)} batches")
+        assert len(inputs) > 2
+        for input_text in inputs:
+            numbers = [int(n) for n in re.findall(r'<p id="\d+">p(\d+) ', input_text)]
+            source = re.search(r'<text language="[^"]+">(.*?)</text>', input_text, re.DOTALL).group(1)
+            referenced = [int(n) for n in re.findall(r"(?:^|\n)r(\d+) ", source)]
+            assert set(numbers) <= set(referenced)
+            # At most one paragraph's reference on each side
+            assert min(referenced) >= numbers[0] - 1
+            assert max(referenced) <= numbers[-1] + 1
+        assert result["translated_paragraphs"] == [f"T:{p}" for p in paragraphs]
+        assert result["references_by_language"]["English"] == lines
+        assert result["remaining_additional_sources_texts"][0].strip() == tail
+
+    def test_alignment_can_be_disabled(self, translation_provider):
+        """With align_references off batches get windows from the consumed offset"""
+        translation_provider.options.align_references = False
+        paragraphs, lines = self.aligned_texts(10)
+
+        reference_spans = translation_provider.align_reference_texts(paragraphs, ["\n".join(lines)])
+        planner = BatchPlanner(translation_provider, "Translate:", paragraphs, ["\n".join(lines)], reference_spans=reference_spans)
+
+        assert reference_spans == [None]
+        assert not planner.aligned
+        batch = planner.plan(0, [5])
+        assert batch["reference_starts"] == [5]
+
+    @pytest.mark.parametrize("max_concurrent_batches", [1, 3])
+    def test_references_are_aligned_once_per_translation(self, translation_provider, max_concurrent_batches):
+        """Alignment takes seconds for a book: once per translation, never for estimates"""
+        translation_provider.options.tpm_limit = 3000
+        translation_provider.options.max_concurrent_batches = max_concurrent_batches
+        paragraphs, lines = self.aligned_texts(40)
+        reference = "\n".join(lines)
+
+        with patch("services.base_provider.align_reference", side_effect=align_reference) as align, \
+                patch.object(translation_provider, "send_for_translation", side_effect=fake_send_for_translation), \
+                patch.object(rate_limiter, "time", FakeClock()):
+            translation_provider.estimate_num_batches("Translate:", paragraphs, [reference], "he", "ru")
+            translation_provider.reduce_paragraphs_to_fit("Translate:", paragraphs, [reference])
+            assert align.call_count == 0
+            translation_provider.translate_paragraphs("he", paragraphs, ["en"], [reference], "ru")
+
+        assert align.call_count == 1
+
+
+class TestStructuredOutput:
+    """The response schema is enforced by OpenAI structured outputs and Claude tool use"""
+
+    INPUT = format_input("he", ["שלום"], ["en"], ["Hello"], "ru")
+
+    def options(self, provider, model):
+        return TranslationServiceOptions(
+            model=model, provider=provider, temperature=0.2, tpm_limit=30000,
+            structured_output=True, use_response_cache=False,
+        )
+
+    def test_response_schema(self):
+        schema = get_response_schema(get_input_reference_languages(self.INPUT))
+        references = schema["properties"]["paragraphs"]["items"]["properties"]["references"]
+        assert references["required"] == ["English"]
+        assert references["additionalProperties"] is False
+
+    def test_openai_json_schema(self):
+        provider = OpenAIProvider(api_key="test_key", options=self.options(Provider.OPENAI, "gpt-4o"))
+
+        response_format = provider.stream_request("prompt", self.INPUT, 100)["response_format"]
+
+        assert response_format["type"] == "json_schema"
+        assert response_format["json_schema"]["strict"] is True
+        assert response_format["json_schema"]["schema"] == get_response_schema(["English"])
+
+    def test_openai_unsupported_model_uses_json_mode(self):
+        provider = OpenAIProvider(api_key="test_key", options=self.options(Provider.OPENAI, "gpt-4"))
+        assert provider.stream_request("prompt", self.INPUT, 100)["response_format"] == {"type": "json_object"}
+
+        provider.options.model = "gpt-4o"
+        provider.options.structured_output = False
+        assert provider.stream_request("prompt", self.INPUT, 100)["response_format"] == {"type": "json_object"}
+
+    def test_claude_tool_use(self):
+        provider = ClaudeProvider(api_key="test_key", options=self.options(Provider.CLAUDE, "claude-sonnet-4-5-20250929"))
+        paragraphs = {"paragraphs": [
+            {"id": 1, "original_paragraph": "שלום", "references": {"English": "Hello"}, "translation": "Привет"}
+        ]}
+        response = json.dumps(paragraphs, ensure_ascii=False)
+
+        def event(event_type, delta_type="input_json_delta", partial_json=""):
+            return MagicMock(type=event_type, delta=MagicMock(type=delta_type, partial_json=partial_json))
+
+        with patch.object(provider, "client") as client:
+            stream = client.messages.stream.return_value.__enter__.return_value
+            stream.__iter__.return_value = iter([
+                event("content_block_start"),
+                event("content_block_delta", partial_json=response[:20]),
+                event("content_block_delta", partial_json=response[20:]),
+                event("content_block_stop"),
+            ])
+            stream.get_final_message.return_value = MagicMock(stop_reason="tool_use")
+            result = provider.send_for_translation("prompt", self.INPUT, 100)
+
+        request = client.messages.stream.call_args.kwargs
+        assert request["tool_choice"] == {"type": "tool", "name": "submit_translation"}
+        assert request["tools"][0]["input_schema"] == get_response_schema(["English"])
+        assert result == paragraphs["paragraphs"]
+
+    def test_claude_bulk_result_from_tool_input(self):
+        provider = ClaudeProvider(api_key="test_key", options=self.options(Provider.CLAUDE, "claude-sonnet-4-5-20250929"))
+        tool_use = MagicMock(type="tool_use", input={"paragraphs": []})
+        tool_use.name = "submit_translation"
+
+        assert provider.get_message_text(MagicMock(content=[tool_use])) == '{"paragraphs": []}'
+
+
+class TestLeanResponse:
+    """Lean responses leave out the echoed original paragraphs"""
+
+    def test_lean_task_prompt(self):
+        task_prompt = get_task_prompt("he", ["en"], "ru")
+        lean = get_lean_task_prompt(task_prompt)
+
+        assert "original_paragraph" in task_prompt
+        assert "original_paragraph" not in lean
+        assert '2. NO ECHO: Do not repeat the original paragraph, its "id" identifies it.' in lean
+        assert get_lean_task_prompt("Translate to Russian.") == "Translate to Russian."
+        assert "original_paragraph" not in get_response_schema(["English"], lean=True)["properties"]["paragraphs"]["items"]["required"]
+
+    def test_originals_are_filled_in(self, translation_provider):
+        """The lean prompt is sent and original_paragraph comes from the request"""
+        translation_provider.options.lean_response = True
+        task_prompts = []
+
+        def lean_stream(task_prompt, input_text, max_output_tokens):
+            task_prompts.append(task_prompt)
+            paragraphs = fake_send_for_translation(task_prompt, input_text, max_output_tokens)
+            for para in paragraphs:
+                del para["original_paragraph"]
+            yield json.dumps({"paragraphs": paragraphs})
+
+        task_prompt = get_task_prompt("he", [], "ru")
+        input_text = format_input("he", ["p1 one", "p2 two"], [], [], "ru")
+        with patch.object(translation_provider, "stream_translation_text", side_effect=lean_stream):
+            paragraphs = translation_provider.send_for_translation(task_prompt, input_text, 100)
+
+        assert task_prompts == [get_lean_task_prompt(task_prompt)]
+        assert [para["original_paragraph"] for para in paragraphs] == ["p1 one", "p2 two"]
+        assert [para["translation"] for para in paragraphs] == ["T:p1 one", "T:p2 two"]
+
+    def test_output_estimate(self, translation_provider):
+        """Lean responses are estimated without the echo, so batches hold more paragraphs"""
+        paragraphs = [f"p{i} " + create_paragraph(30) for i in range(200)]
+        full_multiplier = translation_provider.get_output_multiplier(1)
+        full_batch = BatchPlanner(translation_provider, "prompt", paragraphs).plan(0)
+
+        translation_provider.options.lean_response = True
+        lean_batch = BatchPlanner(translation_provider, "prompt", paragraphs).plan(0)
+
+        assert translation_provider.get_output_multiplier(1) == pytest.approx(full_multiplier - 1)
+        assert len(lean_batch["paragraphs"]) > len(full_batch["paragraphs"])
+
+
+class TestCompactInput:
+    """Compact input numbers paragraphs as "N|text" lines instead of tagging them"""
+
+    def test_format_and_parse(self):
+        paragraphs = ["שלום", "עולם\nשני", "3|x"]
+        input_text = format_input("he", paragraphs, ["en"], ["Hello world"], "ru", compact=True)
+
+        assert "<p id=" not in input_text
+        assert "1|שלום\n2|עולם\nשני\n3|3|x\n" in input_text
+        assert get_input_paragraphs(input_text) == {1: "שלום", 2: "עולם\nשני", 3: "3|x"}
+        assert get_input_reference_languages(input_text) == ["English"]
+
+    def test_compact_task_prompt(self):
+        compact = get_compact_task_prompt(get_task_prompt("he", [], "ar"))
+
+        assert "<p" not in compact
+        assert '"N|text"' in compact
+        assert "1|שלום\n2|עולם\n3|בדיקה" in compact
+
+    def test_requests_use_compact_input(self, translation_provider):
+        """The compact prompt and input are sent, and counted with the smaller per-paragraph overhead"""
+        paragraphs = [f"p{i} " + create_paragraph(5) for i in range(20)]
+        task_prompt = get_task_prompt("he", [], "ru")
+        tagged_tokens = translation_provider.calculate_input_tokens(task_prompt, paragraphs)
+        translation_provider.options.compact_input = True
+        translation_provider.options.lean_response = True
+        requests = []
+
+        def lean_stream(task_prompt, input_text, max_output_tokens):
+            requests.append((task_prompt, input_text))
+            ids = re.findall(r"^(\d+)\|", input_text, re.MULTILINE)
+            yield json.dumps({"paragraphs": [{"id": int(i), "translation": f"T{i}"} for i in ids]})
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=lean_stream):
+            result = translation_provider.translate_paragraphs("he", paragraphs, [], [], "ru", task_prompt)
+
+        assert translation_provider.calculate_input_tokens(task_prompt, paragraphs) < tagged_tokens
+        assert [task_prompt for task_prompt, _ in requests] == [get_compact_task_prompt(get_lean_task_prompt(task_prompt))]
+        assert get_input_paragraphs(requests[0][1]) == {i + 1: p for i, p in enumerate(paragraphs)}
+        assert result["translated_paragraphs"] == [f"T{i + 1}" for i in range(20)]
+
+
+class TestTaggedOutput:
+    """Id-delimited plain-text responses, parsed while they stream"""
+
+    RESPONSE = (
+        "Here is the translation:\n"
+        "```\n"
+        "@@ 1\n"
+        "@ original\n"
+        'אמר הרמב"ם: "שלום"\n'
+        "@ English\n"
+        'Rambam said: "peace"\n'
+        "@ translation\n"
+        'Рамбам сказал: "мир"\n'
+        "и ушел\n"
+        "@@ 2\n"
+        "@ original\n"
+        "עולם\n"
+        "@ English\n"
+        "\n"
+        "@ translation\n"
+        "мир\n"
+        "```"
+    )
+
+    PARAGRAPHS = [
+        {
+            "id": 1,
+            "original_paragraph": 'אמר הרמב"ם: "שלום"',
+            "references": {"English": 'Rambam said: "peace"'},
+            "translation": 'Рамбам сказал: "мир"\nи ушел',
+        },
+        {"id": 2, "original_paragraph": "עולם", "references": {"English": ""}, "translation": "мир"},
+    ]
+
+    @pytest.mark.parametrize("chunk_size", [1, 5, 10000])
+    def test_parser(self, chunk_size):
+        """Quotes need no escaping, a paragraph completes when the next one starts"""
+        parser = TaggedStreamParser(["English"])
+        completed = []
+        for i in range(0, len(self.RESPONSE), chunk_size):
+            completed.append(parser.feed(self.RESPONSE[i:i + chunk_size]))
+        last = parser.finish()
+
+        assert [para for chunk in completed for para in chunk] == self.PARAGRAPHS[:1]
+        assert last == self.PARAGRAPHS[1:]
+
+    def test_tagged_task_prompt(self):
+        tagged = get_tagged_task_prompt(get_task_prompt("he", ["en"], "ru"))
+
+        assert '"paragraphs"' not in tagged
+        assert "@@ <number matching p id>\n@ original\n<exact text from original source>\n@ English\n" in tagged
+        assert "EXAMPLE OUTPUT:\n@@ 1\n@ original\nשלום\n@ English\nHello\n@ Spanish\nHola\n@ translation\nمرحبا" in tagged
+        assert get_tagged_task_prompt("Translate.").startswith("Translate.\n\nOUTPUT FORMAT")
+
+    def test_translation(self, translation_provider):
+        """The tagged prompt is sent and the streamed blocks parsed"""
+        translation_provider.options.output_format = OutputFormat.TAGGED
+        task_prompt = get_task_prompt("he", ["en"], "ru")
+        task_prompts = []
+
+        def tagged_stream(task_prompt, input_text, max_output_tokens):
+            task_prompts.append(task_prompt)
+            for i in range(0, len(self.RESPONSE), 7):
+                yield self.RESPONSE[i:i + 7]
+
+        with patch.object(translation_provider, "stream_translation_text", side_effect=tagged_stream):
+            paragraphs = translation_provider.send_for_translation(
+                task_prompt, format_input("he", ['אמר הרמב"ם: "שלום"', "עולם"], ["en"], ["Rambam said"], "ru"), 100
+            )
+
+        assert task_prompts == [get_tagged_task_prompt(task_prompt)]
+        assert paragraphs == self.PARAGRAPHS
+        assert translation_provider.parse_translation_text(self.RESPONSE, reference_languages=["English"]) == self.PARAGRAPHS
+
+    @pytest.mark.parametrize("chunk_size", [1, 10000])
+    def test_marker_like_text_is_kept(self, chunk_size):
+        """Lines of text that look like section headers or code fences stay in the translation"""
+        translation = "@ all: see the example\n```python\nprint(1)\n```\n@ Spanish is not a section here"
+        response = (
+            "```text\n"
+            "@@ 1\n"
+            "@ english\n"
+            "@ mention\n"
+            "@ translation\n"
+            f"{translation}\n"
+            "@@ 2\n"
+            "@ translation\n"
+            "мир\n"
+            "```\n"
+        )
+        parser = TaggedStreamParser(["English"])
+        paragraphs = []
+        for i in range(0, len(response), chunk_size):
+            paragraphs.extend(parser.feed(response[i:i + chunk_size]))
+        paragraphs.extend(parser.finish())
+
+        assert paragraphs == [
+            {"id": 1, "references": {"English": "@ mention"}, "translation": translation},
+            {"id": 2, "references": {}, "translation": "мир"},
+        ]
+
+    def test_model_default(self):
+        """Models select the format in their model list, requests can override it"""
+        provider = OpenAIProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="gpt-4o", provider=Provider.OPENAI, temperature=0.2, tpm_limit=30000, structured_output=True,
+        ))
+        model = next(model for model in OPENAI_MODELS if model["value"] == "gpt-4o")
+
+        assert provider.get_output_format() == OutputFormat.JSON
+        with patch.dict(model, {"output_format": "tagged"}):
+            assert provider.get_output_format() == OutputFormat.TAGGED
+            assert provider.get_response_format("input") == {"type": "text"}
+            provider.options.output_format = OutputFormat.JSON
+            assert provider.get_output_format() == OutputFormat.JSON
+
+    def test_claude_tagged_is_plain_text(self):
+        """Structured output does not apply to tagged responses"""
+        provider = ClaudeProvider(api_key="test_key", options=TranslationServiceOptions(
+            model="claude-sonnet-4-5-20250929", provider=Provider.CLAUDE, temperature=0.2, tpm_limit=30000,
+            structured_output=True, output_format=OutputFormat.TAGGED,
+        ))
+
+        assert "tools" not in provider.stream_request("prompt", "input", 100)
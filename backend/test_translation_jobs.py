@@ -0,0 +1,263 @@
+"""
+API-level integration tests for background translation jobs
+"""
+import json
+import re
+from unittest.mock import patch
+
+import pytest
+
+import server
+from services import job_service
+from services.base_provider import TruncatedResponseError
+from services.openai_provider import OpenAIProvider
+
+
+def fake_send_for_translation(self, task_prompt, input_text, max_output_tokens):
+    """Echo translation: 'T:' + paragraph, each reference source gives 'R:' + paragraph"""
+    languages = re.findall(r'<text language="([^"]+)">', input_text)
+    return [
+        {
+            "id": int(para_id),
+            "original_paragraph": text,
+            "references": {language: f"R:{text}" for language in languages},
+            "translation": f"T:{text}",
+        }
+        for para_id, text in re.findall(r'<p id="(\d+)">(.*?)</p>', input_text, re.DOTALL)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def no_job_workers(monkeypatch):
+    """Run jobs explicitly with job_service.run_next_job instead of background threads"""
+    monkeypatch.setattr(server, "TRANSLATION_JOB_WORKERS", 0)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+
+
+def create_source(client, name, language):
+    response = client.post("/sources", json={"name": name, "language": language})
+    assert response.status_code == 200
+    return response.json()[0]["id"]
+
+
+def create_segments(client, source_id, texts, first_order=1):
+    response = client.post("/segments", json={"segments": [
+        {"text": text, "source_id": source_id, "order": first_order + i, "properties": {}}
+        for i, text in enumerate(texts)
+    ]})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_job_translates_and_reports_progress(client, test_db):
+    response = client.post("/translate/jobs", json={
+        "paragraphs": ["first", "second"],
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": [],
+        "additional_sources_texts": [],
+    })
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "queued"
+    assert job["total_paragraphs"] == 2
+
+    with patch.object(OpenAIProvider, "send_for_translation", fake_send_for_translation):
+        assert job_service.run_next_job(server.create_provider_for_request)
+    assert not job_service.run_next_job(server.create_provider_for_request)
+
+    response = client.get(f"/translate/jobs/{job['id']}")
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "done"
+    assert job["translated_paragraphs"] == 2
+    assert job["batches_done"] == 1
+    assert job["result"]["translated_paragraphs"] == ["T:first", "T:second"]
+    assert job["result"]["total_segments_translated"] == 2
+    assert job["error"] is None
+
+
+def test_job_stores_translated_segments(client, test_db):
+    original_source_id = create_source(client, "Original", "he")
+    reference_source_id = create_source(client, "Reference", "ru")
+    translated_source_id = create_source(client, "Translated", "en")
+    original_segments = create_segments(client, original_source_id, ["first", "second"])
+    reference_segments = create_segments(client, reference_source_id, ["whole reference text"])
+
+    response = client.post("/translate/jobs", json={
+        "paragraphs": ["first", "second"],
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": ["ru"],
+        "additional_sources_texts": ["whole reference text"],
+        "translated_source_id": translated_source_id,
+        "original_segments": [
+            {"id": s["id"], "timestamp": s["timestamp"], "order": s["order"]} for s in original_segments
+        ],
+        "additional_sources_segments": [
+            {"id": s["id"], "timestamp": s["timestamp"], "source_id": reference_source_id, "properties": {}}
+            for s in reference_segments
+        ],
+        "segment_properties": {"dictionary_id": 7},
+    })
+    assert response.status_code == 200
+    job_id = response.json()["id"]
+
+    with patch.object(OpenAIProvider, "send_for_translation", fake_send_for_translation):
+        assert job_service.run_next_job(server.create_provider_for_request)
+
+    job = client.get(f"/translate/jobs/{job_id}").json()
+    assert job["status"] == "done"
+
+    translated = client.post("/segments", json={"source_ids": [translated_source_id]}).json()
+    assert [s["text"] for s in sorted(translated, key=lambda s: s["order"])] == ["T:first", "T:second"]
+    assert translated[0]["properties"]["dictionary_id"] == 7
+    assert translated[0]["properties"]["translation"]["provider"] == "openai"
+
+    references = client.post("/segments", json={"source_ids": [reference_source_id]}).json()
+    by_order = {s["order"]: s["text"] for s in references}
+    assert by_order[1] == "R:first"
+    assert by_order[2] == "R:second"
+    # New rest of text segment right after the batch
+    assert 3 in by_order
+
+
+def test_retried_job_stores_each_segment_once(client, test_db):
+    """A job retrying a failed one resumes from its checkpoint without storing its batches again"""
+    texts = ["first", "second", "third"]
+    original_source_id = create_source(client, "Original", "he")
+    reference_source_id = create_source(client, "Reference", "ru")
+    translated_source_id = create_source(client, "Translated", "en")
+    original_segments = create_segments(client, original_source_id, texts)
+    reference_segments = create_segments(client, reference_source_id, ["whole reference text"])
+    request = {
+        "paragraphs": texts,
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": ["ru"],
+        "additional_sources_texts": ["whole reference text"],
+        "translated_source_id": translated_source_id,
+        "original_segments": [
+            {"id": s["id"], "timestamp": s["timestamp"], "order": s["order"]} for s in original_segments
+        ],
+        "additional_sources_segments": [
+            {"id": s["id"], "timestamp": s["timestamp"], "source_id": reference_source_id, "properties": {}}
+            for s in reference_segments
+        ],
+    }
+
+    def send_one_by_one(self, task_prompt, input_text, max_output_tokens):
+        """Batches of several paragraphs are truncated, the last paragraph fails"""
+        if input_text.count('<p id="') > 1:
+            raise TruncatedResponseError("Translation response was truncated due to max_tokens limit.")
+        if "third" in input_text:
+            raise ValueError("OpenAI API error: boom")
+        return fake_send_for_translation(self, task_prompt, input_text, max_output_tokens)
+
+    failed_id = client.post("/translate/jobs", json=request).json()["id"]
+    with patch.object(OpenAIProvider, "send_for_translation", send_one_by_one):
+        assert job_service.run_next_job(server.create_provider_for_request)
+    assert client.get(f"/translate/jobs/{failed_id}").json()["status"] == "failed"
+
+    job_id = client.post("/translate/jobs", json=request).json()["id"]
+    with patch.object(OpenAIProvider, "send_for_translation", fake_send_for_translation):
+        assert job_service.run_next_job(server.create_provider_for_request)
+
+    job = client.get(f"/translate/jobs/{job_id}").json()
+    assert job["status"] == "done"
+    assert job["result"]["translated_paragraphs"] == ["T:first", "T:second", "T:third"]
+
+    translated = client.post("/segments", json={"source_ids": [translated_source_id]}).json()
+    assert sorted((s["order"], s["text"]) for s in translated) == [(1, "T:first"), (2, "T:second"), (3, "T:third")]
+    references = client.post("/segments", json={"source_ids": [reference_source_id]}).json()
+    assert sorted(s["text"] for s in references if s["text"].startswith("R:")) == ["R:first", "R:second", "R:third"]
+
+
+def test_failed_job_reports_error(client, test_db):
+    response = client.post("/translate/jobs", json={
+        "paragraphs": ["first"],
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": [],
+        "additional_sources_texts": [],
+    })
+    job_id = response.json()["id"]
+
+    with patch.object(OpenAIProvider, "send_for_translation", side_effect=ValueError("OpenAI API error: boom")):
+        assert job_service.run_next_job(server.create_provider_for_request)
+
+    job = client.get(f"/translate/jobs/{job_id}").json()
+    assert job["status"] == "failed"
+    assert "boom" in job["error"]
+    assert job["finished_at"] is not None
+
+
+def test_bulk_job_waits_for_provider_batch(client, test_db, monkeypatch):
+    response = client.post("/translate/jobs", json={
+        "paragraphs": ["first", "second"],
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": [],
+        "additional_sources_texts": [],
+        "bulk": True,
+    })
+    job_id = response.json()["id"]
+
+    submitted = []
+
+    def submit_bulk_requests(self, requests):
+        submitted.extend(requests)
+        return "batch_1"
+
+    with patch.object(OpenAIProvider, "submit_bulk_requests", submit_bulk_requests):
+        assert job_service.run_next_job(server.create_provider_for_request)
+
+    job = client.get(f"/translate/jobs/{job_id}").json()
+    assert job["status"] == "submitted"
+    assert job["provider_batch_id"] == "batch_1"
+    assert "bulk_state" not in job
+    assert len(submitted) == 1
+
+    # Not due for a check yet
+    assert not job_service.run_next_job(server.create_provider_for_request)
+
+    monkeypatch.setattr(job_service, "BULK_POLL_SECONDS", 0)
+    results = {
+        request["custom_id"]: {
+            "text": json.dumps({"paragraphs": fake_send_for_translation(None, "", request["input_text"], 0)}),
+            "truncated": False,
+            "error": None,
+            "usage": {"input_tokens": 10, "output_tokens": 5},
+        }
+        for request in submitted
+    }
+    with patch.object(OpenAIProvider, "get_bulk_results", return_value=None):
+        assert job_service.run_next_job(server.create_provider_for_request)
+    assert client.get(f"/translate/jobs/{job_id}").json()["status"] == "submitted"
+
+    with patch.object(OpenAIProvider, "get_bulk_results", return_value=results):
+        assert job_service.run_next_job(server.create_provider_for_request)
+
+    job = client.get(f"/translate/jobs/{job_id}").json()
+    assert job["status"] == "done"
+    assert job["translated_paragraphs"] == 2
+    assert job["input_tokens"] == 10
+    assert job["result"]["translated_paragraphs"] == ["T:first", "T:second"]
+
+
+def test_job_segments_must_match_paragraphs(client, test_db):
+    response = client.post("/translate/jobs", json={
+        "paragraphs": ["first", "second"],
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": [],
+        "additional_sources_texts": [],
+        "translated_source_id": 1,
+        "original_segments": [{"id": 1, "timestamp": 0, "order": 1}],
+    })
+    assert response.status_code == 400
+
+
+def test_unknown_job_returns_404(client, test_db):
+    response = client.get("/translate/jobs/12345")
+    assert response.status_code == 404
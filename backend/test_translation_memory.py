@@ -0,0 +1,231 @@
+"""
+API-level integration tests for the translation memory (exact and similar matches)
+"""
+import json
+import re
+from unittest.mock import patch
+
+import pytest
+
+import server
+from services import job_service
+from services.openai_provider import OpenAIProvider
+
+
+def echo_translation(input_text):
+    """Echo translation: 'T:' + paragraph"""
+    return [
+        {"id": int(para_id), "original_paragraph": text, "references": {}, "translation": f"T:{text}"}
+        for para_id, text in re.findall(r'<p id="(\d+)">(.*?)</p>', input_text, re.DOTALL)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def no_job_workers(monkeypatch):
+    monkeypatch.setattr(server, "TRANSLATION_JOB_WORKERS", 0)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+
+
+@pytest.fixture
+def sent_inputs():
+    """Patch the provider with the echo translation, collect the input of every request"""
+    inputs = []
+
+    def send_for_translation(self, task_prompt, input_text, max_output_tokens):
+        inputs.append(input_text)
+        return echo_translation(input_text)
+
+    async def asend_for_translation(self, task_prompt, input_text, max_output_tokens):
+        inputs.append(input_text)
+        return echo_translation(input_text)
+
+    async def astream_for_translation(self, task_prompt, input_text, max_output_tokens):
+        inputs.append(input_text)
+        for para in echo_translation(input_text):
+            yield para
+
+    with patch.object(OpenAIProvider, "send_for_translation", send_for_translation), \
+            patch.object(OpenAIProvider, "asend_for_translation", asend_for_translation), \
+            patch.object(OpenAIProvider, "astream_for_translation", astream_for_translation):
+        yield inputs
+
+
+def create_source(client, name, language):
+    response = client.post("/sources", json={"name": name, "language": language})
+    assert response.status_code == 200
+    return response.json()[0]["id"]
+
+
+def store_translation(client, paragraphs):
+    """Translate paragraphs he -> en with a job that stores linked segments, return the translated source"""
+    original_source_id = create_source(client, "Original", "he")
+    translated_source_id = create_source(client, "Translated", "en")
+    original_segments = client.post("/segments", json={"segments": [
+        {"text": text, "source_id": original_source_id, "order": i + 1, "properties": {}}
+        for i, text in enumerate(paragraphs)
+    ]}).json()
+
+    response = client.post("/translate/jobs", json={
+        "paragraphs": paragraphs,
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": [],
+        "additional_sources_texts": [],
+        "translated_source_id": translated_source_id,
+        "original_segments": [
+            {"id": s["id"], "timestamp": s["timestamp"], "order": s["order"]} for s in original_segments
+        ],
+    })
+    assert response.status_code == 200
+    assert job_service.run_next_job(server.create_provider_for_request)
+    return translated_source_id
+
+
+def translate_request(paragraphs, **kwargs):
+    return {
+        "paragraphs": paragraphs,
+        "original_language": "he",
+        "translate_language": "en",
+        "additional_sources_languages": [],
+        "additional_sources_texts": [],
+        **kwargs,
+    }
+
+
+def test_translated_paragraphs_are_not_sent_again(client, test_db, sent_inputs):
+    store_translation(client, ["first", "second"])
+    sent_inputs.clear()
+
+    response = client.post("/translate", json=translate_request(["second", "third", "first"]))
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["translated_paragraphs"] == ["T:second", "T:third", "T:first"]
+    assert result["properties"]["translation_memory_hits"] == 2
+    assert len(sent_inputs) == 1
+    assert "third" in sent_inputs[0]
+    assert "first" not in sent_inputs[0]
+
+
+def test_latest_version_of_translation_is_reused(client, test_db, sent_inputs):
+    translated_source_id = store_translation(client, ["first"])
+    translated = client.post("/segments", json={"source_ids": [translated_source_id]}).json()[0]
+    client.post("/segments", json={"segments": [{
+        "id": translated["id"],
+        "text": "Corrected first",
+        "source_id": translated_source_id,
+        "order": translated["order"],
+        "properties": translated["properties"],
+    }]})
+    sent_inputs.clear()
+
+    result = client.post("/translate", json=translate_request(["first"])).json()
+
+    assert result["translated_paragraphs"] == ["Corrected first"]
+    assert not sent_inputs
+
+
+def test_edited_translation_is_reused(client, test_db, sent_inputs):
+    """Edits saved by the frontend carry no translation properties, the edited text is still reused"""
+    translated_source_id = store_translation(client, ["first"])
+    translated = client.post("/segments", json={"source_ids": [translated_source_id]}).json()[0]
+    client.post("/segments", json={"segments": [{
+        "id": translated["id"],
+        "text": "Edited first",
+        "source_id": translated_source_id,
+        "order": translated["order"],
+        "properties": {"segment_type": "edited"},
+    }]})
+    sent_inputs.clear()
+
+    result = client.post("/translate", json=translate_request(["first"])).json()
+    custom = client.post("/translate", json=translate_request(["first"], task_prompt="Custom prompt")).json()
+
+    assert result["translated_paragraphs"] == ["Edited first"]
+    assert result["properties"]["translation_memory_hits"] == 1
+    assert custom["properties"]["translation_memory_hits"] == 0
+    assert len(sent_inputs) == 1
+
+
+def test_other_prompt_or_language_is_not_reused(client, test_db, sent_inputs):
+    store_translation(client, ["first"])
+    sent_inputs.clear()
+
+    custom = client.post("/translate", json=translate_request(["first"], task_prompt="Custom prompt")).json()
+    other_language = client.post("/translate", json=translate_request(["first"], translate_language="ru")).json()
+
+    assert custom["properties"]["translation_memory_hits"] == 0
+    assert other_language["properties"]["translation_memory_hits"] == 0
+    assert len(sent_inputs) == 2
+
+
+def test_translation_memory_can_be_disabled(client, test_db, sent_inputs):
+    store_translation(client, ["first"])
+    sent_inputs.clear()
+
+    result = client.post("/translate", json=translate_request(["first"], use_translation_memory=False)).json()
+
+    assert result["translated_paragraphs"] == ["T:first"]
+    assert len(sent_inputs) == 1
+
+
+def test_stream_sends_memory_hits_first(client, test_db, sent_inputs):
+    store_translation(client, ["first"])
+    sent_inputs.clear()
+
+    response = client.post("/translate/stream", json=translate_request(["new", "first"]))
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [(line["index"], line["translated_paragraph"]) for line in lines[:-1]] == [(1, "T:first"), (0, "T:new")]
+    assert lines[-1]["type"] == "done"
+    assert lines[-1]["properties"]["translation_memory_hits"] == 1
+    assert len(sent_inputs) == 1
+
+
+def similar_request(texts, **kwargs):
+    return {"texts": texts, "original_language": "he", "translate_language": "en", **kwargs}
+
+
+def test_similar_translations(client, test_db, sent_inputs):
+    store_translation(client, [
+        "The quick brown fox jumps over the lazy dog",
+        "The quick brown fox jumps over the lazy cat",
+        "Something entirely different",
+    ])
+
+    response = client.post("/translation-memory/similar", json=similar_request(
+        ["The quick brown fox jumped over the lazy dog", "Nothing like it"], limit=1,
+    ))
+
+    assert response.status_code == 200
+    [matches, no_matches] = response.json()
+    assert [match["original_text"] for match in matches] == ["The quick brown fox jumps over the lazy dog"]
+    assert matches[0]["translation"] == "T:The quick brown fox jumps over the lazy dog"
+    assert 0.5 <= matches[0]["similarity"] < 1
+    assert no_matches == []
+
+
+def test_similar_translations_are_ordered_and_filtered_by_language(client, test_db, sent_inputs):
+    store_translation(client, [
+        "The quick brown fox jumps over the lazy dog",
+        "The quick brown fox jumps over a lazy cat",
+    ])
+
+    [matches] = client.post("/translation-memory/similar", json=similar_request(
+        ["The quick brown fox jumps over the lazy dog"],
+    )).json()
+    [other_language] = client.post("/translation-memory/similar", json=similar_request(
+        ["The quick brown fox jumps over the lazy dog"], translate_language="ru",
+    )).json()
+
+    assert [match["original_text"] for match in matches] == [
+        "The quick brown fox jumps over the lazy dog",
+        "The quick brown fox jumps over a lazy cat",
+    ]
+    assert matches[0]["similarity"] == 1
+    assert other_language == []
+
+
+def test_similar_translations_validates_request(client, test_db):
+    response = client.post("/translation-memory/similar", json=similar_request(["text"], limit=0))
+    assert response.status_code == 400